@@ -1,3 +1,3 @@
 from .base_index import AbstractIndex
-from .limiter import ElasticsearchPaginator, QueryLimitParams
+from .limiter import CursorError, ElasticsearchPaginator, QueryLimitParams
 from .register import IndexRegister
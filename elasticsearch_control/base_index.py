@@ -115,6 +115,8 @@ class AbstractIndex(metaclass=MetaIndex):
         index_name: str
         settings: dict[str, Any]
         extra_field_props: dict[str, dict[str, Any]] = {}
+        # Поля, которые не нужно возвращать из `_source` при чтении документов (например, векторы).
+        source_excludes: list[str] = []
 
         # Создается автоматически, не трогать
         mappings: dict[str, dict[str, Any]]
@@ -0,0 +1,123 @@
+from typing import Iterable, Iterator
+
+from elasticsearch import Elasticsearch, helpers
+
+
+def source_filter(
+    source: list[str] | bool | None, excludes: list[str] | None
+) -> list[str] | bool | dict | None:
+    """
+    Фильтр `_source` для тела поиска.
+
+    Исключения нельзя передавать параметром URL `_source_excludes` вместе с `_source` в теле:
+    фильтр из параметров URL заменяет фильтр из тела, и тогда возвращаются все поля, кроме исключенных.
+    """
+    if not excludes or source is False:
+        return source
+    if isinstance(source, list):
+        return {"includes": source, "excludes": excludes}
+    return {"excludes": excludes}
+
+
+def bulk_write(
+    es: Elasticsearch,
+    actions: Iterable[dict],
+    chunk_size: int = 500,
+    thread_count: int = 4,
+    request_timeout: int = 30,
+) -> tuple[int, list[dict]]:
+    """
+    Записывает действия через `_bulk` API, отправляя пачки `chunk_size` параллельно в `thread_count` потоков.
+
+    :param es: Объект Elasticsearch.
+    :param actions: Действия в формате `elasticsearch.helpers` (`_op_type`, `_index`, `_id`, ...).
+    :param chunk_size: Кол-во действий в одном запросе `_bulk`.
+    :param thread_count: Кол-во одновременно отправляемых запросов.
+    :param request_timeout: Таймаут одного запроса `_bulk`.
+    :return: Кол-во успешно выполненных действий и список ошибок.
+    """
+    success = 0
+    errors: list[dict] = []
+    for ok, item in helpers.parallel_bulk(
+        es,
+        actions,
+        thread_count=thread_count,
+        chunk_size=chunk_size,
+        raise_on_error=False,
+        raise_on_exception=False,
+        request_timeout=request_timeout,
+    ):
+        if ok:
+            success += 1
+        else:
+            errors.append(item)
+    return success, errors
+
+
+def iter_hit_batches(
+    es: Elasticsearch,
+    index: str,
+    *,
+    sort: list[dict],
+    query: dict | None = None,
+    size: int = 500,
+    search_after: list | None = None,
+    source: list[str] | bool = True,
+    source_excludes: list[str] | None = None,
+    request_timeout: int = 30,
+    pit_keep_alive: str | None = None,
+) -> Iterator[list[dict]]:
+    """
+    Постранично выдает все документы индекса через `search_after`.
+
+    Сортировка должна однозначно упорядочивать документы (последним полем идет уникальное значение),
+    тогда значения `sort` последнего документа пачки можно сохранить и продолжить чтение с них позже,
+    в том числе в другом процессе.
+
+    Если указан `pit_keep_alive`, то чтение идет внутри point-in-time, и записи, которые меняются
+    во время чтения, не сдвигают документы между пачками. Значения `sort` не зависят от point-in-time,
+    поэтому чтение можно продолжить и в новом point-in-time.
+
+    :param es: Объект Elasticsearch.
+    :param index: Название индекса.
+    :param sort: Сортировка, например `[{"published_at": "asc"}, {"_id": "asc"}]`.
+    :param query: Запрос, по умолчанию все документы.
+    :param size: Размер одной пачки.
+    :param search_after: Значения сортировки, после которых нужно начать чтение.
+    :param source: Какие поля `_source` возвращать.
+    :param source_excludes: Какие поля `_source` не возвращать.
+    :param request_timeout: Таймаут одного запроса.
+    :param pit_keep_alive: Сколько point-in-time живет между запросами пачек, `None` - без point-in-time.
+    :return: Итератор пачек документов, у каждого документа есть значения `sort`.
+    """
+    pit_id = None
+    if pit_keep_alive:
+        pit_id = es.open_point_in_time(
+            index=index, keep_alive=pit_keep_alive, request_timeout=request_timeout
+        )["id"]
+    try:
+        while True:
+            res = es.search(
+                # Внутри point-in-time индекс указывать нельзя, он уже зафиксирован в снимке.
+                index=None if pit_id else index,
+                pit={"id": pit_id, "keep_alive": pit_keep_alive} if pit_id else None,
+                query=query or {"match_all": {}},
+                sort=sort,
+                size=size,
+                search_after=search_after,
+                _source=source_filter(source, source_excludes),
+                track_total_hits=False,
+                request_timeout=request_timeout,
+            )
+            # Elasticsearch может вернуть обновленный идентификатор point-in-time.
+            pit_id = res.get("pit_id", pit_id)
+            hits = res["hits"]["hits"]
+            if not hits:
+                return
+            yield hits
+            if len(hits) < size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        if pit_id:
+            es.close_point_in_time(body={"id": pit_id}, ignore=404)
@@ -1,24 +1,192 @@
+import hashlib
+import json
+import logging
+import math
+import pickle
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Any
 
 from django.core.cache import cache
+from django.db import close_old_connections
+
+# Сколько секунд держится блокировка пересчета значения, если процесс, который её взял, завис или упал.
+_lock_timeout = 30
+# Сколько ждать значение, которое в этот момент вычисляет другой процесс, и как часто его проверять.
+_lock_wait = 5.0
+_lock_poll_interval = 0.05
+# Фоновые обновления устаревших значений выполняются общим ограниченным пулом потоков,
+# а не отдельным потоком на каждый ключ.
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+
+logger = logging.getLogger(__name__)
 
 
 def get_or_cache(
-    function: Callable, kwargs: dict, unique_name: str, cache_timeout: int, version: int | None = None
+    function: Callable,
+    kwargs: dict,
+    unique_name: str,
+    cache_timeout: int | Callable[[Any], int | None],
+    version: int | None = None,
+    stale_timeout: int = 60 * 10,
+    beta: float = 1.0,
 ) -> Any:
     """
     Возвращает результат из кэша django в случае нахождения в нем записи по ключу `unique_name`, если нет,
     то будет вызвана функция `function` и в неё будут переданы параметры `kwargs`.
 
+    - Любой результат, в том числе `None` и пустой список, сохраняется в кэше.
+    - Одновременно значение вычисляет только один процесс (блокировка через `cache.add`, в Redis это `SET NX`),
+      остальные дожидаются его результата.
+    - Устаревшее значение (истекло время или изменилась версия) еще `stale_timeout` секунд отдается сразу,
+      а новое значение вычисляется одним процессом в фоне.
+    - Незадолго до истечения времени значение может быть обновлено заранее (вероятностное раннее
+      обновление XFetch), поэтому популярные записи не истекают у всех процессов одновременно.
+
     :param function: Функция для вызова.
     :param kwargs: Параметры функции.
     :param unique_name: Уникальное название для кэша.
-    :param cache_timeout: Время хранения информации в кэше.
-    :param version: Версия кэша.
+    :param cache_timeout: Время хранения информации в кэше, либо функция, которая получает результат
+     и возвращает время его хранения (`None` - не сохранять).
+    :param version: Версия кэша, хранится вместе со значением, значения прошлых версий считаются устаревшими.
+    :param stale_timeout: Сколько секунд после устаревания значение еще можно отдавать, 0 - не отдавать.
+    :param beta: Насколько заранее обновлять значение, 0 - не обновлять заранее.
     """
 
-    result = cache.get(unique_name, default=None, version=version)
-    if not result:
-        result = function(**kwargs)
-        cache.set(unique_name, result, cache_timeout, version=version)
+    envelope: dict | None = cache.get(unique_name)
+    if envelope is not None:
+        if not _is_stale(envelope, version, beta):
+            return envelope["value"]
+        if stale_timeout and envelope["expires_at"] + stale_timeout > time.time():
+            # Отдаем устаревшее значение, а обновляет его только тот, кто получил блокировку.
+            if _acquire_lock(unique_name):
+                _refresh_executor.submit(
+                    _refresh, function, kwargs, unique_name, cache_timeout, version, stale_timeout
+                )
+            return envelope["value"]
+
+    if not _acquire_lock(unique_name):
+        # Значение уже вычисляет другой процесс, ждем его результат.
+        deadline = time.monotonic() + _lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(_lock_poll_interval)
+            envelope = cache.get(unique_name)
+            if envelope is not None and not _is_stale(envelope, version, beta=0):
+                return envelope["value"]
+        # Не дождались, вычисляем сами.
+
+    try:
+        return _compute(function, kwargs, unique_name, cache_timeout, version, stale_timeout)
+    finally:
+        _release_lock(unique_name)
+
+
+def _is_stale(envelope: dict, version: int | None, beta: float) -> bool:
+    if version is not None and (envelope["version"] is None or envelope["version"] < version):
+        return True
+    # XFetch: чем дольше вычисляется значение и чем ближе истечение, тем вероятнее раннее обновление.
+    early = envelope["delta"] * beta * -math.log(1.0 - random.random())
+    return time.time() + early >= envelope["expires_at"]
+
+
+def _compute(function, kwargs, unique_name, cache_timeout, version, stale_timeout) -> Any:
+    start = time.monotonic()
+    result = function(**kwargs)
+    delta = time.monotonic() - start
+
+    timeout = cache_timeout(result) if callable(cache_timeout) else cache_timeout
+    if timeout:
+        envelope = {"value": result, "version": version, "delta": delta, "expires_at": time.time() + timeout}
+        cache.set(unique_name, envelope, timeout + stale_timeout)
     return result
+
+
+def _refresh(function, kwargs, unique_name, cache_timeout, version, stale_timeout) -> None:
+    try:
+        _compute(function, kwargs, unique_name, cache_timeout, version, stale_timeout)
+    except Exception:
+        logger.exception("Не удалось обновить значение кэша `%s`", unique_name)
+    finally:
+        _release_lock(unique_name)
+        # Поток пула живет дольше запроса, поэтому соединения с БД, открытые функцией, закрываем сами.
+        close_old_connections()
+
+
+def _acquire_lock(unique_name: str) -> bool:
+    return cache.add(f"{unique_name}:lock", 1, _lock_timeout)
+
+
+def _release_lock(unique_name: str) -> None:
+    cache.delete(f"{unique_name}:lock")
+
+
+class QueryCache:
+    """
+    Кэш ответов Elasticsearch на поисковые запросы.
+
+    Ключ - отпечаток всех параметров запроса (индекс, запрос, сортировка, страница и т.д.), поэтому
+    одинаковые запросы разных пользователей используют одну запись. Запись действительна только
+    для версии `version`, увеличение версии делает все записи устаревшими. Устаревший ответ еще
+    `stale_timeout` секунд отдается, пока один из процессов обновляет его в фоне, см. `get_or_cache`.
+    """
+
+    # Записи больше этого размера (в байтах) не сохраняются.
+    max_entry_size = 512 * 1024
+    # Записи больше этого размера хранятся меньше времени, пропорционально размеру.
+    large_entry_size = 64 * 1024
+    min_timeout = 30
+    stale_timeout = 60 * 10
+
+    def __init__(self, prefix: str, version: int | None = None, scope: str = "", timeout: int = 60 * 5):
+        """
+        :param prefix: Префикс ключей кэша.
+        :param version: Версия кэша.
+        :param scope: Дополнительная часть ключа, например отпечаток прав пользователя.
+        :param timeout: Время хранения записи в секундах.
+        """
+        self.prefix = prefix
+        self.version = version
+        self.scope = scope
+        self.timeout = timeout
+
+    def make_key(self, params: dict) -> str:
+        """Возвращает ключ кэша для параметров запроса `Elasticsearch.search`."""
+        canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+        return f"{self.prefix}:{self.scope}:{hashlib.sha1(canonical.encode()).hexdigest()}"
+
+    def get_timeout(self, size: int) -> int | None:
+        """
+        Время хранения записи размера `size` байт, либо `None`, если запись не нужно сохранять.
+        Большие записи занимают больше памяти, поэтому хранятся меньше.
+        """
+        if size > self.max_entry_size:
+            return None
+        if size <= self.large_entry_size:
+            return self.timeout
+        return max(self.min_timeout, self.timeout * self.large_entry_size // size)
+
+    def get_or_set(
+        self, params: dict, function: Callable[[], Any], cache_if: Callable[[Any], bool] | None = None
+    ) -> Any:
+        """
+        Возвращает ответ на запрос из кэша, либо вызывает `function` и сохраняет её результат.
+
+        :param params: Параметры запроса, по ним строится ключ.
+        :param function: Функция, которая выполняет запрос.
+        :param cache_if: Функция, которая получает результат и возвращает, нужно ли его сохранять.
+        """
+
+        def get_timeout(result: Any) -> int | None:
+            if cache_if is not None and not cache_if(result):
+                return None
+            return self.get_timeout(len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+
+        return get_or_cache(
+            function=function,
+            kwargs={},
+            unique_name=self.make_key(params),
+            cache_timeout=get_timeout,
+            version=self.version,
+            stale_timeout=self.stale_timeout,
+        )
@@ -5,12 +5,19 @@ from django.http import JsonResponse
 from elasticsearch.exceptions import TransportError
 from rest_framework.request import Request
 
+from .write_block import IndexWriteBlockedError
+
 
 def api_elasticsearch_check_available(func: Callable):
     @wraps(func)
     def wrapper(request: Request, *args, **kwargs):
         try:
             return func(request, *args, **kwargs)
+        except IndexWriteBlockedError as exc:
+            print(exc)
+            return JsonResponse(
+                {"detail": "Записи временно доступны только для чтения, повторите позже"}, status=503
+            )
         except TransportError as exc:
             print(exc)
             return JsonResponse({"detail": "Elasticsearch недоступен"}, status=500)
@@ -1,8 +1,18 @@
+import base64
+import json
 import math
 from dataclasses import dataclass
 from typing import Callable, Literal, Optional
 
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError, RequestError
+
+from .bulk import source_filter
+from .cache import QueryCache
+
+
+class CursorError(ValueError):
+    """Курсор пагинации поврежден или его point-in-time уже истек."""
 
 
 @dataclass
@@ -16,30 +26,101 @@ class QueryLimitParams:
     query: dict
     request_timeout: int
     sort: dict[str, Literal["desc", "asc"]] | None = None
+    # Поля, которые не нужно возвращать из `_source`.
+    source_excludes: list[str] | None = None
+    # Пути ответа, которые нужно оставить, остальное Elasticsearch не будет отправлять.
+    filter_path: list[str] | None = None
+    # Пересчет оценки лучших документов, см. `rescore` в Search API.
+    rescore: dict | None = None
 
     @property
     def to_dict(self) -> dict:
         data = {
             "index": self.index,
-            "_source": self.source,
+            "_source": source_filter(self.source, self.source_excludes),
             "query": self.query,
             "request_timeout": self.request_timeout,
         }
         if self.sort:
             data["sort"] = self.sort
+        if self.filter_path:
+            data["filter_path"] = self.filter_path
+        if self.rescore:
+            data["rescore"] = self.rescore
 
         return data
 
 
+def _pack_cursor(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def _unpack_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        page = payload["page"]
+    except (ValueError, TypeError, KeyError):
+        raise CursorError("Неверный курсор")
+    if not isinstance(page, int) or isinstance(page, bool) or page < 1:
+        raise CursorError("Неверный курсор")
+    return payload
+
+
+def encode_cursor(pit_id: str, search_after: list, page: int) -> str:
+    """
+    Упаковывает идентификатор point-in-time, значения сортировки последней записи
+    и номер следующей страницы в непрозрачную строку.
+    """
+    return _pack_cursor({"pit": pit_id, "after": search_after, "page": page})
+
+
+def decode_cursor(cursor: str) -> tuple[str, list, int]:
+    """
+    Распаковывает курсор, созданный через `encode_cursor`.
+
+    :raises CursorError: Если курсор поврежден или в нем нет идентификатора point-in-time.
+    """
+    payload = _unpack_cursor(cursor)
+    pit_id, search_after = payload.get("pit"), payload.get("after")
+    if not isinstance(pit_id, str) or not pit_id or not isinstance(search_after, list):
+        raise CursorError("Неверный курсор")
+    return pit_id, search_after, payload["page"]
+
+
+def encode_page_cursor(page: int) -> str:
+    """Упаковывает в непрозрачную строку только номер следующей страницы, без point-in-time."""
+    return _pack_cursor({"page": page})
+
+
+def decode_page_cursor(cursor: str) -> int:
+    """
+    Распаковывает курсор, созданный через `encode_page_cursor`.
+
+    :raises CursorError: Если курсор поврежден или создан для point-in-time.
+    """
+    payload = _unpack_cursor(cursor)
+    if payload.keys() != {"page"}:
+        raise CursorError("Неверный курсор")
+    return payload["page"]
+
+
 class ElasticsearchPaginator:
     """
     Класс для пагинации запросов Elasticsearch.
     """
 
     per_page = 24
+    # Сколько будет жить point-in-time между запросами соседних страниц в режиме курсора.
+    pit_keep_alive = "5m"
 
     def __init__(
-        self, es: Elasticsearch, params: QueryLimitParams, convert_result: Optional[Callable] = None, **extra
+        self,
+        es: Elasticsearch,
+        params: QueryLimitParams,
+        convert_result: Optional[Callable] = None,
+        track_total_hits: bool | int | None = None,
+        query_cache: QueryCache | None = None,
+        **extra,
     ):
         """
         Инициализируем пагинатор запросов.
@@ -49,37 +130,73 @@ class ElasticsearchPaginator:
          запроса и таймаут ожидания
         :param convert_result: Функция, которой будет передан ответ от Elasticsearch. Данная функция может
          преобразовать неформатированные полученные данные.
+        :param track_total_hits: Если указан, то кол-во записей не запрашивается отдельным `count`, а берется
+         из ответа того же `search`, которым получены записи (`True` - точное кол-во, число - предел подсчета).
+         Если `None`, то кол-во определяется сразу отдельным запросом `count`.
+        :param query_cache: Кэш ответов на поисковые запросы. Страницы курсора не кэшируются,
+         т.к. каждая из них относится к своему point-in-time.
         :param extra: Дополнительные параметры, которые будут переданы в функцию `convert_result` вместе с ответом
         """
         self._es = es
         self._params = params
+        self._track_total_hits = track_total_hits
+        self._query_cache = query_cache
         self.page = 1
+        # Курсор следующей страницы, заполняется после вызова `get_cursor_page`.
+        self.next_cursor: str | None = None
 
-        if params.query:
+        self._count: int | None = None
+        if not params.query:
+            self._count = 0
+        elif track_total_hits is None:
             # Определяем кол-во записей для текущего запроса
-            self.count = self._es.count(
+            self._count = self._es.count(
                 index=params.index,
                 body={"query": params.query},
                 request_timeout=params.request_timeout,
             )["count"]
-        else:
-            self.count = 0
-
-        self.max_pages = math.ceil(self.count / self.per_page)
 
         self._convert_func = convert_result
         self.extra_parameters = extra
 
+    @property
+    def count(self) -> int:
+        """
+        Кол-во записей для текущего запроса.
+        Если оно еще не известно, то будет выполнен поиск с `size=0`, который только считает записи.
+        """
+        if self._count is None:
+            self._search(size=0)
+        return self._count or 0
+
+    @property
+    def max_pages(self) -> int:
+        return math.ceil(self.count / self.per_page)
+
+    @property
+    def supports_cursor(self) -> bool:
+        """
+        Можно ли получать страницы через `search_after`.
+        Elasticsearch не разрешает сортировку, которая нужна для `search_after`, вместе с `rescore`.
+        """
+        return not self._params.rescore
+
     @property
     def has_previous(self):
         return self.page > 1
 
     @property
     def has_next(self):
+        if self.next_cursor is not None:
+            return True
         return (self.page + 1) <= self.max_pages
 
     def get_limits(self, page_num: int):
         from_ = (page_num - 1) * self.per_page
+        if self._params.rescore:
+            # Записи за пределами окна пересчета не пересчитаны и не учитываются в кол-ве,
+            # поэтому последняя страница заканчивается на границе окна.
+            return from_, max(0, min(self.per_page, self._params.rescore["window_size"] - from_))
         return from_, self.per_page
 
     def get_page(self, page: str | int | float) -> list:
@@ -89,17 +206,118 @@ class ElasticsearchPaginator:
         :param page: Номер страницы.
         :return: Список найденных данных.
         """
+        if self._count is None:
+            # Кол-во записей еще неизвестно, получим его вместе с самими записями.
+            self.page = self.validate_number(page, check_max=False)
+            res = self._search(**self._limits_kwargs(self.page))
+            if self.page > self.max_pages > 0:
+                # Страница оказалась за пределами результатов, возвращаем последнюю.
+                self.page = self.max_pages
+                res = self._search(**self._limits_kwargs(self.page))
+            return self._convert(res)
+
         self.page = self.validate_number(page)
-        if not self.count:
+        if not self._count:
             return []
-        query_from, query_size = self.get_limits(self.page)
 
         # Ищем данные по запросу
-        res = self._es.search(
-            **self._params.to_dict,
-            **{"from_": query_from, "size": query_size},
-        )
+        res = self._search(**self._limits_kwargs(self.page))
 
+        return self._convert(res)
+
+    def _limits_kwargs(self, page_num: int) -> dict:
+        query_from, query_size = self.get_limits(page_num)
+        return {"from_": query_from, "size": query_size}
+
+    def _search(self, **kwargs) -> dict:
+        """
+        Выполняет поиск с параметрами запроса и запоминает кол-во записей из ответа,
+        если используется подсчет через `track_total_hits`.
+        """
+        # Параметры со значением `None` не передаются, так их можно убрать из запроса.
+        params = {
+            key: value for key, value in {**self._params.to_dict, **kwargs}.items() if value is not None
+        }
+        if self._track_total_hits is not None:
+            params["track_total_hits"] = self._track_total_hits
+
+        res = self._execute_search(params)
+
+        if self._track_total_hits is not None:
+            total = res.get("hits", {}).get("total") or {}
+            self._count = total.get("value", 0) if isinstance(total, dict) else int(total)
+        return res
+
+    def _execute_search(self, params: dict) -> dict:
+        if self._query_cache is None or "pit" in params:
+            return self._es.search(**params)
+        return self._query_cache.get_or_set(params, lambda: self._es.search(**params))
+
+    def get_cursor_page(self, cursor: str | None) -> list:
+        """
+        Получаем следующую страницу через `search_after` внутри point-in-time.
+
+        В отличие от `get_page` стоимость запроса не зависит от глубины страницы, а снимок индекса
+        не дает параллельным изменениям сдвигать записи между страницами.
+        После вызова в `next_cursor` будет курсор следующей страницы, либо `None`, если страниц больше нет.
+
+        :param cursor: Курсор из `next_cursor` предыдущей страницы, либо пустое значение для первой страницы.
+        :return: Список найденных данных.
+        :raises CursorError: Если курсор поврежден или его point-in-time истек.
+        """
+        self.next_cursor = None
+        if self._count == 0:
+            return []
+        if not self.supports_cursor:
+            return self._get_numbered_cursor_page(cursor)
+
+        if cursor:
+            pit_id, search_after, self.page = decode_cursor(cursor)
+        else:
+            self.page = 1
+            pit_id = self._es.open_point_in_time(
+                index=self._params.index,
+                keep_alive=self.pit_keep_alive,
+                request_timeout=self._params.request_timeout,
+            )["id"]
+            search_after = None
+
+        # `_shard_doc` - уникальный для point-in-time тай-брейкер, без него записи
+        # с одинаковым значением сортировки могут теряться или повторяться на стыке страниц.
+        sort: list = [{field: order} for field, order in (self._params.sort or {}).items()] or ["_score"]
+
+        try:
+            res = self._search(
+                # Внутри point-in-time индекс указывать нельзя, он уже зафиксирован в снимке.
+                index=None,
+                sort=[*sort, {"_shard_doc": "asc"}],
+                pit={"id": pit_id, "keep_alive": self.pit_keep_alive},
+                search_after=search_after,
+                size=self.per_page,
+            )
+        except NotFoundError:
+            raise CursorError("Курсор устарел")
+        except RequestError:
+            # Поврежденный идентификатор point-in-time или значения `search_after` не той формы.
+            raise CursorError("Неверный курсор")
+
+        hits = res.get("hits", {}).get("hits", [])
+        if len(hits) == self.per_page:
+            # Elasticsearch может вернуть обновленный идентификатор point-in-time.
+            self.next_cursor = encode_cursor(res.get("pit_id", pit_id), hits[-1]["sort"], self.page + 1)
+        else:
+            # Последняя страница, снимок больше не нужен.
+            self._es.close_point_in_time(body={"id": res.get("pit_id", pit_id)}, ignore=404)
+
+        return self._convert(res)
+
+    def _get_numbered_cursor_page(self, cursor: str | None) -> list:
+        """Курсор, который хранит только номер страницы, сами страницы получаются через `get_page`."""
+        records = self.get_page(decode_page_cursor(cursor) if cursor else 1)
+        self.next_cursor = encode_page_cursor(self.page + 1) if self.page < self.max_pages else None
+        return records
+
+    def _convert(self, res: dict) -> list:
         # Вызываем функцию форматирования результата, его была указана
         if callable(self._convert_func):
             return self._convert_func(res, **self.extra_parameters)
@@ -109,14 +327,80 @@ class ElasticsearchPaginator:
 
         return []
 
-    def validate_number(self, number: str | int | float) -> int:
+    def validate_number(self, number: str | int | float, check_max: bool = True) -> int:
         try:
             valid_number = int(number)
         except (ValueError, TypeError):
             valid_number = 1
 
-        if self.max_pages and valid_number > self.max_pages:
+        if check_max and self.max_pages and valid_number > self.max_pages:
             valid_number = self.max_pages
         elif valid_number <= 0:
             valid_number = 1
         return valid_number
+
+
+class RankedPaginator(ElasticsearchPaginator):
+    """
+    Пагинатор по заранее посчитанному рейтингу документов (например, от векторного индекса).
+
+    Для каждой страницы из Elasticsearch получаются только документы этой страницы, их порядок
+    и `_score` берутся из рейтинга. Запрос из `params` применяется как фильтр, поэтому документы,
+    которые были удалены или больше не подходят под запрос, на страницу не попадут.
+    """
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        params: QueryLimitParams,
+        ranking: list[tuple[str, float]],
+        convert_result: Optional[Callable] = None,
+        query_cache: QueryCache | None = None,
+        **extra,
+    ):
+        """
+        :param es: Объект Elasticsearch.
+        :param params: Параметры запроса, его `query` используется как фильтр.
+        :param ranking: Список пар `(id документа, оценка)` в порядке убывания оценки.
+        :param convert_result: Функция преобразования ответа, как у `ElasticsearchPaginator`.
+        :param query_cache: Кэш ответов на запросы страниц.
+        """
+        super().__init__(es, params, convert_result, track_total_hits=False, query_cache=query_cache, **extra)
+        self._ranking = ranking
+        self._count = len(ranking)
+
+    def get_page(self, page: str | int | float) -> list:
+        self.page = self.validate_number(page)
+        return self._hydrate(self.page)
+
+    @property
+    def supports_cursor(self) -> bool:
+        # Рейтинг уже посчитан целиком, курсор хранит только номер страницы.
+        return False
+
+    def _hydrate(self, page: int) -> list:
+        query_from, query_size = self.get_limits(page)
+        page_ranking = self._ranking[query_from : query_from + query_size]
+        if not page_ranking:
+            return []
+
+        ids = [id_ for id_, _ in page_ranking]
+        res = self._execute_search(
+            {
+                **self._params.to_dict,
+                "query": {"bool": {"filter": [{"ids": {"values": ids}}, self._params.query]}},
+                "size": len(ids),
+            }
+        )
+        hits = {hit["_id"]: hit for hit in res.get("hits", {}).get("hits", [])}
+        ordered = []
+        for id_, score in page_ranking:
+            if id_ in hits:
+                ordered.append({**hits[id_], "_score": score})
+
+        res["hits"] = {
+            "total": {"value": self._count, "relation": "eq"},
+            "max_score": self._ranking[0][1],
+            "hits": ordered,
+        }
+        return self._convert(res)
@@ -0,0 +1,23 @@
+from typing import Hashable, Iterable
+
+
+def reciprocal_rank_fusion(
+    *rankings: Iterable[tuple[Hashable, float]], k: int = 60, size: int | None = None
+) -> list[tuple[Hashable, float]]:
+    """
+    Объединяет несколько рейтингов методом Reciprocal Rank Fusion.
+
+    Оценка документа - сумма `1 / (k + позиция)` по всем рейтингам, в которых он есть,
+    поэтому исходные оценки (BM25, косинусная близость и т.д.) могут быть в любых шкалах.
+
+    :param rankings: Рейтинги из пар `(id документа, оценка)` в порядке убывания оценки.
+    :param k: Сглаживание, чем больше, тем меньше влияние первых позиций.
+    :param size: Сколько лучших документов вернуть, по умолчанию все.
+    :return: Список пар `(id документа, оценка RRF)` в порядке убывания оценки.
+    """
+    scores: dict[Hashable, float] = {}
+    for ranking in rankings:
+        for position, (id_, _) in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + position)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:size] if size else fused
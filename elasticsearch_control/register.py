@@ -1,43 +1,367 @@
+import copy
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
 from typing import Type
 
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConflictError
 from requests.exceptions import ConnectionError
 
 from .base_index import AbstractIndex
+from .bulk import iter_hit_batches
 from .transport import ElasticsearchConnection, es_connector
 
+logger = logging.getLogger(__name__)
+
+
+class IndexMigrationError(Exception):
+    """Перенос документов в новую версию индекса не удался, псевдоним не переключен."""
+
+
+def get_settings_hash(index_settings: dict) -> str:
+    """
+    Возвращает отпечаток настроек индекса, по которому определяется, что индекс нужно пересоздать.
+    """
+    return hashlib.sha1(json.dumps(index_settings, sort_keys=True).encode()).hexdigest()
+
 
 class IndexRegister:
     """
     Регистрирует индексы в Elasticsearch.
+
+    Название индекса `Meta.index_name` является псевдонимом, за которым стоит версия индекса
+    `<index_name>_v<N>`. Если настройки индекса изменились, то создается следующая версия,
+    в неё в фоне переносятся документы, после чего псевдоним атомарно переключается на неё.
+    До переключения все запросы идут в предыдущую версию.
+
+    Индексы регистрируются при запуске каждого процесса (воркеры gunicorn, команды manage.py),
+    поэтому переключение выполняет только процесс, получивший блокировку - документ `<версия>`
+    в индексе `<index_name>_migrations`. Остальные ждут, пока псевдоним не будет переключен,
+    и забирают блокировку, если её владелец не продлил её за `migration_lock_timeout` секунд.
     """
 
-    def __init__(self, es_connector: ElasticsearchConnection = es_connector):
+    # Как часто проверять завершение фоновой переиндексации, в секундах.
+    reindex_poll_interval = 5
+    # Сколько ждать запуска переноса другим процессом и завершения самого переноса, в секундах.
+    reindex_start_timeout = 60 * 10
+    reindex_timeout = 60 * 60 * 6
+    # Блокировка продлевается перед каждым шагом переключения, самый долгий шаг - повторный проход.
+    migration_lock_timeout = 60 * 60 * 2
+
+    def __init__(
+        self,
+        es_connector: ElasticsearchConnection = es_connector,
+        reindex_requests_per_second: float | None = None,
+    ):
+        """
+        :param es_connector: Подключение к Elasticsearch.
+        :param reindex_requests_per_second: Ограничение скорости переиндексации, чтобы она
+         не отнимала ресурсы у поисковых запросов. `None` - без ограничений.
+        """
         self._es: Elasticsearch = es_connector.es
+        self._reindex_requests_per_second = reindex_requests_per_second
+        # `(_seq_no, _primary_term)` документов взятых блокировок по версиям индексов.
+        self._migration_locks: dict[str, tuple[int, int]] = {}
 
-    def register_index(self, index: Type[AbstractIndex]) -> None:
+    def register_index(self, index: Type[AbstractIndex], background: bool = True) -> None:
         """
         Регистрирует индекс в Elasticsearch.
         :param index: Класс индекса.
+        :param background: Переносить документы в новую версию индекса в фоновом потоке.
         """
         self._validate_index(index)
 
-        if self._es.ping():
-            # Создаем индекс в Elasticsearch
-            if self._es.indices.exists(index=index.Meta.index_name):
+        if not self._es.ping():
+            raise ConnectionError("Elasticsearch недоступен!")
+
+        alias: str = index.Meta.index_name
+        index_settings = index.get_index_settings()
+        settings_hash = get_settings_hash(index_settings)
+
+        current = self._get_alias_index(alias)
+        versions = self._get_versions(alias)
+
+        if current is None and not self._es.indices.exists(index=alias):
+            # Индекса еще нет, создаем первую версию сразу под псевдонимом.
+            body = self._version_body(index_settings, settings_hash)
+            body["aliases"] = {alias: {}}
+            self._es.indices.create(index=f"{alias}_v1", body=body, ignore=400)
+            return
+
+        if current is not None and versions.get(current) == settings_hash:
+            return  # Настройки не изменились.
+
+        # Индекс без версии, созданный до перехода на псевдонимы.
+        source = current or alias
+
+        target = next((name for name, hash_ in versions.items() if hash_ == settings_hash), None)
+        if target is None:
+            target = f"{alias}_v{self._max_version(versions) + 1}"
+            body = self._version_body(index_settings, settings_hash)
+            # Пока документы переносятся, обновление сегментов и реплики не нужны.
+            body["settings"] = {**body["settings"], "refresh_interval": "-1", "number_of_replicas": 0}
+            result = self._es.indices.create(index=target, body=body, ignore=400)
+            if not result.get("error"):
+                task_id = self._start_reindex(source, target)
                 self._es.indices.put_mapping(
-                    index=index.Meta.index_name,
-                    body=index.get_index_settings()["mappings"],
-                    ignore=400,
+                    index=target, body={"_meta": {**body["mappings"]["_meta"], "reindex_task": task_id}}
+                )
+
+        # Новая версия уже создана (возможно, другим процессом), дожидаемся переноса и переключаем псевдоним.
+        if background:
+            threading.Thread(
+                target=self._run_migration, args=(alias, source, target, index_settings), daemon=True
+            ).start()
+        else:
+            self._finish_migration(alias, source, target, index_settings)
+
+    def _run_migration(self, alias: str, source: str, target: str, index_settings: dict) -> None:
+        try:
+            self._finish_migration(alias, source, target, index_settings)
+        except IndexMigrationError:
+            logger.exception("Переход индекса `%s` на `%s` отменен", alias, target)
+
+    def _finish_migration(self, alias: str, source: str, target: str, index_settings: dict) -> None:
+        """
+        Дожидается переноса документов в новую версию, переносит документы, которые изменились
+        за время переноса, и переключает псевдоним.
+
+        Последний проход и переключение псевдонима выполняются при запрете записи в старую версию,
+        чтобы изменения, сделанные между последним проходом и переключением, не потерялись.
+
+        :raises IndexMigrationError: Если перенос завершился с ошибкой, тогда псевдоним не переключается.
+        """
+        task_id = self._wait_reindex_task(target)
+        deadline = time.monotonic() + self.reindex_timeout
+        while True:
+            task = self._es.tasks.get(task_id=task_id)
+            if task.get("completed"):
+                break
+            if time.monotonic() > deadline:
+                raise IndexMigrationError(
+                    f"Перенос документов в `{target}` не завершился за отведенное время"
+                )
+            time.sleep(self.reindex_poll_interval)
+        self._check_reindex_result(target, task.get("error"), task.get("response", {}))
+
+        while True:
+            if self._get_alias_index(alias) == target:
+                return  # Псевдоним уже переключен другим процессом.
+            if self._acquire_migration_lock(alias, target):
+                break
+            if time.monotonic() > deadline:
+                raise IndexMigrationError(
+                    f"Псевдоним `{alias}` не был переключен на `{target}` другим процессом"
                 )
+            time.sleep(self.reindex_poll_interval)
+
+        try:
+            self._switch_alias(alias, source, target, index_settings)
+        finally:
+            self._release_migration_lock(alias, target)
+
+    def _switch_alias(self, alias: str, source: str, target: str, index_settings: dict) -> None:
+        """Переносит изменения за время переноса и переключает псевдоним, выполняется под блокировкой."""
+        # Пока ждали блокировку, её владелец мог переключить псевдоним и отпустить её.
+        if self._get_alias_index(alias) == target:
+            return
+
+        # Повторный проход переносит только документы, версия которых выросла за время переноса.
+        self._catch_up(source, target)
+
+        self._renew_migration_lock(alias, target)
+        self._es.indices.put_settings(index=source, body={"index.blocks.write": True})
+        try:
+            if self._get_alias_index(alias) == target:
+                return
+            self._catch_up(source, target)
+            self._renew_migration_lock(alias, target)
+            # Если документов больше, чем в старой версии, то в ней были удаления за время переноса.
+            if self._count(target) != self._count(source):
+                self._delete_missing(source, target)
+
+            self._es.indices.put_settings(
+                index=target,
+                body={
+                    "refresh_interval": index_settings["settings"].get("refresh_interval"),
+                    "number_of_replicas": index_settings["settings"].get("number_of_replicas"),
+                },
+            )
+            self._es.indices.refresh(index=target)
+
+            if source == alias:
+                # Индекс без версии удаляется в том же атомарном действии, в котором появляется псевдоним.
+                actions = [{"add": {"index": target, "alias": alias}}, {"remove_index": {"index": source}}]
             else:
-                self._es.indices.create(
-                    index=index.Meta.index_name,
-                    body=index.get_index_settings(),
-                    ignore=400,
+                actions = [
+                    {"remove": {"index": source, "alias": alias}},
+                    {"add": {"index": target, "alias": alias}},
+                ]
+            self._es.indices.update_aliases(body={"actions": actions}, ignore=[400, 404])
+        finally:
+            # Старая версия остается доступной для записи, например для отката. Если блокировку забрал
+            # другой процесс, то запрет снимет он, иначе запись откроется во время его последнего прохода.
+            if self._holds_migration_lock(alias, target):
+                self._es.indices.put_settings(index=source, body={"index.blocks.write": None}, ignore=404)
+
+    def _acquire_migration_lock(self, alias: str, target: str) -> bool:
+        """Берет блокировку переключения псевдонима на `target`, `False` - она занята другим процессом."""
+        lock_index = f"{alias}_migrations"
+        body = {"expires_at": time.time() + self.migration_lock_timeout}
+        try:
+            result = self._es.create(index=lock_index, id=target, body=body)
+        except ConflictError:
+            current = self._es.get(index=lock_index, id=target, ignore=404)
+            if not current.get("found") or current["_source"]["expires_at"] > time.time():
+                return False
+            # Владелец блокировки завис или упал, забираем её, если её не забрал другой процесс.
+            try:
+                result = self._es.index(
+                    index=lock_index,
+                    id=target,
+                    body=body,
+                    if_seq_no=current["_seq_no"],
+                    if_primary_term=current["_primary_term"],
                 )
-        else:
-            raise ConnectionError("Elasticsearch недоступен!")
+            except ConflictError:
+                return False
+        self._migration_locks[target] = (result["_seq_no"], result["_primary_term"])
+        return True
+
+    def _renew_migration_lock(self, alias: str, target: str) -> None:
+        seq_no, primary_term = self._migration_locks[target]
+        try:
+            result = self._es.index(
+                index=f"{alias}_migrations",
+                id=target,
+                body={"expires_at": time.time() + self.migration_lock_timeout},
+                if_seq_no=seq_no,
+                if_primary_term=primary_term,
+            )
+        except ConflictError:
+            raise IndexMigrationError(f"Блокировка переключения на `{target}` перешла другому процессу")
+        self._migration_locks[target] = (result["_seq_no"], result["_primary_term"])
+
+    def _holds_migration_lock(self, alias: str, target: str) -> bool:
+        current = self._es.get(index=f"{alias}_migrations", id=target, ignore=404)
+        if not current.get("found"):
+            return False
+        return (current["_seq_no"], current["_primary_term"]) == self._migration_locks.get(target)
+
+    def _release_migration_lock(self, alias: str, target: str) -> None:
+        seq_no, primary_term = self._migration_locks.pop(target)
+        # Если блокировку уже забрал другой процесс, то удалять её нельзя.
+        self._es.delete(
+            index=f"{alias}_migrations",
+            id=target,
+            if_seq_no=seq_no,
+            if_primary_term=primary_term,
+            ignore=[404, 409],
+        )
+
+    def _wait_reindex_task(self, target: str) -> str:
+        """Ждет, пока процесс, создавший новую версию, сохранит в ней идентификатор задачи переноса."""
+        deadline = time.monotonic() + self.reindex_start_timeout
+        while True:
+            task_id = self._get_meta(target).get("reindex_task")
+            if task_id is not None:
+                return task_id
+            if time.monotonic() > deadline:
+                raise IndexMigrationError(
+                    f"Перенос в `{target}` не был запущен, индекс нужно удалить и перезапустить приложение"
+                )
+            time.sleep(self.reindex_poll_interval)
+
+    def _catch_up(self, source: str, target: str) -> None:
+        self._es.indices.refresh(index=source)
+        result = self._es.reindex(
+            body=self._reindex_body(source, target), wait_for_completion=True, request_timeout=3600
+        )
+        self._check_reindex_result(target, result.get("error"), result)
+        self._es.indices.refresh(index=target)
+
+    @staticmethod
+    def _check_reindex_result(target: str, error: dict | None, response: dict) -> None:
+        """Конфликты версий ожидаемы (`conflicts: proceed`), любые другие ошибки отменяют переход."""
+        if error:
+            raise IndexMigrationError(f"Ошибка переноса документов в `{target}`: {error}")
+        failures = response.get("failures") or []
+        if failures:
+            raise IndexMigrationError(
+                f"Не удалось перенести {len(failures)} документов в `{target}`: {failures[:3]}"
+            )
+
+    def _count(self, index: str) -> int:
+        return self._es.count(index=index)["count"]
+
+    def _delete_missing(self, source: str, target: str) -> None:
+        """Удаляет из новой версии документы, которых уже нет в старой."""
+        for hits in iter_hit_batches(self._es, target, sort=[{"_id": "asc"}], source=False, size=1000):
+            ids = [hit["_id"] for hit in hits]
+            found = self._es.search(
+                index=source,
+                query={"ids": {"values": ids}},
+                size=len(ids),
+                _source=False,
+                track_total_hits=False,
+            )["hits"]["hits"]
+            missing = set(ids) - {hit["_id"] for hit in found}
+            if missing:
+                self._es.delete_by_query(
+                    index=target, body={"query": {"ids": {"values": list(missing)}}}, refresh=True
+                )
+
+    def _start_reindex(self, source: str, target: str) -> str:
+        """Запускает перенос документов на стороне Elasticsearch и возвращает идентификатор задачи."""
+        result = self._es.reindex(
+            body=self._reindex_body(source, target),
+            wait_for_completion=False,
+            requests_per_second=self._reindex_requests_per_second or -1,
+        )
+        return result["task"]
+
+    @staticmethod
+    def _reindex_body(source: str, target: str) -> dict:
+        # Внешние версии позволяют повторным проходом записать только изменившиеся документы.
+        return {
+            "conflicts": "proceed",
+            "source": {"index": source},
+            "dest": {"index": target, "version_type": "external"},
+        }
+
+    @staticmethod
+    def _version_body(index_settings: dict, settings_hash: str) -> dict:
+        body = copy.deepcopy(index_settings)
+        body["mappings"]["_meta"] = {"settings_hash": settings_hash}
+        return body
+
+    def _get_alias_index(self, alias: str) -> str | None:
+        """Возвращает название индекса, на который указывает псевдоним."""
+        result = self._es.indices.get_alias(name=alias, ignore=404)
+        if not result or "error" in result or result.get("status") == 404:
+            return None
+        return next(iter(result))
+
+    def _get_versions(self, alias: str) -> dict[str, str | None]:
+        """Возвращает все версии индекса и отпечатки их настроек."""
+        result = self._es.indices.get_mapping(index=f"{alias}_v*")
+        return {
+            name: data["mappings"].get("_meta", {}).get("settings_hash")
+            for name, data in result.items()
+            if re.fullmatch(rf"{re.escape(alias)}_v\d+", name)
+        }
+
+    def _get_meta(self, index_name: str) -> dict:
+        result = self._es.indices.get_mapping(index=index_name)
+        return result[index_name]["mappings"].get("_meta", {})
+
+    @staticmethod
+    def _max_version(versions: dict) -> int:
+        return max((int(name.rsplit("_v", 1)[1]) for name in versions), default=0)
 
     def _validate_index(self, index) -> None:
         """
@@ -0,0 +1,26 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from elasticsearch_control.bulk import iter_hit_batches
+
+
+class TestIterHitBatches(SimpleTestCase):
+    def test_point_in_time(self):
+        es = mock.Mock()
+        es.open_point_in_time.return_value = {"id": "pit-1"}
+        es.search.side_effect = [
+            {"pit_id": "pit-2", "hits": {"hits": [{"_id": "1", "sort": [1]}, {"_id": "2", "sort": [2]}]}},
+            {"pit_id": "pit-2", "hits": {"hits": [{"_id": "3", "sort": [3]}]}},
+        ]
+
+        batches = list(iter_hit_batches(es, "notes", sort=[{"_id": "asc"}], size=2, pit_keep_alive="1m"))
+
+        self.assertEqual([["1", "2"], ["3"]], [[hit["_id"] for hit in hits] for hits in batches])
+        first, second = [call.kwargs for call in es.search.call_args_list]
+        self.assertIsNone(first["index"])
+        self.assertEqual({"id": "pit-1", "keep_alive": "1m"}, first["pit"])
+        # Следующая пачка читается по обновленному идентификатору и после последнего документа.
+        self.assertEqual({"id": "pit-2", "keep_alive": "1m"}, second["pit"])
+        self.assertEqual([2], second["search_after"])
+        es.close_point_in_time.assert_called_once_with(body={"id": "pit-2"}, ignore=404)
@@ -0,0 +1,126 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from elasticsearch_control import ElasticsearchPaginator, QueryLimitParams
+from elasticsearch_control.cache import QueryCache, get_or_cache
+from .test_limiter import FakeElasticsearch
+
+
+def wait_until(condition) -> None:
+    """Дожидается фонового обновления кэша, которое выполняется в пуле потоков."""
+    deadline = time.monotonic() + 2
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class TestGetOrCache(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def function(self, value=None):
+        self.calls += 1
+        return value
+
+    def get(self, value=None, version=1, **kwargs):
+        return get_or_cache(self.function, {"value": value}, "test", 60, version=version, beta=0, **kwargs)
+
+    def wait_calls(self, calls: int):
+        # Дожидаемся, пока фоновое обновление запишет значение и снимет блокировку.
+        wait_until(lambda: self.calls >= calls and cache.get("test:lock") is None)
+
+    def test_empty_result_cached(self):
+        self.assertEqual([], self.get([]))
+        self.assertEqual([], self.get([1]))
+        self.assertEqual(1, self.calls)
+
+    def test_none_cached(self):
+        self.get(None)
+        self.assertIsNone(self.get(1))
+        self.assertEqual(1, self.calls)
+
+    def test_stale_while_revalidate(self):
+        self.get("old", version=1)
+        # Версия изменилась: сразу отдается прежнее значение, а новое вычисляется в фоне.
+        self.assertEqual("old", self.get("new", version=2))
+        self.wait_calls(2)
+        self.assertEqual("new", self.get("newer", version=2))
+        self.assertEqual(2, self.calls)
+
+    @mock.patch("elasticsearch_control.cache.close_old_connections")
+    def test_refresh_closes_connections(self, close_old_connections):
+        self.get("old", version=1)
+        self.get("new", version=2)
+        wait_until(lambda: close_old_connections.called)
+        close_old_connections.assert_called_once()
+
+    def test_stale_disabled(self):
+        self.get("old", version=1)
+        self.assertEqual("new", self.get("new", version=2, stale_timeout=0))
+
+    @mock.patch("elasticsearch_control.cache._lock_wait", 0.1)
+    def test_wait_for_lock(self):
+        cache.add("test:lock", 1)
+        # Блокировку держит другой процесс, который так и не сохранил значение.
+        self.assertEqual("value", self.get("value"))
+        self.assertEqual(1, self.calls)
+        self.assertIsNone(cache.get("test:lock"))
+
+
+class TestQueryCache(SimpleTestCase):
+    params = QueryLimitParams(
+        index="test_index", source=["title"], query={"match_all": {}}, request_timeout=5
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_paginator_cached_pages(self):
+        es = FakeElasticsearch(total=50)
+        for _ in range(2):
+            paginator = ElasticsearchPaginator(
+                es, self.params, track_total_hits=True, query_cache=QueryCache("test", version=1)
+            )
+            self.assertEqual("doc-24", paginator.get_page(2)[0]["_id"])
+            # Кол-во записей берется из закэшированного ответа.
+            self.assertEqual(50, paginator.count)
+        self.assertEqual(1, len(es.searches))
+
+        ElasticsearchPaginator(
+            es, self.params, track_total_hits=True, query_cache=QueryCache("test", version=1)
+        ).get_page(1)
+        ElasticsearchPaginator(
+            es, self.params, track_total_hits=True, query_cache=QueryCache("test", version=2)
+        ).get_page(2)
+        wait_until(lambda: len(es.searches) == 3)
+        self.assertEqual(3, len(es.searches))
+
+    def test_cursor_pages_not_cached(self):
+        es = FakeElasticsearch(total=50)
+        for _ in range(2):
+            ElasticsearchPaginator(
+                es, self.params, query_cache=QueryCache("test", version=1)
+            ).get_cursor_page("")
+        self.assertEqual(2, len(es.searches))
+
+    def test_key(self):
+        query_cache = QueryCache("test", scope="acl")
+        self.assertEqual(
+            query_cache.make_key({"a": 1, "b": [1, 2]}), query_cache.make_key({"b": [1, 2], "a": 1})
+        )
+        self.assertNotEqual(
+            query_cache.make_key({"a": 1}), QueryCache("test", scope="other").make_key({"a": 1})
+        )
+
+    def test_size_aware_timeout(self):
+        query_cache = QueryCache("test", timeout=300)
+        self.assertEqual(300, query_cache.get_timeout(1024))
+        self.assertEqual(150, query_cache.get_timeout(query_cache.large_entry_size * 2))
+        self.assertEqual(37, query_cache.get_timeout(query_cache.max_entry_size))
+        self.assertEqual(
+            query_cache.min_timeout, QueryCache("test", timeout=60).get_timeout(query_cache.max_entry_size)
+        )
+        self.assertIsNone(query_cache.get_timeout(query_cache.max_entry_size + 1))
@@ -0,0 +1,257 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from elasticsearch import Elasticsearch, NotFoundError, RequestError
+
+from elasticsearch_control import CursorError, ElasticsearchPaginator, QueryLimitParams
+from elasticsearch_control.limiter import (
+    RankedPaginator,
+    decode_cursor,
+    decode_page_cursor,
+    encode_cursor,
+    encode_page_cursor,
+)
+
+
+class FakeElasticsearch:
+    """Отдает документы `doc-0` ... `doc-N` в режиме `search_after`, запоминая все запросы."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.searches: list[dict] = []
+        self.closed_pits: list[str] = []
+        self.counts = 0
+
+    def count(self, **kwargs):
+        self.counts += 1
+        return {"count": self.total}
+
+    def open_point_in_time(self, **kwargs):
+        return {"id": "pit-1"}
+
+    def close_point_in_time(self, body, **kwargs):
+        self.closed_pits.append(body["id"])
+
+    def search(self, **kwargs):
+        self.searches.append(kwargs)
+        if "pit" in kwargs and kwargs["pit"]["id"] == "broken":
+            raise RequestError(400, "illegal_argument_exception")
+        if "pit" in kwargs and kwargs["pit"]["id"] != "pit-1":
+            raise NotFoundError(404, "search_context_missing_exception")
+        if kwargs.get("search_after"):
+            start = kwargs["search_after"][0] + 1
+        else:
+            start = kwargs.get("from_", 0)
+        stop = min(start + kwargs["size"], self.total)
+        return {
+            "pit_id": "pit-1",
+            "hits": {
+                "total": {"value": self.total, "relation": "eq"},
+                "hits": [{"_id": f"doc-{i}", "_source": {}, "sort": [i, i]} for i in range(start, stop)],
+            },
+        }
+
+
+class TestCursorPaginator(SimpleTestCase):
+    params = QueryLimitParams(
+        index="test_index",
+        source=["title"],
+        query={"match_all": {}},
+        request_timeout=5,
+        sort={"published_at": "desc"},
+    )
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor("pit", [1, "a"], 3)
+        self.assertEqual(("pit", [1, "a"], 3), decode_cursor(cursor))
+
+    def test_invalid_cursor(self):
+        for cursor in (
+            "not a cursor",
+            encode_cursor("", [], 2),
+            encode_page_cursor(2),
+            encode_cursor("pit", [], 0),
+        ):
+            with self.subTest(cursor=cursor), self.assertRaises(CursorError):
+                decode_cursor(cursor)
+        with self.assertRaises(CursorError):
+            decode_page_cursor(encode_cursor("pit", [1], 2))
+        self.assertEqual(2, decode_page_cursor(encode_page_cursor(2)))
+
+    def test_walk_all_pages(self):
+        es = FakeElasticsearch(total=50)
+        ids = []
+        cursor = ""
+        pages = 0
+        while cursor is not None:
+            paginator = ElasticsearchPaginator(es, self.params)
+            ids += [hit["_id"] for hit in paginator.get_cursor_page(cursor)]
+            cursor = paginator.next_cursor
+            pages += 1
+            self.assertEqual(pages, paginator.page)
+
+        self.assertEqual([f"doc-{i}" for i in range(50)], ids)
+        self.assertEqual(3, pages)
+        self.assertEqual(["pit-1"], es.closed_pits)
+
+        first_search = es.searches[0]
+        self.assertNotIn("index", first_search)
+        self.assertNotIn("from_", first_search)
+        self.assertEqual([{"published_at": "desc"}, {"_shard_doc": "asc"}], first_search["sort"])
+
+    def test_expired_cursor(self):
+        paginator = ElasticsearchPaginator(FakeElasticsearch(total=50), self.params)
+        with self.assertRaises(CursorError):
+            paginator.get_cursor_page(encode_cursor("expired", [23, 23], 2))
+
+    def test_broken_cursor(self):
+        paginator = ElasticsearchPaginator(FakeElasticsearch(total=50), self.params)
+        with self.assertRaises(CursorError):
+            paginator.get_cursor_page(encode_cursor("broken", [23, 23], 2))
+
+    def test_rescore_uses_page_numbers(self):
+        es = FakeElasticsearch(total=50)
+        params = QueryLimitParams(
+            index="test_index",
+            source=["title"],
+            query={"match_all": {}},
+            request_timeout=5,
+            rescore={"window_size": 50},
+        )
+        paginator = ElasticsearchPaginator(es, params, track_total_hits=50)
+        self.assertFalse(paginator.supports_cursor)
+
+        paginator.get_cursor_page("")
+        paginator.get_cursor_page(paginator.next_cursor)
+        self.assertEqual(2, paginator.page)
+        self.assertEqual(24, es.searches[-1]["from_"])
+        self.assertNotIn("pit", es.searches[-1])
+        self.assertEqual({"window_size": 50}, es.searches[-1]["rescore"])
+
+
+class TestSourceFilter(SimpleTestCase):
+    """Исключения `_source` должны уходить в теле запроса вместе с включениями, а не параметром URL"""
+
+    params = QueryLimitParams(
+        index="test_index",
+        source=["title"],
+        query={"match_all": {}},
+        request_timeout=5,
+        source_excludes=["embedding"],
+    )
+
+    def setUp(self):
+        self.es = Elasticsearch()
+        self.es.transport = mock.Mock()
+        self.es.transport.perform_request.return_value = {
+            "hits": {"total": {"value": 1, "relation": "eq"}, "hits": [{"_id": "1", "_source": {}}]}
+        }
+
+    def assertSourceInBody(self):
+        _, path = self.es.transport.perform_request.call_args.args
+        kwargs = self.es.transport.perform_request.call_args.kwargs
+        self.assertEqual("/test_index/_search", path)
+        self.assertEqual({"includes": ["title"], "excludes": ["embedding"]}, kwargs["body"]["_source"])
+        self.assertNotIn("_source_excludes", kwargs["params"])
+        self.assertNotIn("_source", kwargs["params"])
+
+    def test_page(self):
+        ElasticsearchPaginator(self.es, self.params, track_total_hits=True).get_page(1)
+        self.assertSourceInBody()
+
+    def test_ranked_page(self):
+        RankedPaginator(self.es, self.params, ranking=[("1", 1.0)]).get_page(1)
+        self.assertSourceInBody()
+
+
+class TestSingleRequestPaginator(SimpleTestCase):
+    params = QueryLimitParams(
+        index="test_index", source=["title"], query={"match_all": {}}, request_timeout=5
+    )
+
+    def test_legacy_count(self):
+        es = FakeElasticsearch(total=50)
+        paginator = ElasticsearchPaginator(es, self.params)
+        paginator.get_page(1)
+        self.assertEqual(1, es.counts)
+        self.assertEqual(1, len(es.searches))
+
+    def test_count_from_search(self):
+        es = FakeElasticsearch(total=50)
+        paginator = ElasticsearchPaginator(es, self.params, track_total_hits=True)
+        self.assertEqual(0, len(es.searches))
+
+        hits = paginator.get_page(2)
+        self.assertEqual([f"doc-{i}" for i in range(24, 48)], [hit["_id"] for hit in hits])
+        self.assertEqual(50, paginator.count)
+        self.assertEqual(3, paginator.max_pages)
+        self.assertEqual(0, es.counts)
+        self.assertEqual(1, len(es.searches))
+        self.assertTrue(es.searches[0]["track_total_hits"])
+
+    def test_page_out_of_range(self):
+        es = FakeElasticsearch(total=50)
+        paginator = ElasticsearchPaginator(es, self.params, track_total_hits=True)
+        hits = paginator.get_page(10)
+        self.assertEqual(3, paginator.page)
+        self.assertEqual([f"doc-{i}" for i in range(48, 50)], [hit["_id"] for hit in hits])
+
+    def test_last_page_inside_rescore_window(self):
+        """Последняя страница не выходит за окно пересчета, записи за окном не пересчитаны"""
+        es = FakeElasticsearch(total=100)
+        params = QueryLimitParams(
+            index="test_index",
+            source=["title"],
+            query={"match_all": {}},
+            request_timeout=5,
+            rescore={"window_size": 50},
+        )
+        hits = ElasticsearchPaginator(es, params, track_total_hits=50).get_page(3)
+        self.assertEqual(2, es.searches[-1]["size"])
+        self.assertEqual(["doc-48", "doc-49"], [hit["_id"] for hit in hits])
+
+    def test_count_only(self):
+        es = FakeElasticsearch(total=50)
+        paginator = ElasticsearchPaginator(es, self.params, track_total_hits=1000)
+        self.assertEqual(50, paginator.count)
+        self.assertEqual(0, es.searches[0]["size"])
+        self.assertEqual(1000, es.searches[0]["track_total_hits"])
+
+
+class FakeIdsElasticsearch(FakeElasticsearch):
+    """Отдает документы из фильтра `ids` в порядке возрастания номера."""
+
+    def search(self, **kwargs):
+        self.searches.append(kwargs)
+        ids = kwargs["query"]["bool"]["filter"][0]["ids"]["values"]
+        hits = [{"_id": id_, "_score": 1.0, "_source": {}} for id_ in sorted(ids, key=lambda x: int(x[4:]))]
+        return {"hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits}}
+
+
+class TestRankedPaginator(SimpleTestCase):
+    params = QueryLimitParams(
+        index="test_index", source=["title"], query={"match_all": {}}, request_timeout=5
+    )
+
+    def test_hydrate_in_ranking_order(self):
+        es = FakeIdsElasticsearch(total=50)
+        # Документы находятся поиском в порядке `doc-0`, `doc-1`, ..., а рейтинг задает обратный порядок.
+        ranking = [(f"doc-{i}", 1 - i / 100) for i in range(30, 0, -1)]
+        paginator = RankedPaginator(es, self.params, ranking)
+
+        hits = paginator.get_page(1)
+        self.assertEqual(30, paginator.count)
+        self.assertEqual(2, paginator.max_pages)
+        self.assertEqual([id_ for id_, _ in ranking[:24]], [hit["_id"] for hit in hits])
+        self.assertEqual([score for _, score in ranking[:24]], [hit["_score"] for hit in hits])
+        self.assertEqual(0, es.counts)
+        self.assertEqual(
+            {"ids": {"values": [id_ for id_, _ in ranking[:24]]}},
+            es.searches[0]["query"]["bool"]["filter"][0],
+        )
+
+        paginator.get_cursor_page("")
+        self.assertIsNotNone(paginator.next_cursor)
+        paginator.get_cursor_page(paginator.next_cursor)
+        self.assertEqual(2, paginator.page)
+        self.assertIsNone(paginator.next_cursor)
@@ -0,0 +1,17 @@
+from django.test import SimpleTestCase
+
+from elasticsearch_control.ranking import reciprocal_rank_fusion
+
+
+class TestReciprocalRankFusion(SimpleTestCase):
+    def test_fusion(self):
+        lexical = [("a", 12.5), ("b", 7.0), ("c", 1.2)]
+        vector = [("c", 0.99), ("a", 0.98), ("d", 0.5)]
+        fused = reciprocal_rank_fusion(lexical, vector, k=60)
+
+        self.assertEqual(["a", "c", "b", "d"], [id_ for id_, _ in fused])
+        self.assertAlmostEqual(1 / 61 + 1 / 62, fused[0][1])
+
+    def test_size(self):
+        self.assertEqual([("a", 1 / 61)], reciprocal_rank_fusion([("a", 1.0), ("b", 0.5)], [], size=1))
+        self.assertEqual([], reciprocal_rank_fusion([], []))
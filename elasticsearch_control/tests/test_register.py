@@ -0,0 +1,267 @@
+import time
+from fnmatch import fnmatch
+from unittest import mock
+
+from django.test import SimpleTestCase
+from elasticsearch.exceptions import ConflictError
+
+from elasticsearch_control import AbstractIndex, IndexRegister
+from elasticsearch_control.register import IndexMigrationError, get_settings_hash
+from elasticsearch_control.transport import ElasticsearchConnection
+
+
+class FakeIndices:
+    def __init__(self):
+        self.data: dict[str, dict] = {}
+        self.settings: list[tuple[str, dict]] = []
+
+    def exists(self, index):
+        return index in self.data or any(index in data["aliases"] for data in self.data.values())
+
+    def get_alias(self, name, ignore=None):
+        found = {
+            index: {"aliases": {name: {}}} for index, data in self.data.items() if name in data["aliases"]
+        }
+        return found or {"error": "alias missing", "status": 404}
+
+    def get_mapping(self, index):
+        return {
+            name: {"mappings": data["mappings"]} for name, data in self.data.items() if fnmatch(name, index)
+        }
+
+    def create(self, index, body, ignore=None):
+        if index in self.data:
+            return {"error": "resource_already_exists_exception", "status": 400}
+        self.data[index] = {"mappings": body["mappings"], "aliases": set(body.get("aliases", {}))}
+        return {"acknowledged": True}
+
+    def put_mapping(self, index, body):
+        self.data[index]["mappings"].update(body)
+
+    def put_settings(self, index, body, ignore=None):
+        self.settings.append((index, body))
+
+    def refresh(self, index):
+        pass
+
+    def update_aliases(self, body, ignore=None):
+        for action in body["actions"]:
+            (name, params), *_ = action.items()
+            if name == "add":
+                self.data[params["index"]]["aliases"].add(params["alias"])
+            elif name == "remove":
+                self.data[params["index"]]["aliases"].discard(params["alias"])
+            elif name == "remove_index":
+                del self.data[params["index"]]
+
+
+class FakeTasks:
+    def __init__(self):
+        self.result = {"completed": True, "response": {"failures": []}}
+
+    def get(self, task_id):
+        return self.result
+
+
+class FakeElasticsearch:
+    """Хранит только идентификаторы документов каждого индекса."""
+
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.tasks = FakeTasks()
+        self.reindexed: list[tuple[str, str]] = []
+        self.docs: dict[str, set[str]] = {}
+        # Документы блокировок: `(индекс, id)` -> `(_source, _seq_no)`.
+        self.lock_docs: dict[tuple[str, str], tuple[dict, int]] = {}
+        self._seq_no = 0
+
+    def ping(self):
+        return True
+
+    def reindex(self, body, **kwargs):
+        source, target = body["source"]["index"], body["dest"]["index"]
+        self.reindexed.append((source, target))
+        self.docs.setdefault(target, set()).update(self.docs.get(source, set()))
+        return {"task": "node:1", "failures": []}
+
+    def count(self, index):
+        return {"count": len(self.docs.get(index, set()))}
+
+    def search(self, index, query, size, search_after=None, **kwargs):
+        ids = sorted(self.docs.get(index, set()))
+        if "ids" in query:
+            ids = [id_ for id_ in ids if id_ in query["ids"]["values"]]
+        ids = [id_ for id_ in ids if search_after is None or id_ > search_after[0]][:size]
+        return {"hits": {"hits": [{"_id": id_, "sort": [id_]} for id_ in ids]}}
+
+    def delete_by_query(self, index, body, **kwargs):
+        self.docs[index] -= set(body["query"]["ids"]["values"])
+
+    def _write_lock(self, index, id, body) -> dict:
+        self._seq_no += 1
+        self.lock_docs[(index, id)] = (body, self._seq_no)
+        return {"_seq_no": self._seq_no, "_primary_term": 1}
+
+    def _check_seq_no(self, index, id, if_seq_no):
+        if (index, id) not in self.lock_docs or self.lock_docs[(index, id)][1] != if_seq_no:
+            raise ConflictError(409, "version_conflict_engine_exception", {})
+
+    def create(self, index, id, body):
+        if (index, id) in self.lock_docs:
+            raise ConflictError(409, "version_conflict_engine_exception", {})
+        return self._write_lock(index, id, body)
+
+    def get(self, index, id, ignore=None):
+        if (index, id) not in self.lock_docs:
+            return {"found": False}
+        body, seq_no = self.lock_docs[(index, id)]
+        return {"found": True, "_source": body, "_seq_no": seq_no, "_primary_term": 1}
+
+    def index(self, index, id, body, if_seq_no, if_primary_term):
+        self._check_seq_no(index, id, if_seq_no)
+        return self._write_lock(index, id, body)
+
+    def delete(self, index, id, if_seq_no, if_primary_term, ignore=None):
+        try:
+            self._check_seq_no(index, id, if_seq_no)
+        except ConflictError:
+            return
+        del self.lock_docs[(index, id)]
+
+
+class Index(AbstractIndex):
+    title: str
+
+    class Meta:
+        index_name = "notes"
+        settings = {}
+        mappings = {}
+
+    def json(self) -> dict:
+        return {}
+
+
+class TestIndexRegister(SimpleTestCase):
+    def setUp(self):
+        self.es = FakeElasticsearch()
+        connection = ElasticsearchConnection()
+        connection.init(self.es, 5)  # type: ignore
+        self.register = IndexRegister(connection)
+
+    def aliased_index(self) -> str:
+        return next(iter(self.es.indices.get_alias(name="notes")))
+
+    def test_create_first_version(self):
+        self.register.register_index(Index, background=False)
+        self.assertEqual("notes_v1", self.aliased_index())
+        self.assertEqual([], self.es.reindexed)
+
+    def test_same_settings(self):
+        self.register.register_index(Index, background=False)
+        self.register.register_index(Index, background=False)
+        self.assertEqual(["notes_v1"], list(self.es.indices.data))
+        self.assertEqual([], self.es.reindexed)
+
+    def test_settings_drift(self):
+        self.register.register_index(Index, background=False)
+        Index.Meta.mappings["title"] = {"type": "keyword"}
+        try:
+            self.register.register_index(Index, background=False)
+        finally:
+            Index.Meta.mappings["title"] = {"type": "text"}
+
+        self.assertEqual("notes_v2", self.aliased_index())
+        # Основной перенос и повторные проходы по изменившимся документам до и во время запрета записи.
+        self.assertEqual([("notes_v1", "notes_v2")] * 3, self.es.reindexed)
+        self.assertEqual(
+            get_settings_hash(
+                {
+                    "settings": {},
+                    "mappings": {"dynamic": "true", "properties": {"title": {"type": "keyword"}}},
+                }
+            ),
+            self.es.indices.data["notes_v2"]["mappings"]["_meta"]["settings_hash"],
+        )
+
+    def test_legacy_index(self):
+        self.es.indices.data["notes"] = {"mappings": {}, "aliases": set()}
+        self.register.register_index(Index, background=False)
+
+        self.assertEqual("notes_v1", self.aliased_index())
+        self.assertNotIn("notes", self.es.indices.data)
+        self.assertEqual([("notes", "notes_v1")] * 3, self.es.reindexed)
+
+    def migrate(self):
+        self.register.register_index(Index, background=False)
+        Index.Meta.mappings["title"] = {"type": "keyword"}
+        try:
+            self.register.register_index(Index, background=False)
+        finally:
+            Index.Meta.mappings["title"] = {"type": "text"}
+
+    def test_failed_reindex_keeps_alias(self):
+        self.es.tasks.result = {"completed": True, "response": {"failures": [{"id": "1", "cause": {}}]}}
+        with self.assertRaises(IndexMigrationError):
+            self.migrate()
+        self.assertEqual("notes_v1", self.aliased_index())
+
+    def test_deleted_during_copy(self):
+        self.es.docs["notes_v1"] = {"1", "2", "3"}
+        self.es.docs["notes_v2"] = {"1", "2", "3", "4"}  # "4" удален из старой версии во время переноса.
+        self.migrate()
+
+        self.assertEqual("notes_v2", self.aliased_index())
+        self.assertEqual({"1", "2", "3"}, self.es.docs["notes_v2"])
+
+    def test_source_write_block(self):
+        self.migrate()
+        blocks = [body for index, body in self.es.indices.settings if index == "notes_v1"]
+        # Запись в старую версию запрещается на время последнего прохода и снова разрешается.
+        self.assertEqual([{"index.blocks.write": True}, {"index.blocks.write": None}], blocks)
+
+    def test_reindex_task_never_started(self):
+        self.register.register_index(Index, background=False)
+        self.es.indices.create(index="notes_v2", body={"mappings": {"_meta": {}}})
+        self.register.reindex_start_timeout = 0
+        self.register.reindex_poll_interval = 0
+        with self.assertRaises(IndexMigrationError):
+            self.register._finish_migration("notes", "notes_v1", "notes_v2", {"settings": {}})
+
+    def test_lock_released(self):
+        self.migrate()
+        self.assertEqual({}, self.es.lock_docs)
+
+    def test_alias_switched_by_lock_owner(self):
+        """Процесс без блокировки ждет и ничего не переносит и не удаляет после переключения псевдонима"""
+        self.register.register_index(Index, background=False)
+        self.es.indices.create(index="notes_v2", body={"mappings": {"_meta": {"reindex_task": "node:1"}}})
+        self.es.create("notes_migrations", "notes_v2", {"expires_at": time.time() + 60})
+        self.es.docs = {"notes_v1": {"1"}, "notes_v2": {"1"}}
+
+        def switch_by_owner(_):
+            self.es.indices.update_aliases(
+                body={
+                    "actions": [
+                        {"remove": {"index": "notes_v1", "alias": "notes"}},
+                        {"add": {"index": "notes_v2", "alias": "notes"}},
+                    ]
+                }
+            )
+            # Новая заметка после переключения есть только в новой версии.
+            self.es.docs["notes_v2"].add("2")
+
+        with mock.patch("elasticsearch_control.register.time.sleep", side_effect=switch_by_owner):
+            self.register._finish_migration("notes", "notes_v1", "notes_v2", {"settings": {}})
+
+        self.assertEqual({"1", "2"}, self.es.docs["notes_v2"])
+        self.assertEqual([], self.es.reindexed)
+        self.assertEqual([], self.es.indices.settings)
+
+    def test_expired_lock_taken_over(self):
+        self.register.register_index(Index, background=False)
+        self.es.indices.create(index="notes_v2", body={"mappings": {"_meta": {"reindex_task": "node:1"}}})
+        self.es.create("notes_migrations", "notes_v2", {"expires_at": time.time() - 1})
+
+        self.register._finish_migration("notes", "notes_v1", "notes_v2", {"settings": {}})
+        self.assertEqual("notes_v2", self.aliased_index())
+        self.assertEqual({}, self.es.lock_docs)
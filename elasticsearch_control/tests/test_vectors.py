@@ -0,0 +1,54 @@
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from elasticsearch_control.vectors import NumpyVectorIndex
+
+
+class TestNumpyVectorIndex(SimpleTestCase):
+    dims = 8
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index = NumpyVectorIndex(self.tmp.name, self.dims)
+        rng = np.random.default_rng(1)
+        self.vectors = {f"doc-{i}": rng.normal(size=self.dims).tolist() for i in range(50)}
+        self.index.rebuild(
+            (
+                (id_, vector, ["even" if i % 2 == 0 else "odd"])
+                for i, (id_, vector) in enumerate(self.vectors.items())
+            ),
+            synced_at=None,
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_nearest_first(self):
+        result = self.index.search(self.vectors["doc-7"], k=5)
+        self.assertEqual(5, len(result))
+        self.assertEqual("doc-7", result[0][0])
+        self.assertAlmostEqual(1.0, result[0][1], places=5)
+        self.assertEqual(sorted((score for _, score in result), reverse=True), [score for _, score in result])
+
+    def test_labels_filter(self):
+        ids = [id_ for id_, _ in self.index.search(self.vectors["doc-7"], k=50, must_have=["even"])]
+        self.assertEqual(25, len(ids))
+        self.assertNotIn("doc-7", ids)
+        self.assertEqual([], self.index.search(self.vectors["doc-7"], k=5, must_not_have=["even", "odd"]))
+
+    def test_upsert_remove_and_reload(self):
+        self.index.upsert("doc-7", self.vectors["doc-8"], ["odd"])
+        self.index.upsert("new", self.vectors["doc-9"], ["new"])
+        self.index.remove("doc-1")
+        self.assertEqual(50, len(self.index))
+
+        for index in [self.index, NumpyVectorIndex(self.tmp.name, self.dims)]:
+            index.save() if index is self.index else index.load()
+            self.assertEqual({"doc-7", "doc-8"}, {id_ for id_, _ in index.search(self.vectors["doc-8"], k=2)})
+            self.assertEqual(
+                [], [id_ for id_, _ in index.search(self.vectors["doc-1"], k=50) if id_ == "doc-1"]
+            )
+            self.assertEqual("new", index.search(self.vectors["doc-9"], k=1, must_have=["new"])[0][0])
+            self.assertEqual(0, index.dead_rows)
@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from elasticsearch import Elasticsearch
+
+
+class VectorIndex(ABC):
+    """
+    Индекс для поиска ближайших векторов.
+    Возвращает только идентификаторы и близость, сами документы затем получаются из Elasticsearch.
+    """
+
+    @property
+    def ready(self) -> bool:
+        """Можно ли выполнять поиск по индексу."""
+        return True
+
+    def sync(self) -> None:
+        """Подготавливает индекс к поиску, вызывается перед каждым поиском."""
+
+    @abstractmethod
+    def search(
+        self,
+        vector: list[float],
+        k: int,
+        must_have: list[str] | None = None,
+        must_not_have: list[str] | None = None,
+    ) -> list[tuple[str, float]]:
+        """
+        Возвращает `k` ближайших документов в порядке убывания косинусной близости.
+
+        :param vector: Вектор запроса.
+        :param k: Кол-во документов.
+        :param must_have: Метки (теги), которые все должны быть у документа.
+        :param must_not_have: Метки (теги), ни одной из которых не должно быть у документа.
+        :return: Список пар `(id документа, близость)`.
+        """
+
+
+class ElasticsearchKnnIndex(VectorIndex):
+    """
+    Нативный приближенный kNN поиск Elasticsearch (версия 8.4 и выше, в ней появился `filter` у `knn`).
+    Поле вектора должно быть проиндексировано с `"index": true` и `"similarity": "cosine"`.
+    """
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        index: str,
+        field: str = "embedding",
+        label_field: str = "tags",
+        num_candidates: int = 100,
+        timeout: int = 5,
+    ):
+        self._es = es
+        self._index = index
+        self._field = field
+        self._label_field = label_field
+        self._num_candidates = num_candidates
+        self._timeout = timeout
+
+    def search(self, vector, k, must_have=None, must_not_have=None):
+        knn: dict = {
+            "field": self._field,
+            "query_vector": vector,
+            "k": k,
+            "num_candidates": max(k, self._num_candidates),
+        }
+        if must_have or must_not_have:
+            knn["filter"] = {
+                "bool": {
+                    "filter": [{"term": {self._label_field: label}} for label in must_have or []],
+                    "must_not": [{"terms": {self._label_field: must_not_have or []}}],
+                }
+            }
+        res = self._es.search(
+            index=self._index,
+            body={"knn": knn, "size": k, "_source": False},
+            filter_path=["hits.hits._id", "hits.hits._score"],
+            request_timeout=self._timeout,
+        )
+        return [(hit["_id"], hit["_score"]) for hit in res.get("hits", {}).get("hits", [])]
+
+
+class NumpyVectorIndex(VectorIndex):
+    """
+    Локальный индекс векторов в памяти процесса.
+
+    Сохраненные векторы открываются через `np.load(mmap_mode="r")` и разделяются между процессами
+    через страничный кэш ОС, добавленные после сохранения векторы хранятся в памяти.
+    Для больших индексов используется IVF: векторы разбиты на кластеры k-means,
+    и при поиске просматриваются только `nprobe` ближайших к запросу кластеров.
+    """
+
+    # Начиная с этого размера используется IVF, меньшие индексы просматриваются полностью.
+    ivf_min_size = 20_000
+    # Кол-во просматриваемых кластеров IVF.
+    nprobe = 8
+    kmeans_iterations = 10
+
+    def __init__(self, path: Path | str, dims: int):
+        """
+        :param path: Папка для хранения индекса.
+        :param dims: Размерность векторов.
+        """
+        self._path = Path(path)
+        self._dims = dims
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self._ids: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._label_rows: dict[str, list[int]] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._base = np.zeros((0, self._dims), dtype=np.float32)
+        self._extra: list[np.ndarray] = []
+        self._extra_matrix: np.ndarray | None = None
+        self._centroids: np.ndarray | None = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        # Время последней синхронизации с хранилищем документов, сохраняется вместе с индексом.
+        self.synced_at: str | None = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def dead_rows(self) -> int:
+        """Кол-во строк, которые заняты удаленными или замененными векторами."""
+        return len(self._ids) - len(self._positions)
+
+    @property
+    def unsaved_rows(self) -> int:
+        return len(self._extra)
+
+    def _normalize(self, vector: list[float]) -> np.ndarray | None:
+        row = np.asarray(vector, dtype=np.float32)
+        if row.shape != (self._dims,):
+            return None
+        norm = np.linalg.norm(row)
+        if not norm:
+            return None
+        return row / norm
+
+    def _append(self, id_: str, row: np.ndarray, labels: list[str]) -> None:
+        position = len(self._ids)
+        self._ids.append(id_)
+        self._positions[id_] = position
+        for label in labels:
+            self._label_rows.setdefault(label, []).append(position)
+        self._extra.append(row)
+        self._extra_matrix = None
+
+    def upsert(self, id_: str, vector: list[float], labels: list[str]) -> None:
+        """Добавляет вектор документа или заменяет существующий."""
+        row = self._normalize(vector)
+        if row is None:
+            return
+
+        with self._lock:
+            self.remove(id_)
+            self._append(id_, row, labels)
+            self._alive = np.append(self._alive, True)
+            if self._centroids is not None:
+                self._assignments = np.append(self._assignments, np.int32(np.argmax(self._centroids @ row)))
+
+    def rebuild(self, items: Iterable[tuple[str, list[float], list[str]]], synced_at: str | None) -> None:
+        """
+        Полностью перестраивает индекс и сохраняет его на диск.
+
+        :param items: Тройки `(id документа, вектор, метки)`.
+        :param synced_at: Время, на которое актуальны переданные документы.
+        """
+        with self._lock:
+            self._clear()
+            for id_, vector, labels in items:
+                row = self._normalize(vector)
+                if row is not None and id_ not in self._positions:
+                    self._append(id_, row, labels)
+            self._alive = np.ones(len(self._ids), dtype=bool)
+            self.synced_at = synced_at
+            self.save()
+
+    def remove(self, id_: str) -> None:
+        with self._lock:
+            position = self._positions.pop(id_, None)
+            if position is not None:
+                self._alive[position] = False
+
+    def search(self, vector, k, must_have=None, must_not_have=None):
+        query = self._normalize(vector)
+        if query is None:
+            return []
+
+        with self._lock:
+            mask = self._alive.copy()
+            for label in must_have or []:
+                label_mask = np.zeros_like(mask)
+                label_mask[self._label_rows.get(label, [])] = True
+                mask &= label_mask
+            for label in must_not_have or []:
+                mask[self._label_rows.get(label, [])] = False
+
+            if self._centroids is not None:
+                probe = np.argsort(self._centroids @ query)[-self.nprobe :]
+                mask &= np.isin(self._assignments, probe)
+
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return []
+
+            base_size = len(self._base)
+            base_rows, extra_rows = rows[rows < base_size], rows[rows >= base_size] - base_size
+            scores = np.concatenate([self._base[base_rows] @ query, self._get_extra()[extra_rows] @ query])
+
+            top = np.argsort(scores)[::-1][:k] if len(scores) <= k else np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(scores[top])[::-1]]
+            return [(self._ids[rows[i]], float(scores[i])) for i in top]
+
+    def _get_extra(self) -> np.ndarray:
+        if self._extra_matrix is None:
+            self._extra_matrix = (
+                np.vstack(self._extra) if self._extra else np.zeros((0, self._dims), dtype=np.float32)
+            )
+        return self._extra_matrix
+
+    def save(self) -> None:
+        """
+        Сохраняет индекс на диск, отбрасывая удаленные векторы, и открывает его заново через mmap.
+        При достаточном размере заново обучает кластеры IVF.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            base_size = len(self._base)
+            matrix = np.vstack(
+                [self._base[rows[rows < base_size]], self._get_extra()[rows[rows >= base_size] - base_size]]
+            ).astype(np.float32)
+            ids = [self._ids[row] for row in rows]
+            new_positions = {old: new for new, old in enumerate(rows)}
+            labels = {
+                label: [new_positions[row] for row in label_rows if row in new_positions]
+                for label, label_rows in self._label_rows.items()
+            }
+
+            self._path.mkdir(parents=True, exist_ok=True)
+            self._atomic_save(self._path / "vectors.npy", matrix)
+            if len(matrix) >= self.ivf_min_size:
+                centroids, assignments = self._train_ivf(matrix)
+                self._atomic_save(self._path / "centroids.npy", centroids)
+                self._atomic_save(self._path / "assignments.npy", assignments)
+            else:
+                for name in ["centroids.npy", "assignments.npy"]:
+                    (self._path / name).unlink(missing_ok=True)
+
+            tmp = self._path / "index.json.tmp"
+            tmp.write_text(json.dumps({"ids": ids, "labels": labels, "synced_at": self.synced_at}))
+            os.replace(tmp, self._path / "index.json")
+
+            self.load()
+
+    def load(self) -> bool:
+        """
+        Загружает сохраненный индекс.
+        :return: `True`, если индекс был найден на диске и успешно загружен.
+        """
+        meta_path = self._path / "index.json"
+        if not meta_path.exists():
+            return False
+
+        meta = json.loads(meta_path.read_text())
+        base = np.load(self._path / "vectors.npy", mmap_mode="r")
+        if len(base) != len(meta["ids"]):
+            # Индекс в этот момент сохраняет другой процесс.
+            return False
+
+        with self._lock:
+            self._clear()
+            self._base = base
+            self._ids = meta["ids"]
+            self._positions = {id_: position for position, id_ in enumerate(self._ids)}
+            self._label_rows = meta["labels"]
+            self._alive = np.ones(len(self._ids), dtype=bool)
+            self.synced_at = meta.get("synced_at")
+            if (self._path / "centroids.npy").exists():
+                self._centroids = np.load(self._path / "centroids.npy")
+                self._assignments = np.load(self._path / "assignments.npy")
+        return True
+
+    def _train_ivf(self, matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Обучает сферический k-means, возвращает центроиды и номер кластера для каждого вектора."""
+        n_lists = int(np.sqrt(len(matrix)))
+        rng = np.random.default_rng(0)
+        sample = matrix[rng.choice(len(matrix), size=min(len(matrix), n_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = sample[assignments == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1)
+
+        assignments = np.concatenate(
+            [
+                np.argmax(chunk @ centroids.T, axis=1)
+                for chunk in np.array_split(matrix, max(1, len(matrix) // 10_000))
+            ]
+        )
+        return centroids.astype(np.float32), assignments.astype(np.int32)
+
+    @staticmethod
+    def _atomic_save(path: Path, array: np.ndarray) -> None:
+        # `np.save` добавляет расширение `.npy`, поэтому временный файл тоже должен его иметь.
+        tmp = path.with_name(path.stem + ".tmp.npy")
+        np.save(tmp, array)
+        os.replace(tmp, path)
@@ -0,0 +1,34 @@
+import time
+from typing import Callable, TypeVar
+
+from elasticsearch.exceptions import AuthorizationException
+
+_T = TypeVar("_T")
+
+
+class IndexWriteBlockedError(Exception):
+    """Запись в индекс запрещена (`index.blocks.write`), например на время перехода на новую версию индекса."""
+
+
+def is_write_block_error(exc: Exception) -> bool:
+    return isinstance(exc, AuthorizationException) and exc.error == "cluster_block_exception"
+
+
+def retry_when_write_blocked(function: Callable[[], _T], timeout: float = 10, interval: float = 0.5) -> _T:
+    """
+    Выполняет запись `function`, а если индекс закрыт на запись, то повторяет её до `timeout` секунд.
+    Запрет записи на время переключения псевдонима (см. `IndexRegister`) обычно длится недолго,
+    после переключения повторная запись через псевдоним попадает уже в новую версию индекса.
+
+    :raises IndexWriteBlockedError: Если запись так и не была разрешена.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return function()
+        except AuthorizationException as exc:
+            if not is_write_block_error(exc):
+                raise
+            if time.monotonic() > deadline:
+                raise IndexWriteBlockedError(str(exc)) from exc
+        time.sleep(interval)
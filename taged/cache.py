@@ -0,0 +1,349 @@
+import fnmatch
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Any
+
+import orjson
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LocalLRU:
+    """Ограниченный по кол-ву записей LRU кэш в памяти процесса, записи живут не дольше `timeout` секунд."""
+
+    def __init__(self, max_entries: int, timeout: float):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Возвращает значение либо `_MISSING`."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, timeout: float | None = None) -> None:
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class _ProcessL1:
+    """L1 и поток подписки, общие для всех потоков процесса (Django создает объект кэша на каждый поток)."""
+
+    def __init__(self, max_entries: int, timeout: float):
+        self.pid = os.getpid()
+        self.l1 = LocalLRU(max_entries, timeout)
+        # Отправитель пропускает свои же сообщения, его L1 уже обновлен.
+        self.sender_id = f"{self.pid}-{uuid.uuid4().hex}"
+        self.listener_started = False
+        self.lock = threading.Lock()
+
+
+_process_l1: dict[str, _ProcessL1] = {}
+_process_l1_lock = threading.Lock()
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    Кэш Redis с копией часто читаемых ключей в памяти процесса (L1).
+
+    В L1 попадают только ключи, подходящие под шаблоны `L1_KEY_PATTERNS` (например, счетчики версий).
+    При записи такого ключа через этот кэш имя ключа рассылается через Redis pub/sub, и все процессы
+    удаляют его из своего L1. Если сообщение потерялось (например, при переподключении к Redis),
+    то значение в L1 все равно проживет не дольше `L1_TIMEOUT` секунд.
+
+    Настройки в `OPTIONS`:
+    - `L1_KEY_PATTERNS` - шаблоны `fnmatch` ключей для L1;
+    - `L1_MAX_ENTRIES` - максимальное кол-во записей L1;
+    - `L1_TIMEOUT` - максимальное время жизни записи L1 в секундах;
+    - `L1_CHANNEL` - канал pub/sub для рассылки измененных ключей.
+
+    Статистику сжатия значений (при `CompactSerializer`) возвращает `get_serializer_stats`.
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get("OPTIONS", {}))
+        self._l1_patterns: list[str] = options.pop("L1_KEY_PATTERNS", ["*:version"])
+        self._l1_max_entries: int = options.pop("L1_MAX_ENTRIES", 1024)
+        self._l1_timeout: float = options.pop("L1_TIMEOUT", 60)
+        self._channel: str = options.pop("L1_CHANNEL", "cache:invalidate")
+        params["OPTIONS"] = options
+        super().__init__(server, params)
+
+    @property
+    def _process(self) -> _ProcessL1:
+        """L1 текущего процесса, после fork создается заново."""
+        name = f"{self._channel}:{','.join(self._servers)}"
+        state = _process_l1.get(name)
+        if state is None or state.pid != os.getpid():
+            with _process_l1_lock:
+                state = _process_l1.get(name)
+                if state is None or state.pid != os.getpid():
+                    state = _process_l1[name] = _ProcessL1(self._l1_max_entries, self._l1_timeout)
+        return state
+
+    def _use_l1(self, key: str) -> bool:
+        return any(fnmatch.fnmatchcase(key, pattern) for pattern in self._l1_patterns)
+
+    def get(self, key, default=None, version=None):
+        if not self._use_l1(key):
+            return super().get(key, default, version)
+
+        process = self._process
+        self._ensure_listener(process)
+        full_key = self.make_and_validate_key(key, version=version)
+        value = process.l1.get(full_key)
+        if value is _MISSING:
+            value = super().get(key, _MISSING, version)
+            if value is _MISSING:
+                return default
+            process.l1.set(full_key, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        self._changed(key, version, value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version)
+        if added:
+            self._changed(key, version, value)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        self._changed(key, version, value)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        result = super().touch(key, timeout, version)
+        self._changed(key, version)
+        return result
+
+    def delete(self, key, version=None):
+        result = super().delete(key, version)
+        self._changed(key, version)
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version)
+        for key, value in data.items():
+            self._changed(key, version, value)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version)
+        for key in keys:
+            self._changed(key, version)
+
+    def get_serializer_stats(self) -> dict | None:
+        """
+        Статистика сериализатора текущего процесса, см. `CompactSerializer.get_stats`.
+
+        :return: Словарь статистики либо `None`, если сериализатор её не ведет.
+        """
+        get_stats = getattr(self._cache._serializer, "get_stats", None)
+        return get_stats() if callable(get_stats) else None
+
+    def clear(self):
+        result = super().clear()
+        self._process.l1.clear()
+        self._publish("*")
+        return result
+
+    def _changed(self, key: str, version: int | None, value: Any = _MISSING) -> None:
+        """Обновляет L1 текущего процесса и сообщает другим процессам, что ключ изменился."""
+        if not self._use_l1(key):
+            return
+        full_key = self.make_and_validate_key(key, version=version)
+        if value is _MISSING:
+            self._process.l1.delete(full_key)
+        else:
+            self._process.l1.set(full_key, value)
+        self._publish(full_key)
+
+    def _publish(self, full_key: str) -> None:
+        try:
+            self._cache.get_client(write=True).publish(self._channel, f"{self._process.sender_id}:{full_key}")
+        except Exception:
+            logger.exception("Не удалось разослать изменение ключа кэша `%s`", full_key)
+
+    def _ensure_listener(self, process: _ProcessL1) -> None:
+        """Запускает поток подписки на изменения ключей, один на процесс."""
+        if process.listener_started:
+            return
+        with process.lock:
+            if process.listener_started:
+                return
+            process.listener_started = True
+            threading.Thread(
+                target=self._listen, args=(process,), name="cache-l1-invalidation", daemon=True
+            ).start()
+
+    def _listen(self, process: _ProcessL1) -> None:
+        while True:
+            try:
+                pubsub = self._cache.get_client(write=True).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                # Пока не было подписки, сообщения могли потеряться.
+                process.l1.clear()
+                for message in pubsub.listen():
+                    sender_id, _, full_key = message["data"].decode().partition(":")
+                    if sender_id == process.sender_id:
+                        continue
+                    if full_key == "*":
+                        process.l1.clear()
+                    else:
+                        process.l1.delete(full_key)
+            except Exception:
+                logger.exception("Подписка на изменения ключей кэша прервана, переподключение")
+                process.l1.clear()
+                time.sleep(1)
+
+
+class CompactSerializer:
+    """
+    Сериализатор значений для `RedisCache` (настройка `OPTIONS["serializer"]`).
+
+    - Целые числа хранятся как есть, чтобы работал атомарный `incr` (как в `RedisSerializer`).
+    - Значения только из простых типов JSON сохраняются через orjson, остальные через pickle.
+    - Данные больше `compress_min_size` байт сжимаются zstd (пакет `zstandard` из requirements.txt).
+      Без него сжатие идет через zlib: данные больше, но читаются любым процессом; значения,
+      сжатые zstd, без `zstandard` прочитать нельзя.
+    - Статистика записанных значений доступна через `get_stats` (или `get_serializer_stats` кэша).
+
+    Первый байт данных указывает формат, значения, сохраненные стандартным `RedisSerializer`
+    (pickle), по-прежнему читаются.
+    """
+
+    compress_min_size = 1024
+    # Как часто писать в лог статистику сжатия, в кол-ве записанных значений.
+    stats_log_interval = 1000
+
+    _JSON = b"J"
+    _PICKLE = b"P"
+    _ZLIB = b"z"
+    _ZSTD = b"Z"
+
+    _stats = {"values": 0, "raw_bytes": 0, "stored_bytes": 0}
+    _stats_lock = threading.Lock()
+
+    def __init__(self, protocol=None):
+        self.protocol = pickle.HIGHEST_PROTOCOL if protocol is None else protocol
+
+    def dumps(self, obj):
+        if type(obj) is int:
+            return obj
+
+        data = (
+            self._JSON + orjson.dumps(obj)
+            if _is_plain_json(obj)
+            else self._PICKLE + pickle.dumps(obj, self.protocol)
+        )
+        raw_size = len(data)
+        if raw_size >= self.compress_min_size:
+            if zstandard is not None:
+                data = self._ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+            else:
+                data = self._ZLIB + zlib.compress(data, 6)
+        self._count(raw_size, len(data))
+        return data
+
+    def loads(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            pass
+
+        prefix, payload = data[:1], data[1:]
+        if prefix == self._ZSTD:
+            return self.loads(zstandard.ZstdDecompressor().decompress(payload))
+        if prefix == self._ZLIB:
+            return self.loads(zlib.decompress(payload))
+        if prefix == self._JSON:
+            return orjson.loads(payload)
+        if prefix == self._PICKLE:
+            return pickle.loads(payload)
+        # Значение, сохраненное `RedisSerializer`.
+        return pickle.loads(data)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """Статистика записанных текущим процессом значений: кол-во, размер до и после сжатия."""
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+        stats["saved_bytes"] = stats["raw_bytes"] - stats["stored_bytes"]
+        return stats
+
+    @classmethod
+    def _count(cls, raw_size: int, stored_size: int) -> None:
+        with cls._stats_lock:
+            cls._stats["values"] += 1
+            cls._stats["raw_bytes"] += raw_size
+            cls._stats["stored_bytes"] += stored_size
+            log = cls._stats["values"] % cls.stats_log_interval == 0
+        if log:
+            stats = cls.get_stats()
+            logger.info(
+                "Кэш: записано %s значений, %s байт вместо %s, сжатие сэкономило %s байт",
+                stats["values"],
+                stats["stored_bytes"],
+                stats["raw_bytes"],
+                stats["saved_bytes"],
+            )
+
+
+def _is_plain_json(obj: Any) -> bool:
+    """
+    Можно ли сохранить значение в JSON и получить обратно то же самое.
+    Кортежи, даты, `set` и т.д. после JSON изменят тип, поэтому для них нужен pickle.
+    """
+    obj_type = type(obj)
+    if obj_type is str or obj_type is bool or obj is None:
+        return True
+    if obj_type is int:
+        return -(2**63) <= obj < 2**64
+    if obj_type is float:
+        return math.isfinite(obj)
+    if obj_type is list:
+        return all(_is_plain_json(item) for item in obj)
+    if obj_type is dict:
+        return all(type(key) is str and _is_plain_json(value) for key, value in obj.items())
+    return False
@@ -176,8 +176,16 @@ SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 if os.getenv("REDIS_CACHE_URL"):
     CACHES = {
         "default": {
-            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            # Redis с копией счетчиков версий и снимков прав в памяти процесса, см. `taged.cache`.
+            "BACKEND": "taged.cache.TwoTierRedisCache",
             "LOCATION": os.getenv("REDIS_CACHE_URL"),
+            "OPTIONS": {
+                # JSON/pickle со сжатием больших значений вместо pickle без сжатия.
+                "serializer": "taged.cache.CompactSerializer",
+                "L1_KEY_PATTERNS": ["*:version", "permissions:*"],
+                "L1_MAX_ENTRIES": int(os.getenv("CACHE_L1_MAX_ENTRIES", "1024")),
+                "L1_TIMEOUT": int(os.getenv("CACHE_L1_TIMEOUT", "60")),
+            },
         }
     }
 
@@ -211,6 +219,11 @@ CKEDITOR_UPLOAD_PATH = "notes/"
 
 logging.basicConfig(filename="logs", level=logging.INFO)
 
+# Как искать ближайшие векторы при поиске только по векторной модели:
+# script - скриптом Elasticsearch по всем заметкам, numpy - локальным индексом, knn - kNN Elasticsearch 8.4+.
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "script")
+PostIndex.set_vector_search_backend(VECTOR_SEARCH_BACKEND)
+
 # В формате `es01:9200,es02:9201,es03:9202`
 ELASTICSEARCH_HOSTS_raw_str = os.getenv("ELASTICSEARCH_HOSTS")
 print(PostIndex.get_index_settings())
@@ -277,4 +290,27 @@ SIMPLE_JWT = {
 }
 
 NOTE_INDEX_NAME = os.getenv("NOTE_INDEX_NAME", "notes")
+# Предел точного подсчета кол-ва найденных записей, 0 - считать всегда точно.
+NOTES_TRACK_TOTAL_HITS: bool | int = int(os.getenv("NOTES_TRACK_TOTAL_HITS", "0")) or True
 VECTORIZE_URL = os.getenv("VECTORIZE_URL", "http://127.0.0.1:8090")
+# Адреса экземпляров векторизатора через запятую, запросы распределяются между ними.
+VECTORIZE_URLS = [url.strip() for url in os.getenv("VECTORIZE_URLS", VECTORIZE_URL).split(",") if url.strip()]
+# Таймауты соединения и ответа векторизатора в секундах и кол-во повторов запроса.
+VECTORIZE_CONNECT_TIMEOUT = float(os.getenv("VECTORIZE_CONNECT_TIMEOUT", "1"))
+VECTORIZE_READ_TIMEOUT = float(os.getenv("VECTORIZE_READ_TIMEOUT", "10"))
+VECTORIZE_RETRIES = int(os.getenv("VECTORIZE_RETRIES", "2"))
+# Формат векторов в ответах векторизатора: float32, float16 (байты little-endian) или json.
+VECTORIZE_WIRE_FORMAT = os.getenv("VECTORIZE_WIRE_FORMAT", "float32")
+# Версия модели векторизатора, при смене модели кэш векторов строк поиска сбрасывается.
+VECTORIZE_MODEL_VERSION = os.getenv("VECTORIZE_MODEL_VERSION", "rubert-tiny")
+VECTORIZE_QUERY_CACHE_TIMEOUT = int(os.getenv("VECTORIZE_QUERY_CACHE_TIMEOUT", str(60 * 60)))
+# Redis для очереди расчета векторов заметок (`manage.py embedding_worker`).
+# Если не указан, то вектор считается сразу при сохранении заметки.
+EMBEDDING_QUEUE_URL = os.getenv("EMBEDDING_QUEUE_URL", "")
+VECTOR_INDEX_PATH = Path(os.getenv("VECTOR_INDEX_PATH", BASE_DIR / "vector_index"))
+# Сколько ближайших заметок отбирается векторным индексом, дальше по ним идет пагинация.
+VECTOR_SEARCH_TOP_K = int(os.getenv("VECTOR_SEARCH_TOP_K", "240"))
+# Для скольких лучших по тексту записей учитывается векторная модель в смешанном поиске, 0 - для всех.
+VECTOR_RESCORE_WINDOW = int(os.getenv("VECTOR_RESCORE_WINDOW", "0"))
+# Искать заголовки для автодополнения в памяти процесса, а не в Elasticsearch.
+AUTOCOMPLETE_PREFIX_INDEX = os.getenv("AUTOCOMPLETE_PREFIX_INDEX", "false").lower() == "true"
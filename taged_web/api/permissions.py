@@ -1,25 +1,26 @@
 from typing import cast
 
-from django.contrib.auth.models import AbstractUser
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 from rest_framework.request import Request
 from rest_framework.views import APIView
 
+from taged_web.models import User
+from taged_web.services.permissions import get_permission_snapshot
+
 
 class NotePermission(BasePermission):
     def has_permission(self, request: Request, view: APIView):
         if request.method in SAFE_METHODS:
             return True
-        user = cast(AbstractUser, request.user)
+        snapshot = get_permission_snapshot(cast(User, request.user))
         if request.method == "POST":
-            return user.has_perms(["taged_web.create_notes"])
+            return snapshot.has_perms(["taged_web.create_notes"])
         if request.method in ["PUT", "PATCH"]:
-            return user.has_perms(["taged_web.update_notes"])
+            return snapshot.has_perms(["taged_web.update_notes"])
         if request.method == "DELETE":
-            return user.has_perms(["taged_web.delete_notes"])
+            return snapshot.has_perms(["taged_web.delete_notes"])
 
 
 class NoteCreateLinkPermission(BasePermission):
     def has_permission(self, request: Request, view: APIView):
-        user = cast(AbstractUser, request.user)
-        return user.has_perms(["taged_web.create_notes_link"])
+        return get_permission_snapshot(cast(User, request.user)).has_perms(["taged_web.create_notes_link"])
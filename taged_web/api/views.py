@@ -14,6 +14,7 @@ from taged_web.api.serializers import (
 )
 from taged_web.es_index import PostIndex
 from taged_web.repo.notes import get_repository
+from taged_web.services.autocomplete import get_autocomplete_titles
 from taged_web.services.notes import (
     get_note_or_404,
     get_notes,
@@ -24,7 +25,8 @@ from taged_web.services.notes import (
     get_notes_count,
 )
 from taged_web.services.storage import add_files, get_file, delete_file
-from taged_web.services.tags import get_unavailable_tags, add_tags_to_user_if_not_exist, get_available_tags
+from taged_web.services.permissions import get_permission_snapshot
+from taged_web.services.tags import add_tags_to_user_if_not_exist
 from .types import UserGenericAPIView
 from ..services.signals import signals
 
@@ -35,7 +37,7 @@ class ListUserPermissions(UserGenericAPIView):
     def get(self, *args, **kwargs):
         # Получаем все права пользователей, которые связаны с данным приложением `taged_web`
         taged_web_permissions = filter(
-            lambda x: x.startswith("taged_web"), self.request.user.get_all_permissions()
+            lambda x: x.startswith("taged_web"), get_permission_snapshot(self.current_user()).permissions
         )
         # Приводим права "taged_web.update_note" к виду "update_note"
         permissions = map(lambda p: p.split(".")[1], taged_web_permissions)
@@ -54,9 +56,7 @@ class AutocompleteAPIView(UserGenericAPIView):
 
     def get(self, request: Request):
         try:
-            titles = get_repository().get_titles(
-                string=request.GET.get("term", ""), unavailable_tags=get_unavailable_tags(self.current_user())
-            )
+            titles = get_autocomplete_titles(request.GET.get("term", ""), self.current_user())
         except es_exceptions.ConnectionError:
             return Response([], status=500)
         else:
@@ -85,7 +85,7 @@ class NotesListCreateAPIView(UserGenericAPIView):
         которых не проверяет полученные теги на их существование в базе
         :return:
         """
-        if self.request.user.has_perms(["taged_web.add_tags"]):
+        if get_permission_snapshot(self.current_user()).has_perms(["taged_web.add_tags"]):
             return NoteSerializerNoTagsValidation
         return NoteSerializerTagsValidation
 
@@ -93,10 +93,26 @@ class NotesListCreateAPIView(UserGenericAPIView):
         search: str = request.GET.get("search", "")
         tags_in: list[str] = request.GET.getlist("tags-in", [])
         page: str = request.GET.get("page", "1")
+        # Непрозрачный курсор для бесконечной прокрутки, пустое значение - первая страница.
+        cursor: str | None = request.GET.get("cursor")
         use_vectorize_search: bool = request.GET.get("use-vectorizer", "false") == "true"
         vectorizer_only: bool = request.GET.get("vectorizer-only", "false") == "true"
-
-        return get_notes(search, tags_in, page, self.current_user(), use_vectorize_search, vectorizer_only)
+        # Кол-во лучших по тексту записей, к которым применяется векторная модель, 0 - ко всем.
+        rescore_window: str | None = request.GET.get("rescore-window")
+        # Объединить текстовый и векторный поиск через Reciprocal Rank Fusion.
+        hybrid: bool = request.GET.get("hybrid", "false") == "true"
+
+        return get_notes(
+            search,
+            tags_in,
+            page,
+            self.current_user(),
+            use_vectorize_search,
+            vectorizer_only,
+            cursor=cursor,
+            rescore_window=rescore_window,
+            hybrid=hybrid,
+        )
 
     def post(self, request: Request):
         serializer = self.get_serializer_class()(data=self.request.data)
@@ -126,7 +142,7 @@ class NoteDetailUpdateAPIView(UserGenericAPIView):
         которых не проверяет полученные теги на их существование в базе
         :return:
         """
-        if self.request.user.has_perms(["taged_web.add_tags"]):
+        if get_permission_snapshot(self.current_user()).has_perms(["taged_web.add_tags"]):
             return NoteSerializerNoTagsValidation
         return NoteSerializerTagsValidation
 
@@ -196,7 +212,7 @@ class TagsListAPIView(UserGenericAPIView):
     permission_classes = [IsAuthenticated, NotePermission]
 
     def get(self, request: Request, *args, **kwargs):
-        return Response(get_available_tags(self.current_user()))
+        return Response(sorted(get_permission_snapshot(self.current_user()).available_tags))
 
 
 class CreateNoteTempLinkAPIView(UserGenericAPIView):
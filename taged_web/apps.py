@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 
 
 class TagedWebConfig(AppConfig):
@@ -7,6 +7,21 @@ class TagedWebConfig(AppConfig):
     name = "taged_web"
 
     def ready(self):
-        from .signals import create_permission
+        from django.contrib.auth.models import Group
+
+        from .models import Tags, User
+        from .signals import create_permission, invalidate_permissions_receiver
 
         post_migrate.connect(create_permission, sender=self)
+
+        # Снимки прав пользователей (см. `services.permissions`) зависят от тегов, прав, групп и пользователей.
+        for model in [Tags, User, Group]:
+            post_save.connect(invalidate_permissions_receiver, sender=model)
+            post_delete.connect(invalidate_permissions_receiver, sender=model)
+        for through in [
+            Tags.user.through,
+            User.user_permissions.through,
+            User.groups.through,
+            Group.permissions.through,
+        ]:
+            m2m_changed.connect(invalidate_permissions_receiver, sender=through)
@@ -48,8 +48,35 @@ class PostIndex(AbstractIndex):
             }
         }
         mappings = {
-            "embedding": {"type": "dense_vector", "dims": 312},
+            "embedding": {
+                "type": "dense_vector",
+                "dims": 312,
+            },
+            # Когда `embedding_worker` записал вектор.
+            "embedded_at": {"type": "date"},
+            # Когда заметка последний раз записывалась, по нему синхронизируется векторный индекс.
+            "modified_at": {"type": "date"},
+            # Содержимое изменилось, а новый вектор получить не удалось.
+            "embedding_stale": {"type": "boolean"},
         }
+        extra_field_props = {
+            # Подполе для автодополнения: префиксы слов индексируются заранее, а не ищутся при каждом запросе.
+            "title": {"fields": {"suggest": {"type": "search_as_you_type"}}},
+            # Теги фильтруются точным совпадением, а подполе `tags.text` оставлено для полнотекстового поиска.
+            "tags": {"type": "keyword", "fields": {"text": {"type": "text"}}},
+        }
+        # Вектор нужен только Elasticsearch для поиска, читать его из `_source` незачем.
+        source_excludes = ["embedding"]
+
+    @classmethod
+    def set_vector_search_backend(cls, backend: str) -> None:
+        """
+        Настраивает поле вектора под способ поиска `VECTOR_SEARCH_BACKEND`.
+        Вызывается из настроек до регистрации индекса, т.к. настройки импортируют этот модуль.
+        """
+        if backend == "knn":
+            # Нативный kNN поиск (Elasticsearch 8.4+) требует индексировать вектор.
+            cls.Meta.mappings["embedding"].update({"index": True, "similarity": "cosine"})
 
     @staticmethod
     def get_first_image_url(content: str) -> str:
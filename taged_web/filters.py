@@ -4,7 +4,7 @@ from bs4 import BeautifulSoup
 
 from elasticsearch_control import QueryLimitParams
 from .es_index import T_Values
-from .vectorizer import vectorize
+from .vectorizer import vectorize_query
 
 
 def create_notes_query_params(
@@ -18,7 +18,11 @@ def create_notes_query_params(
     sort_desc: bool = False,
     timeout: int = 5,
     use_vectorize_search: bool = False,
-    vectorizer_only: bool = False
+    vectorizer_only: bool = False,
+    source_excludes: list[str] | None = None,
+    filter_path: list[str] | None = None,
+    rescore_window: int | None = None,
+    query_vector: list[float] | None = None,
 ) -> QueryLimitParams:
     """
     Возвращает запрос для поиска заметок.
@@ -33,6 +37,11 @@ def create_notes_query_params(
     :param timeout: Время ожидания в секундах.
     :param use_vectorize_search: Использовать векторный поиск?
     :param vectorizer_only: Использовать только векторный поиск?
+    :param source_excludes: Поля, которые не нужно возвращать из `_source`.
+    :param filter_path: Пути ответа Elasticsearch, которые нужно оставить.
+    :param rescore_window: Если указан вместе с `use_vectorize_search`, то векторная близость считается
+     только для указанного кол-ва лучших по тексту записей, а не для всех найденных.
+    :param query_vector: Вектор строки поиска, если уже получен, иначе он запрашивается у векторизатора.
     :return: :class:`QueryLimitParams`.
     """
 
@@ -61,22 +70,24 @@ def create_notes_query_params(
         query={"bool": {"must": []}},
         sort=sort_parameter,
         request_timeout=timeout,
+        source_excludes=source_excludes,
+        filter_path=filter_path,
     )
 
-    # Если переменная string пустая и переменная tags_in не пустая, то выполняется поиск по тегам.
+    # Теги проверяются в контексте фильтра: без подсчета релевантности и с кэшированием в Elasticsearch.
+    # Запись должна содержать все теги из tags_in.
     if tags_in:
-        query_params.query["bool"]["must"].append(
-            {
-                "match": {"tags": " ".join(tags_in)},
-            }
-        )
+        query_params.query["bool"]["filter"] = [{"term": {"tags": tag}} for tag in tags_in]
 
+    # Запись не должна содержать ни одного тега из tags_off.
     if tags_off:
-        query_params.query["bool"]["must_not"] = [
-            {
-                "match": {"tags": " ".join(tags_off)},
-            }
-        ]
+        query_params.query["bool"]["must_not"] = [{"terms": {"tags": tags_off}}]
+
+    if use_vectorize_search and string:
+        query_vector = query_vector or vectorize_query(string)
+        if not query_vector:
+            # Векторизатор недоступен - ищем только по тексту.
+            use_vectorize_search = vectorizer_only = False
 
     # Поиск по строке в title и content с возможностью допущения ошибок в словах.
     if string and not vectorizer_only:
@@ -94,14 +105,32 @@ def create_notes_query_params(
         ]
         query_params.query["bool"]["minimum_should_match"] = 1
 
-    if use_vectorize_search and string:
+    if use_vectorize_search and string and rescore_window and not vectorizer_only:
+        # Скрипт выполняется только для `window_size` лучших записей каждого шарда.
+        query_params.rescore = {
+            "window_size": rescore_window,
+            "query": {
+                "rescore_query": {
+                    "script_score": {
+                        "query": {"match_all": {}},
+                        "script": {
+                            "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
+                            "params": {"query_vector": query_vector},
+                        },
+                    },
+                },
+                # Как и `function_score`, умножаем оценку текстового поиска на близость векторов.
+                "score_mode": "multiply",
+            },
+        }
+    elif use_vectorize_search and string:
         query = {
             "function_score": {
                 "query": query_params.query,
                 "script_score": {
                     "script": {
                         "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                        "params": {"query_vector": vectorize(string)},
+                        "params": {"query_vector": query_vector},
                     },
                 },
             }
@@ -111,41 +140,34 @@ def create_notes_query_params(
     return query_params
 
 
-def notes_records_filter(res, tags_in: list[str], tags_off: list[str]) -> list[dict]:
+def notes_records_filter(res) -> list[dict]:
     """
-    Фильтрует полученные данные по тегам и приводит к формату записи.
+    Приводит полученные данные к формату записи.
+    Фильтрация по тегам выполняется в самом запросе, см. `create_notes_query_params`.
 
     :param res: Результат запроса.
-    :param tags_in: Теги, которые должны находиться у записи.
-    :param tags_off: Теги, которые должны отсутствовать у записи.
-    :return: Список отфильтрованных записей.
+    :return: Список записей.
     """
     # Присваивает переменной max_score максимальный балл из всех записей в ответе.
-    max_score = float(res["hits"]["max_score"] or 1)
+    max_score = float(res["hits"].get("max_score") or 1)
     result = []
     # Проверяет, есть ли хоть одна запись в ответе.
-    if res and res["hits"]["total"]["value"]:
+    if res and res["hits"]["total"]["value"] and res["hits"].get("hits"):
         for post in res["hits"]["hits"]:
             if isinstance(post["_source"]["tags"], str):
                 # Переводим один тег в список из одного тега
                 post["_source"]["tags"] = [post["_source"]["tags"]]
-            # Если имеются необходимые теги (tags_in) и они встречаются в записи, а также
-            # имеются нежелательные теги (tags_off) и они отсутствуют в записи
-            # Пересечение тегов поста и тегов поиска равно списку тегов поиска (т.е. теги поиска содержатся в посте)
-            if (
-                not tags_in or sorted(list(set(post["_source"]["tags"]) & set(tags_in))) == sorted(tags_in)
-            ) and (not tags_off or not set(post["_source"]["tags"]) & set(tags_off)):
-                result.append(
-                    {
-                        "id": post["_id"],
-                        "title": post["_source"].get("title"),
-                        "tags": post["_source"].get("tags"),
-                        "published_at": post["_source"].get("published_at"),
-                        "content": post["_source"].get("content"),
-                        "preview_image": post["_source"].get("preview_image"),
-                        "score": round(float(post["_score"] or 0) / max_score, 3),
-                    }
-                )
+            result.append(
+                {
+                    "id": post["_id"],
+                    "title": post["_source"].get("title"),
+                    "tags": post["_source"].get("tags"),
+                    "published_at": post["_source"].get("published_at"),
+                    "content": post["_source"].get("content"),
+                    "preview_image": post["_source"].get("preview_image"),
+                    "score": round(float(post["_score"] or 0) / max_score, 3),
+                }
+            )
     return result
 
 
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from taged_web.repo.exc import RepositoryException
+from taged_web.repo.notes import get_repository
+
+
+class Command(BaseCommand):
+    help = "Считает векторы заметок из очереди EMBEDDING_QUEUE_URL и записывает их в индекс"
+
+    # Пауза после пачки, для которой векторизатор не вернул ни одного вектора.
+    retry_delay = 5
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=64, help="Кол-во заметок в одной пачке векторизации"
+        )
+        parser.add_argument(
+            "--wait", type=float, default=5, help="Сколько секунд ждать заметки в пустой очереди"
+        )
+        parser.add_argument(
+            "--backfill", action="store_true", help="Посчитать векторы всех заметок без вектора и выйти"
+        )
+        parser.add_argument("--once", action="store_true", help="Выйти, когда очередь опустеет")
+
+    def handle(self, *args, **options):
+        repository = get_repository()
+        batch_size: int = options["batch_size"]
+
+        if options["backfill"]:
+            done = 0
+            for ids in repository.iter_ids_without_embedding(batch_size):
+                failed = self._apply(repository, ids)
+                done += len(ids) - len(failed)
+                self.stdout.write(f"{done} векторов записано")
+            self.stdout.write(self.style.SUCCESS(f"Готово: {done} векторов записано"))
+            return
+
+        queue = repository.embedding_queue
+        if queue is None:
+            raise CommandError("Не указана очередь EMBEDDING_QUEUE_URL")
+
+        while True:
+            ids = queue.pop(batch_size, timeout=options["wait"])
+            if not ids:
+                if options["once"]:
+                    break
+                continue
+
+            started_at = time.monotonic()
+            failed = self._apply(repository, ids)
+            self.stdout.write(
+                f"{len(ids) - len(failed)} из {len(ids)} векторов за {time.monotonic() - started_at:.2f} сек,"
+                f" в очереди {len(queue)}"
+            )
+            if failed:
+                # Векторизатор или Elasticsearch недоступны, заметки вернутся в очередь.
+                queue.push(failed)
+                if len(failed) == len(ids):
+                    time.sleep(self.retry_delay)
+
+    def _apply(self, repository, ids: list[str]) -> list[str]:
+        try:
+            return repository.apply_embeddings(ids)
+        except RepositoryException:
+            self.stderr.write("Elasticsearch недоступен")
+            return ids
@@ -0,0 +1,148 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch import exceptions
+
+from elasticsearch_control.bulk import bulk_write, iter_hit_batches
+from elasticsearch_control.transport import es_connector
+from taged_web.es_index import PostIndex
+from taged_web.repo.notes import get_embedding_text
+from taged_web.vectorizer import vectorize_many
+
+
+class Command(BaseCommand):
+    help = "Перестраивает векторы всех заметок и записывает их пачками в целевой индекс"
+
+    # Однозначная сортировка, по значениям которой можно продолжить чтение после перезапуска.
+    sort = [{"published_at": "asc"}, {"_id": "asc"}]
+    # Чтение идет внутри point-in-time, чтобы изменения заметок во время переноса не сдвигали пачки.
+    pit_keep_alive = "5m"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default=PostIndex.Meta.index_name, help="Индекс, из которого читать")
+        parser.add_argument("--target", default=None, help="Индекс, в который писать (по умолчанию --source)")
+        parser.add_argument(
+            "--batch-size", type=int, default=64, help="Кол-во заметок в одной пачке векторизации"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=500, help="Кол-во документов в одном запросе _bulk"
+        )
+        parser.add_argument("--threads", type=int, default=4, help="Кол-во параллельных запросов _bulk")
+        parser.add_argument("--checkpoint", type=Path, default=None, help="Файл для сохранения прогресса")
+        parser.add_argument(
+            "--no-embed", action="store_true", help="Копировать документы без пересчета векторов"
+        )
+
+    def handle(self, *args, **options):
+        es = es_connector.es
+        source: str = options["source"]
+        target: str = options["target"] or source
+        checkpoint: Path | None = options["checkpoint"]
+        embed: bool = not options["no_embed"]
+
+        if not es.indices.exists(index=target):
+            es.indices.create(index=target, body=PostIndex.get_index_settings())
+            self.stdout.write(f"Создан индекс {target}")
+
+        search_after, processed = None, 0
+        if checkpoint and checkpoint.exists():
+            state = json.loads(checkpoint.read_text())
+            if state.get("source") != source or state.get("target") != target:
+                raise CommandError(f"Checkpoint {checkpoint} создан для другой пары индексов")
+            search_after, processed = state["search_after"], state["processed"]
+            self.stdout.write(f"Продолжаем с {processed} заметок")
+
+        started_at = time.monotonic()
+        done_in_run = 0
+        # Документы записываются группами, которых хватает на все потоки `_bulk`.
+        group_size = options["chunk_size"] * options["threads"]
+        group: list[dict] = []
+        try:
+            for hits in iter_hit_batches(
+                es,
+                source,
+                sort=self.sort,
+                size=min(options["chunk_size"], 10_000),
+                search_after=search_after,
+                # Старый вектор читается тоже: он остается, если новый получить не удалось.
+                request_timeout=es_connector.timeout * 6,
+                pit_keep_alive=self.pit_keep_alive,
+            ):
+                group += hits
+                if len(group) < group_size:
+                    continue
+                processed += self._write_group(group, target, embed, checkpoint, source, processed, options)
+                done_in_run += len(group)
+                group = []
+                elapsed = time.monotonic() - started_at
+                self.stdout.write(f"{processed} заметок, {done_in_run / elapsed:.1f} заметок/сек")
+
+            if group:
+                processed += self._write_group(group, target, embed, checkpoint, source, processed, options)
+        except exceptions.ElasticsearchException as exc:
+            raise CommandError(f"Ошибка Elasticsearch: {exc}")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: {processed} заметок записано в {target}"))
+        if checkpoint and checkpoint.exists():
+            checkpoint.unlink()
+
+    def _write_group(
+        self,
+        hits: list[dict],
+        target: str,
+        embed: bool,
+        checkpoint: Path | None,
+        source: str,
+        processed: int,
+        options: dict,
+    ) -> int:
+        """
+        Пересчитывает векторы группы заметок и записывает её одним вызовом `bulk_write`,
+        пачки `--chunk-size` которого отправляются параллельно в `--threads` потоков.
+        Заметки, для которых вектор получить не удалось, записываются со старым вектором и помечаются устаревшими.
+        :return: Кол-во записанных заметок.
+        """
+        if embed:
+            vectors = vectorize_many(
+                [
+                    get_embedding_text(hit["_source"].get("title", ""), hit["_source"].get("content", ""))
+                    for hit in hits
+                ],
+                batch_size=options["batch_size"],
+            )
+            for hit, vector in zip(hits, vectors):
+                if vector:
+                    hit["_source"]["embedding"] = vector
+                    hit["_source"]["embedding_stale"] = False
+                else:
+                    # Векторизатор недоступен: старый вектор сохраняется, а новый посчитает
+                    # `embedding_worker --backfill`.
+                    hit["_source"]["embedding_stale"] = True
+
+        _, errors = bulk_write(
+            es_connector.es,
+            (
+                {"_op_type": "index", "_index": target, "_id": hit["_id"], "_source": hit["_source"]}
+                for hit in hits
+            ),
+            chunk_size=options["chunk_size"],
+            thread_count=options["threads"],
+            request_timeout=es_connector.timeout * 6,
+        )
+        if errors:
+            raise CommandError(f"Не удалось записать {len(errors)} документов: {errors[:3]}")
+
+        if checkpoint:
+            checkpoint.write_text(
+                json.dumps(
+                    {
+                        "source": source,
+                        "target": target,
+                        "search_after": hits[-1]["sort"],
+                        "processed": processed + len(hits),
+                    }
+                )
+            )
+        return len(hits)
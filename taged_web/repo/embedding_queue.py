@@ -0,0 +1,44 @@
+import redis
+from django.conf import settings
+
+
+class EmbeddingQueue:
+    """
+    Очередь идентификаторов заметок, для которых нужно посчитать вектор, в списке Redis.
+
+    Заметки попадают в очередь при сохранении, а векторы считает команда `embedding_worker`.
+    Если обработчик упал посреди пачки, то её заметки из очереди теряются, их векторы остаются старыми
+    (у новых заметок вектора нет, такие заметки находит `embedding_worker --backfill`).
+    """
+
+    def __init__(self, url: str, key: str = "embedding:queue"):
+        self._redis = redis.Redis.from_url(url)
+        self._key = key
+
+    def push(self, ids: list[str]) -> None:
+        if ids:
+            self._redis.lpush(self._key, *ids)
+
+    def pop(self, count: int, timeout: float = 5) -> list[str]:
+        """
+        Ждет первую заметку не дольше `timeout` секунд и забирает до `count` заметок из очереди.
+        Повторы одной и той же заметки убираются.
+        """
+        first = self._redis.brpop([self._key], timeout=timeout)
+        if first is None:
+            return []
+        rest = self._redis.rpop(self._key, count - 1) if count > 1 else None
+        ids = [first[1], *(rest or [])]
+        return list(dict.fromkeys(id_.decode() for id_ in ids))
+
+    def __len__(self) -> int:
+        return self._redis.llen(self._key)
+
+
+def create_embedding_queue() -> EmbeddingQueue | None:
+    """
+    Создает очередь по настройке `EMBEDDING_QUEUE_URL`.
+    Если она не указана, то векторы считаются сразу при сохранении заметки.
+    """
+    url = getattr(settings, "EMBEDDING_QUEUE_URL", "")
+    return EmbeddingQueue(url) if url else None
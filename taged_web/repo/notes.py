@@ -1,23 +1,92 @@
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Iterable
 
 from django.conf import settings
 from elasticsearch import Elasticsearch, exceptions
 
 from elasticsearch_control import ElasticsearchPaginator
+from elasticsearch_control.limiter import QueryLimitParams, RankedPaginator
+from elasticsearch_control.ranking import reciprocal_rank_fusion
+from elasticsearch_control.bulk import bulk_write, iter_hit_batches
+from elasticsearch_control.cache import QueryCache
 from elasticsearch_control.transport import es_connector
+from elasticsearch_control.vectors import NumpyVectorIndex, VectorIndex
+from elasticsearch_control.write_block import retry_when_write_blocked
+from .embedding_queue import EmbeddingQueue, create_embedding_queue
 from .exc import NotFoundError, RepositoryException
 from ..es_index import PostFile, PostIndex, T_Values
 from ..filters import create_notes_query_params, remove_html_tags
-from ..vectorizer import vectorize
+from .vector_index import create_vector_index
+from ..vectorizer import is_vectorizer_available, vectorize, vectorize_many, vectorize_query
+
+# Потоки для параллельного выполнения частей гибридного поиска.
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="notes-search")
+
+
+def get_embedding_text(title: str, content: str) -> str:
+    """Текст заметки, по которому строится её вектор."""
+    return f'Заголовок: "{title}"!' + remove_html_tags(content)
 
 
 class NotesRepository:
-    def __init__(self, es: Elasticsearch, index: str, timeout: int = 5):
+    # Части ответа поиска, которые используются при разборе результатов, остальное не передается.
+    search_filter_path = [
+        "pit_id",
+        "hits.total",
+        "hits.max_score",
+        "hits.hits._id",
+        "hits.hits._score",
+        "hits.hits._source",
+        "hits.hits.sort",
+    ]
+    # Кол-во документов в одном запросе `_bulk` и кол-во параллельных запросов.
+    bulk_chunk_size = 500
+    bulk_thread_count = 4
+    # Сколько секунд повторять запись, пока индекс закрыт на запись на время перехода на новую версию.
+    write_blocked_timeout = 10
+    # Сглаживание Reciprocal Rank Fusion для гибридного поиска.
+    rrf_k = 60
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        index: str,
+        timeout: int = 5,
+        track_total_hits: bool | int = True,
+        source_excludes: list[str] | None = None,
+        vector_index: VectorIndex | None = None,
+        vector_top_k: int = 240,
+        embedding_queue: EmbeddingQueue | None = None,
+    ):
+        """
+        :param es: Объект Elasticsearch.
+        :param index: Название индекса заметок.
+        :param timeout: Таймаут запросов.
+        :param track_total_hits: Предел подсчета кол-ва найденных записей (`True` - считать точно).
+         Кол-во записей получается тем же запросом, что и сами записи.
+        :param source_excludes: Поля, которые никогда не читаются из `_source`,
+         по умолчанию берутся из `PostIndex.Meta.source_excludes`.
+        :param vector_index: Индекс для поиска только по векторной модели. Если не указан,
+         то близость векторов считается скриптом Elasticsearch для каждой подходящей заметки.
+        :param vector_top_k: Сколько ближайших заметок возвращает поиск по векторному индексу.
+        :param embedding_queue: Очередь для расчета векторов в фоне. Если не указана,
+         то векторы считаются сразу при сохранении заметок.
+        """
         self._es = es
         self._timeout = timeout
+        self._track_total_hits = track_total_hits
+        self._source_excludes = PostIndex.Meta.source_excludes if source_excludes is None else source_excludes
         self.index = index
+        self._vector_index = vector_index
+        self._vector_top_k = vector_top_k
+        self._embedding_queue = embedding_queue
+
+    @property
+    def embedding_queue(self) -> EmbeddingQueue | None:
+        return self._embedding_queue
 
     def get(self, id_: str, values: list[T_Values] | None = None) -> PostIndex:
         """
@@ -33,12 +102,14 @@ class NotesRepository:
                 id=id_,
                 request_timeout=self._timeout,
                 _source=list(values) if values else None,
+                _source_excludes=self._source_excludes or None,
+                filter_path=["_source"],
             )
         except exceptions.ElasticsearchException:
             raise NotFoundError
 
         post = PostIndex()
-        data: dict = response["_source"]
+        data: dict = response.get("_source", {})
 
         # Если теги были получены и они в виде list, то переводим их в строку тегов, разделенную `, `
         if data.get("tags") and isinstance(data["tags"], list):
@@ -75,23 +146,35 @@ class NotesRepository:
         post.published_at = datetime.now()
         post.preview_image = preview_image
 
-        document = post.json()
-        document["embedding"] = vectorize(f'Заголовок: "{post.title}"!' + remove_html_tags(post.content))
+        document = {**post.json(), **self._modified_fields()}
+        if self._embedding_queue is None:
+            embedding = vectorize(get_embedding_text(post.title, post.content))
+            # Заметку без вектора найдет `embedding_worker --backfill`.
+            if embedding:
+                document["embedding"] = embedding
 
         try:
-            result = self._es.index(
-                index=self.index, id=str(uuid.uuid4()), document=document, request_timeout=self._timeout
+            id_ = str(uuid.uuid4())
+            result = retry_when_write_blocked(
+                lambda: self._es.index(
+                    index=self.index, id=id_, document=document, request_timeout=self._timeout
+                ),
+                timeout=self.write_blocked_timeout,
             )
         except exceptions.ElasticsearchException:
             raise RepositoryException
 
         post.id = result.get("_id", "")
+        if self._embedding_queue is not None:
+            self._embedding_queue.push([post.id])
         return post
 
     def delete(self, id_: str) -> bool:
         """Удаляет запись"""
         try:
-            result = self._es.delete(index=self.index, id=id_)
+            result = retry_when_write_blocked(
+                lambda: self._es.delete(index=self.index, id=id_), timeout=self.write_blocked_timeout
+            )
         except exceptions.ElasticsearchException:
             return False
         return result["_shards"].get("failed") == 0
@@ -106,19 +189,213 @@ class NotesRepository:
             data = instance
         else:
             data = {k: v for k, v in instance.items() if k in values}
+        data = {**data, **self._modified_fields()}
 
-        if "content" in data:
-            data["embedding"] = vectorize(
-                f"Заголовок: \"{instance['title']}\"!" + remove_html_tags(data["content"])
-            )
+        if "content" in data and self._embedding_queue is None:
+            data = {
+                **data,
+                **self._embedding_fields(vectorize(get_embedding_text(instance["title"], data["content"]))),
+            }
 
         try:
-            self._es.update(index=self.index, id=id_, body={"doc": data}, request_timeout=self._timeout)
+            retry_when_write_blocked(
+                lambda: self._es.update(
+                    index=self.index, id=id_, body={"doc": data}, request_timeout=self._timeout
+                ),
+                timeout=self.write_blocked_timeout,
+            )
         except exceptions.ElasticsearchException:
             return False
+        if "content" in data and self._embedding_queue is not None:
+            self._embedding_queue.push([id_])
         instance["id"] = id_
         return instance
 
+    def create_many(
+        self,
+        notes: Iterable[dict],
+        chunk_size: int | None = None,
+        thread_count: int | None = None,
+    ) -> list[PostIndex]:
+        """
+        Создает заметки пачками через `_bulk` API.
+        Векторы для всех заметок запрашиваются одним вызовом `vectorize_many` либо считаются в фоне.
+
+        :param notes: Словари с полями `title`, `tags`, `content`, `preview_image`.
+        :param chunk_size: Кол-во документов в одном запросе `_bulk`.
+        :param thread_count: Кол-во параллельных запросов `_bulk`.
+        :return: Созданные заметки, заметки с ошибкой записи не возвращаются.
+        """
+        posts: list[PostIndex] = []
+        for note in notes:
+            post = PostIndex()
+            post.id = str(uuid.uuid4())
+            post.title = note["title"]
+            post.tags = ", ".join(note["tags"])
+            post.content = note["content"]
+            post.published_at = datetime.now()
+            post.preview_image = note["preview_image"]
+            posts.append(post)
+
+        modified = self._modified_fields()
+        actions = [
+            {
+                "_op_type": "index",
+                "_index": self.index,
+                "_id": post.id,
+                "_source": {**post.json(), **modified},
+            }
+            for post in posts
+        ]
+        if self._embedding_queue is None:
+            vectors = vectorize_many([get_embedding_text(post.title, post.content) for post in posts])
+            for action, vector in zip(actions, vectors):
+                # Заметку без вектора найдет `embedding_worker --backfill`.
+                if vector:
+                    action["_source"]["embedding"] = vector
+
+        failed_ids = self._bulk(actions, chunk_size, thread_count)
+        created = [post for post in posts if post.id not in failed_ids]
+        if self._embedding_queue is not None:
+            self._embedding_queue.push([post.id for post in created])
+        return created
+
+    def update_many(
+        self,
+        instances: dict[str, dict],
+        values: list[T_Values] | None = None,
+        chunk_size: int | None = None,
+        thread_count: int | None = None,
+    ) -> list[str]:
+        """
+        Частично обновляет заметки пачками через `_bulk` API, аналогично `update`.
+
+        :param instances: Словарь `{id заметки: поля заметки}`.
+        :param values: Поля, которые нужно сохранить, либо `None`, тогда сохраняются все поля.
+        :param chunk_size: Кол-во документов в одном запросе `_bulk`.
+        :param thread_count: Кол-во параллельных запросов `_bulk`.
+        :return: Идентификаторы обновленных заметок.
+        """
+        docs: dict[str, dict] = {}
+        for id_, instance in instances.items():
+            docs[id_] = instance if values is None else {k: v for k, v in instance.items() if k in values}
+
+        # Векторы нужны только для заметок с измененным содержимым.
+        embed_ids = [id_ for id_, data in docs.items() if "content" in data]
+        if self._embedding_queue is None:
+            vectors = vectorize_many(
+                [get_embedding_text(instances[id_]["title"], docs[id_]["content"]) for id_ in embed_ids]
+            )
+            for id_, vector in zip(embed_ids, vectors):
+                docs[id_] = {**docs[id_], **self._embedding_fields(vector)}
+
+        modified = self._modified_fields()
+        actions = [
+            {"_op_type": "update", "_index": self.index, "_id": id_, "doc": {**data, **modified}}
+            for id_, data in docs.items()
+        ]
+        failed_ids = self._bulk(actions, chunk_size, thread_count)
+        if self._embedding_queue is not None:
+            self._embedding_queue.push([id_ for id_ in embed_ids if id_ not in failed_ids])
+        return [id_ for id_ in docs if id_ not in failed_ids]
+
+    @staticmethod
+    def _modified_fields() -> dict:
+        """Время изменения заметки, по нему векторный индекс подтягивает изменения из других процессов."""
+        return {"modified_at": datetime.now().isoformat()}
+
+    @staticmethod
+    def _embedding_fields(vector: list[float]) -> dict:
+        """
+        Поля вектора для частичного обновления заметки с измененным содержимым.
+        Пустой вектор не записывается (Elasticsearch его не примет), а старый вектор помечается
+        устаревшим, чтобы его пересчитал `embedding_worker --backfill`.
+        """
+        if vector:
+            return {"embedding": vector, "embedding_stale": False}
+        return {"embedding_stale": True}
+
+    def apply_embeddings(self, ids: list[str], chunk_size: int | None = None) -> list[str]:
+        """
+        Считает векторы заметок по их текущему содержимому одним вызовом `vectorize_many`
+        и записывает их частичным обновлением через `_bulk` API.
+
+        :param ids: Идентификаторы заметок, удаленные заметки пропускаются.
+        :param chunk_size: Кол-во документов в одном запросе `_bulk`.
+        :return: Идентификаторы заметок, для которых не удалось получить или записать вектор.
+        """
+        try:
+            response = self._es.mget(
+                index=self.index,
+                body={"ids": ids},
+                _source=["title", "content"],
+                request_timeout=self._timeout,
+            )
+        except exceptions.ElasticsearchException:
+            raise RepositoryException
+        docs = [doc for doc in response["docs"] if doc.get("found")]
+
+        vectors = vectorize_many(
+            [
+                get_embedding_text(doc["_source"].get("title", ""), doc["_source"].get("content", ""))
+                for doc in docs
+            ]
+        )
+        embedded_at = datetime.now().isoformat()
+        actions = [
+            {
+                "_op_type": "update",
+                "_index": self.index,
+                "_id": doc["_id"],
+                "doc": {
+                    "embedding": vector,
+                    "embedding_stale": False,
+                    "embedded_at": embedded_at,
+                    "modified_at": embedded_at,
+                },
+            }
+            for doc, vector in zip(docs, vectors)
+            if vector
+        ]
+        failed_ids = self._bulk(actions, chunk_size, self.bulk_thread_count)
+        return [doc["_id"] for doc, vector in zip(docs, vectors) if not vector or doc["_id"] in failed_ids]
+
+    def iter_ids_without_embedding(self, batch_size: int | None = None) -> Iterable[list[str]]:
+        """Выдает пачками идентификаторы заметок, у которых нет вектора или он устарел."""
+        for hits in iter_hit_batches(
+            self._es,
+            self.index,
+            sort=[{"published_at": "asc"}, {"_id": "asc"}],
+            query={
+                "bool": {
+                    "should": [
+                        {"bool": {"must_not": [{"exists": {"field": "embedding"}}]}},
+                        {"term": {"embedding_stale": True}},
+                    ],
+                    "minimum_should_match": 1,
+                }
+            },
+            size=batch_size or self.bulk_chunk_size,
+            source=False,
+            request_timeout=self._timeout,
+        ):
+            yield [hit["_id"] for hit in hits]
+
+    def _bulk(self, actions: list[dict], chunk_size: int | None, thread_count: int | None) -> set[str]:
+        """Выполняет действия `_bulk` и возвращает идентификаторы документов, которые не удалось записать."""
+        try:
+            _, errors = bulk_write(
+                self._es,
+                actions,
+                chunk_size=chunk_size or self.bulk_chunk_size,
+                thread_count=thread_count or self.bulk_thread_count,
+                request_timeout=self._timeout,
+            )
+        except exceptions.ElasticsearchException:
+            raise RepositoryException
+        # Ошибка имеет вид `{"index": {"_id": ..., "error": ...}}`.
+        return {info.get("_id") for error in errors for info in error.values()}
+
     def filter(
         self,
         tags_in: list[str] | None = None,
@@ -130,6 +407,9 @@ class NotesRepository:
         convert_result=None,
         use_vectorize_search: bool = False,
         vectorizer_only: bool = False,
+        rescore_window: int | None = None,
+        hybrid: bool = False,
+        query_cache: QueryCache | None = None,
     ):
         """
         Возвращает список записей, которые были отфильтрованы.
@@ -143,8 +423,32 @@ class NotesRepository:
         :param convert_result: Функция, которая будет преобразовывать результат запроса в объект.
         :param use_vectorize_search: Использовать векторную модель для поиска?
         :param vectorizer_only: Использовать только векторную модель для поиска?
+        :param rescore_window: Кол-во лучших по тексту записей, для которых учитывается векторная модель.
+         Остальные записи в выдачу не попадают.
+        :param hybrid: Гибридный поиск: текстовый и векторный поиск выполняются параллельно,
+         а их рейтинги объединяются через Reciprocal Rank Fusion.
+        :param query_cache: Кэш ответов Elasticsearch на запросы страниц.
         :return: `ElasticsearchPaginator`.
         """
+        if (use_vectorize_search or vectorizer_only or hybrid) and not is_vectorizer_available():
+            # Векторизатор недоступен - ищем только по тексту, не дожидаясь ошибок.
+            use_vectorize_search = vectorizer_only = hybrid = False
+
+        if hybrid and string:
+            return self._filter_hybrid(
+                tags_in or [], tags_off or [], string, values, convert_result, query_cache
+            )
+
+        if vectorizer_only and string and self._vector_index is not None:
+            self._vector_index.sync()
+            if self._vector_index.ready:
+                paginator = self._filter_by_vector_index(
+                    tags_in or [], tags_off or [], string, values, convert_result, query_cache
+                )
+                if paginator is not None:
+                    return paginator
+            use_vectorize_search = vectorizer_only = False
+
         query_params = create_notes_query_params(
             self.index,
             tags_in=tags_in or [],
@@ -156,47 +460,239 @@ class NotesRepository:
             timeout=self._timeout,
             use_vectorize_search=use_vectorize_search,
             vectorizer_only=vectorizer_only,
+            source_excludes=self._source_excludes,
+            filter_path=self.search_filter_path,
+            rescore_window=rescore_window,
         )
         return ElasticsearchPaginator(
             es=self._es,
             params=query_params,
             convert_result=convert_result,
+            # Записи за пределами окна пересчета не учитываются.
+            track_total_hits=rescore_window if query_params.rescore else self._track_total_hits,
+            query_cache=query_cache,
+        )
+
+    def _filter_by_vector_index(
+        self,
+        tags_in: list[str],
+        tags_off: list[str],
+        string: str,
+        values: list[T_Values] | None,
+        convert_result,
+        query_cache: QueryCache | None = None,
+    ) -> RankedPaginator | None:
+        """
+        Поиск только по векторной модели через векторный индекс.
+        Индекс отбирает ближайшие заметки, а Elasticsearch возвращает только заметки запрошенной страницы.
+        Рейтинг кэшируется в `query_cache`, при попадании в кэш векторизатор не вызывается.
+
+        :return: `None`, если векторизатор недоступен.
+        """
+
+        def get_ranking() -> list[tuple[str, float]] | None:
+            query_vector = vectorize_query(string)
+            if not query_vector:
+                return None
+            return self._vector_index.search(
+                query_vector, self._vector_top_k, must_have=tags_in, must_not_have=tags_off
+            )
+
+        ranking = self._get_cached_ranking(
+            query_cache,
+            {"ranking": "vector", "string": string, "tags_in": tags_in, "tags_off": tags_off},
+            get_ranking,
+            cache_if=lambda result: result is not None,
+        )
+        if ranking is None:
+            return None
+        # Запрос без строки поиска содержит только фильтры по тегам.
+        query_params = create_notes_query_params(
+            self.index,
             tags_in=tags_in,
             tags_off=tags_off,
+            values=values,
+            timeout=self._timeout,
+            source_excludes=self._source_excludes,
+            filter_path=self.search_filter_path,
+        )
+        return RankedPaginator(
+            es=self._es,
+            params=query_params,
+            ranking=ranking,
+            convert_result=convert_result,
+            query_cache=query_cache,
+        )
+
+    def _filter_hybrid(
+        self,
+        tags_in: list[str],
+        tags_off: list[str],
+        string: str,
+        values: list[T_Values] | None,
+        convert_result,
+        query_cache: QueryCache | None = None,
+    ) -> RankedPaginator:
+        """
+        Гибридный поиск. Время ответа близко к самой медленной из частей, а не к их сумме.
+        Обе части возвращают только идентификаторы, документы страницы затем получает `RankedPaginator`.
+        Объединенный рейтинг кэшируется в `query_cache`, при попадании в кэш части не выполняются.
+        """
+        query_kwargs = {
+            "tags_in": tags_in,
+            "tags_off": tags_off,
+            "timeout": self._timeout,
+            "source_excludes": self._source_excludes,
+            "filter_path": self.search_filter_path,
+        }
+
+        def get_ranking() -> tuple[list[tuple[str, float]], bool]:
+            lexical = _search_executor.submit(
+                self._get_ranking, create_notes_query_params(self.index, string=string, **query_kwargs)
+            )
+            vector = _search_executor.submit(self._get_vector_ranking, string, query_kwargs)
+            vector_ranking = vector.result()
+            ranking = reciprocal_rank_fusion(
+                lexical.result(), vector_ranking or [], k=self.rrf_k, size=self._vector_top_k
+            )
+            # Рейтинг без векторной части (векторизатор недоступен) не кэшируется.
+            return ranking, vector_ranking is not None
+
+        ranking, _ = self._get_cached_ranking(
+            query_cache,
+            {"ranking": "hybrid", "string": string, "tags_in": tags_in, "tags_off": tags_off},
+            get_ranking,
+            cache_if=lambda result: result[1],
+        )
+        return RankedPaginator(
+            es=self._es,
+            params=create_notes_query_params(self.index, values=values, **query_kwargs),
+            ranking=ranking,
+            convert_result=convert_result,
+            query_cache=query_cache,
         )
 
-    def get_titles(self, string: str, unavailable_tags: list[str]) -> list[str]:
+    def _get_cached_ranking(self, query_cache: QueryCache | None, params: dict, function, cache_if=None):
+        """
+        Возвращает рейтинг из `query_cache`, либо вычисляет его через `function`.
+        Ключ учитывает индекс и размер рейтинга, версия и отпечаток прав берутся из `query_cache`.
+        """
+        if query_cache is None:
+            return function()
+        params = {**params, "index": self.index, "size": self._vector_top_k, "rrf_k": self.rrf_k}
+        return query_cache.get_or_set(params, function, cache_if=cache_if)
+
+    def _get_vector_ranking(self, string: str, query_kwargs: dict) -> list[tuple[str, float]] | None:
+        """Векторный рейтинг, либо `None`, если векторизатор недоступен."""
+        query_vector = vectorize_query(string)
+        if not query_vector:
+            return None
+        if self._vector_index is not None:
+            self._vector_index.sync()
+            if self._vector_index.ready:
+                return self._vector_index.search(
+                    query_vector,
+                    self._vector_top_k,
+                    must_have=query_kwargs["tags_in"],
+                    must_not_have=query_kwargs["tags_off"],
+                )
+        query_params = create_notes_query_params(
+            self.index,
+            string=string,
+            use_vectorize_search=True,
+            vectorizer_only=True,
+            query_vector=query_vector,
+            **query_kwargs,
+        )
+        return self._get_ranking(query_params)
+
+    def _get_ranking(self, params: QueryLimitParams) -> list[tuple[str, float]]:
+        """Возвращает `_vector_top_k` лучших по запросу записей в виде пар `(id записи, оценка)`."""
+        res = self._es.search(
+            index=params.index,
+            query=params.query,
+            size=self._vector_top_k,
+            _source=False,
+            track_total_hits=False,
+            filter_path=["hits.hits._id", "hits.hits._score"],
+            request_timeout=params.request_timeout,
+        )
+        return [(hit["_id"], hit["_score"]) for hit in res.get("hits", {}).get("hits", [])]
+
+    def get_embedding(self, id_: str) -> list[float]:
+        """Возвращает вектор заметки, либо пустой список, если его нет."""
+        try:
+            response = self._es.get(
+                index=self.index,
+                id=id_,
+                _source=["embedding"],
+                filter_path=["_source"],
+                request_timeout=self._timeout,
+            )
+        except exceptions.ElasticsearchException:
+            return []
+        return response.get("_source", {}).get("embedding") or []
+
+    def update_vector_index(self, id_: str, tags: list[str]) -> None:
+        """Добавляет или обновляет вектор заметки в векторном индексе."""
+        if isinstance(self._vector_index, NumpyVectorIndex):
+            self._vector_index.upsert(id_, self.get_embedding(id_), tags)
+
+    def remove_from_vector_index(self, id_: str) -> None:
+        if isinstance(self._vector_index, NumpyVectorIndex):
+            self._vector_index.remove(id_)
+
+    def get_titles(self, string: str, unavailable_tags: list[str], size: int = 10) -> list[str]:
         """
         ## Возвращает заголовки, которые соответствуют искомой строке.
 
+        Последнее слово строки ищется как префикс по заранее проиндексированным n-граммам
+        подполя `title.suggest`, поэтому запрос не строит нечеткие автоматы на каждое нажатие клавиши.
+
         :param string: Строка для поиска.
         :param unavailable_tags: Недоступные пользователю теги.
+        :param size: Максимальное кол-во заголовков.
         :return: Список заголовков, которые соответствуют искомой подстроке или пустой список.
         """
 
-        # Поиск по строке в title и content
         res = self._es.search(
             index=self.index,
-            _source=["title", "tags"],
+            _source=["title"],
+            size=size,
             query={
                 "bool": {
                     "must": [
                         {
-                            "match": {
-                                "title": {"query": string, "fuzziness": "auto"},
+                            "multi_match": {
+                                "query": string,
+                                "type": "bool_prefix",
+                                "fields": ["title.suggest", "title.suggest._2gram", "title.suggest._3gram"],
                             },
                         },
                     ],
-                    "must_not": [{"match": {"tags": " ".join(unavailable_tags)}}],
+                    "must_not": [{"terms": {"tags": unavailable_tags}}],
                 }
             },
+            track_total_hits=False,
+            filter_path=["hits.hits._source.title"],
             request_timeout=self._timeout,
         )
-        # Проверяет, есть ли хоть одна запись в ответе.
-        if res["hits"]["total"]["value"]:
-            return [line["_source"]["title"] for line in res["hits"]["hits"]]
-        else:
-            return []
+        # Если записей нет, то после `filter_path` в ответе не будет `hits`.
+        return [line["_source"]["title"] for line in res.get("hits", {}).get("hits", [])]
+
+    def iter_titles(self, unavailable_tags: list[str]) -> Iterable[str]:
+        """Выдает заголовки всех заметок, у которых нет недоступных тегов."""
+        for hits in iter_hit_batches(
+            self._es,
+            self.index,
+            sort=[{"published_at": "asc"}, {"_id": "asc"}],
+            query={"bool": {"must_not": [{"terms": {"tags": unavailable_tags}}]}},
+            size=self.bulk_chunk_size,
+            source=["title"],
+            request_timeout=self._timeout,
+        ):
+            for hit in hits:
+                yield hit["_source"].get("title") or ""
 
     @staticmethod
     def get_files(id_: str) -> list[PostFile]:
@@ -219,7 +715,7 @@ class NotesRepository:
         try:
             return self._es.count(
                 index=self.index,
-                body={"query": {"match": {"tags": tag_name}}},
+                body={"query": {"term": {"tags": tag_name}}},
                 request_timeout=self._timeout,
             )["count"]
         except exceptions.ElasticsearchException:
@@ -232,5 +728,13 @@ _repo_instance: NotesRepository | None = None
 def get_repository() -> NotesRepository:
     global _repo_instance
     if _repo_instance is None:
-        _repo_instance = NotesRepository(es_connector.es, PostIndex.Meta.index_name, es_connector.timeout)
+        _repo_instance = NotesRepository(
+            es_connector.es,
+            PostIndex.Meta.index_name,
+            es_connector.timeout,
+            track_total_hits=getattr(settings, "NOTES_TRACK_TOTAL_HITS", True),
+            vector_index=create_vector_index(es_connector.es, PostIndex.Meta.index_name),
+            vector_top_k=getattr(settings, "VECTOR_SEARCH_TOP_K", 240),
+            embedding_queue=create_embedding_queue(),
+        )
     return _repo_instance
@@ -0,0 +1,130 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from elasticsearch import Elasticsearch
+
+from elasticsearch_control.bulk import iter_hit_batches
+from elasticsearch_control.vectors import ElasticsearchKnnIndex, NumpyVectorIndex, VectorIndex
+from ..es_index import PostIndex
+
+
+class NotesVectorIndex(NumpyVectorIndex):
+    """
+    Локальный векторный индекс заметок.
+
+    Заметки, измененные в текущем процессе, попадают в индекс сразу через сигналы,
+    изменения из других процессов подтягиваются по `modified_at` не чаще чем раз в `sync_interval` секунд.
+    Удаленные в других процессах заметки остаются в индексе до перестроения,
+    но не попадают в выдачу, т.к. документы затем получаются из Elasticsearch.
+    """
+
+    sync_interval = 10
+    # Запас по времени, чтобы не пропустить записи, которые стали видны в поиске позже своего `modified_at`.
+    sync_margin = timedelta(minutes=1)
+    # После стольких добавленных или удаленных векторов индекс сохраняется на диск.
+    save_threshold = 1000
+    batch_size = 1000
+    build_lock_timeout = 60 * 30
+
+    def __init__(self, es: Elasticsearch, index: str, path: Path | str, dims: int, timeout: int = 30):
+        super().__init__(path, dims)
+        self._es = es
+        self._index = index
+        self._timeout = timeout
+        self._lock_key = f"vectorIndexLock:{index}"
+        self._building = False
+        self._last_sync = time.monotonic()
+        self._ready = self.load()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def sync(self) -> None:
+        """
+        Подготавливает индекс к поиску.
+        Если индекса еще нет, то запускает его построение в фоне, иначе догоняет изменения заметок.
+        """
+        if not self._ready:
+            # Индекс мог быть построен другим процессом.
+            self._ready = self.load()
+            if not self._ready and not self._building:
+                self._building = True
+                threading.Thread(target=self._build, daemon=True).start()
+            return
+
+        if time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = time.monotonic()
+
+        synced_at = datetime.now().isoformat()
+        since = datetime.fromisoformat(self.synced_at) - self.sync_margin if self.synced_at else None
+        # `modified_at` меняет любая запись заметки, в том числе изменение тегов и вектор от `embedding_worker`.
+        query = {"range": {"modified_at": {"gte": since.isoformat()}}} if since else None
+        for id_, vector, labels in self._iter_notes(query):
+            self.upsert(id_, vector, labels)
+        self.synced_at = synced_at
+
+        if self.unsaved_rows + self.dead_rows >= self.save_threshold and cache.add(
+            self._lock_key, True, self.build_lock_timeout
+        ):
+            # Сохранение заново обучает кластеры IVF, запрос поиска его не ждет.
+            threading.Thread(target=self._save, daemon=True).start()
+
+    def _save(self) -> None:
+        try:
+            self.save()
+        finally:
+            cache.delete(self._lock_key)
+
+    def _build(self) -> None:
+        try:
+            if not cache.add(self._lock_key, True, self.build_lock_timeout):
+                return  # Индекс уже строит другой процесс.
+            try:
+                synced_at = datetime.now().isoformat()
+                self.rebuild(self._iter_notes(), synced_at)
+                self._ready = True
+            finally:
+                cache.delete(self._lock_key)
+        finally:
+            self._building = False
+
+    def _iter_notes(self, query: dict | None = None):
+        """Выдает тройки `(id заметки, вектор, теги)` для всех заметок, подходящих под запрос."""
+        for hits in iter_hit_batches(
+            self._es,
+            self._index,
+            sort=[{"published_at": "asc"}, {"_id": "asc"}],
+            query=query,
+            size=self.batch_size,
+            source=["embedding", "tags"],
+            request_timeout=self._timeout,
+        ):
+            for hit in hits:
+                tags = hit["_source"].get("tags") or []
+                yield hit["_id"], hit["_source"].get("embedding") or [], (
+                    [tags] if isinstance(tags, str) else tags
+                )
+
+
+def create_vector_index(es: Elasticsearch, index: str) -> VectorIndex | None:
+    """
+    Создает векторный индекс по настройке `VECTOR_SEARCH_BACKEND`:
+
+    - `script` - индекса нет, близость считается скриптом Elasticsearch по всем подходящим заметкам;
+    - `numpy` - локальный индекс `NotesVectorIndex`;
+    - `knn` - нативный kNN поиск Elasticsearch 8.4+ (фильтр по тегам внутри kNN).
+    """
+    backend = getattr(settings, "VECTOR_SEARCH_BACKEND", "script")
+    if backend == "numpy":
+        return NotesVectorIndex(
+            es, index, settings.VECTOR_INDEX_PATH, PostIndex.Meta.mappings["embedding"]["dims"]
+        )
+    if backend == "knn":
+        return ElasticsearchKnnIndex(es, index)
+    return None
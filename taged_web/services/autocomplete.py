@@ -0,0 +1,165 @@
+import bisect
+import logging
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+
+from taged_web.models import User
+from taged_web.repo.notes import get_repository
+from elasticsearch_control.cache import get_or_cache
+from .cache_version import CacheVersion, get_query_hash
+from .notes import _notes_base_cache_key
+from .permissions import get_permission_snapshot
+from .tags import acl_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class TitlePrefixIndex:
+    """
+    Префиксный индекс заголовков в памяти процесса.
+
+    Каждый заголовок хранится один раз, а для каждого слова хранится только пара
+    (номер заголовка, смещение слова) в компактных массивах, отсортированных по тексту с этого смещения.
+    Поэтому, как и `search_as_you_type`, индекс находит заголовки по началу любого слова,
+    а память растет линейно от суммарной длины заголовков. Поиск префикса - два двоичных поиска.
+    Сортировка учитывает только первые `key_length` символов, более длинные префиксы дофильтровываются.
+    """
+
+    key_length = 32
+
+    def __init__(self, titles, version: int):
+        self._titles = sorted(set(titles))
+        self._normalized = [self.normalize(title) for title in self._titles]
+        keys = [
+            (normalized[match.start() : match.start() + self.key_length], match.start(), title_id)
+            for title_id, normalized in enumerate(self._normalized)
+            for match in re.finditer(r"\w+", normalized)
+        ]
+        # Вторым элементом идет смещение слова, чтобы совпадения с начала заголовка шли первыми.
+        keys.sort()
+        self._title_ids = array("I", (title_id for _, _, title_id in keys))
+        self._offsets = array("I", (offset for _, offset, _ in keys))
+        self.version = version
+
+    @staticmethod
+    def normalize(string: str) -> str:
+        return " ".join(re.findall(r"\w+", string.lower().replace("ё", "е")))
+
+    @property
+    def size(self) -> int:
+        """Примерный размер индекса в байтах."""
+        strings = sum(sys.getsizeof(title) for title in self._titles)
+        strings += sum(sys.getsizeof(normalized) for normalized in self._normalized)
+        arrays = (len(self._title_ids) + len(self._offsets)) * self._title_ids.itemsize
+        return strings + arrays
+
+    def search(self, string: str, size: int = 10) -> list[str]:
+        prefix = self.normalize(string)
+        if not prefix:
+            return []
+        key = prefix[: self.key_length]
+
+        def key_at(i: int) -> str:
+            offset = self._offsets[i]
+            return self._normalized[self._title_ids[i]][offset : offset + len(key)]
+
+        positions = range(len(self._title_ids))
+        start = bisect.bisect_left(positions, key, key=key_at)
+        stop = bisect.bisect_right(positions, key, lo=start, key=key_at)
+
+        titles: dict[int, int] = {}
+        for i in positions[start:stop]:
+            title_id, offset = self._title_ids[i], self._offsets[i]
+            if len(prefix) > len(key) and not self._normalized[title_id].startswith(prefix, offset):
+                continue
+            titles[title_id] = min(offset, titles.get(title_id, offset))
+        title_ids = sorted(titles, key=lambda title_id: (titles[title_id], self._titles[title_id]))
+        return [self._titles[title_id] for title_id in title_ids[:size]]
+
+
+class _PrefixIndexes:
+    """
+    Префиксные индексы по отпечаткам прав.
+
+    Хранятся не больше `max_entries` последних использованных индексов общим размером до `max_total_size` байт.
+    Индексы строятся только в фоне, одним потоком на отпечаток:
+    пока индекса нет, `get` возвращает None и поиск идет в Elasticsearch,
+    а устаревший индекс отдается, пока строится новый.
+    """
+
+    max_entries = 4
+    max_total_size = 64 * 1024 * 1024
+
+    def __init__(self):
+        self._indexes: OrderedDict[str, TitlePrefixIndex] = OrderedDict()
+        self._building: set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, unavailable_tags: list[str]) -> TitlePrefixIndex | None:
+        fingerprint = acl_fingerprint(unavailable_tags)
+        # Версия меняется при любом изменении записей, в том числе в других процессах.
+        version = CacheVersion(_notes_base_cache_key).get_version()
+
+        with self._lock:
+            index = self._indexes.get(fingerprint)
+            if index is not None:
+                self._indexes.move_to_end(fingerprint)
+            if (index is None or index.version < version) and fingerprint not in self._building:
+                self._building.add(fingerprint)
+                threading.Thread(
+                    target=self._build, args=(fingerprint, unavailable_tags, version), daemon=True
+                ).start()
+        return index
+
+    def _build(self, fingerprint: str, unavailable_tags: list[str], version: int) -> None:
+        try:
+            index = TitlePrefixIndex(get_repository().iter_titles(unavailable_tags), version)
+            with self._lock:
+                self._indexes[fingerprint] = index
+                self._indexes.move_to_end(fingerprint)
+                self._evict()
+        except Exception:
+            logger.exception("Не удалось построить префиксный индекс заголовков")
+        finally:
+            with self._lock:
+                self._building.discard(fingerprint)
+
+    def _evict(self) -> None:
+        total_size = sum(index.size for index in self._indexes.values())
+        # Последний построенный индекс не вытесняется, даже если он один больше лимита.
+        while len(self._indexes) > 1 and (
+            len(self._indexes) > self.max_entries or total_size > self.max_total_size
+        ):
+            _, evicted = self._indexes.popitem(last=False)
+            total_size -= evicted.size
+
+
+_prefix_indexes = _PrefixIndexes()
+
+
+def get_autocomplete_titles(string: str, user: User, size: int = 10) -> list[str]:
+    """
+    Возвращает заголовки доступных пользователю заметок для автодополнения строки.
+    При включенной настройке `AUTOCOMPLETE_PREFIX_INDEX` поиск идет в памяти процесса, без Elasticsearch,
+    если префиксный индекс для прав пользователя уже построен.
+    """
+    if not string.strip():
+        return []
+    snapshot = get_permission_snapshot(user)
+    unavailable_tags = sorted(snapshot.unavailable_tags)
+    if getattr(settings, "AUTOCOMPLETE_PREFIX_INDEX", False):
+        index = _prefix_indexes.get(unavailable_tags)
+        if index is not None:
+            return index.search(string, size)
+    return get_or_cache(
+        function=get_repository().get_titles,
+        kwargs={"string": string, "unavailable_tags": unavailable_tags, "size": size},
+        unique_name=f"titles:{snapshot.fingerprint}:{get_query_hash({'string': string, 'size': size})}",
+        cache_timeout=60 * 5,
+        version=CacheVersion(_notes_base_cache_key).get_version(),
+    )
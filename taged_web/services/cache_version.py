@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 from django.core.cache import cache
 
 
@@ -13,3 +16,8 @@ class CacheVersion:
             cache.incr(f"{self._cache_name}:version", 1)
         except ValueError:
             cache.set(f"{self._cache_name}:version", 2)
+
+
+def get_query_hash(params: dict) -> str:
+    """Короткий отпечаток параметров запроса для ключа кэша."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
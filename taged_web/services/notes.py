@@ -4,13 +4,13 @@ from typing import TypeVar
 
 from django.conf import settings
 from django.contrib.humanize.templatetags import humanize
-from django.core.cache import cache
 from django.http import Http404
 from jwt import encode as jwt_encode, decode as jwt_decode, PyJWTError
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from elasticsearch_control.cache import get_or_cache
+from elasticsearch_control import CursorError
+from elasticsearch_control.cache import QueryCache, get_or_cache
 from taged_web.es_index import T_Values, PostIndex
 from taged_web.filters import notes_records_filter
 from taged_web.models import User
@@ -18,7 +18,8 @@ from taged_web.repo.exc import NotFoundError
 from taged_web.repo.notes import get_repository
 from .cache_version import CacheVersion
 from .signals import register
-from .tags import get_unavailable_tags, add_tags_to_user_if_not_exist
+from .permissions import get_permission_snapshot
+from .tags import add_tags_to_user_if_not_exist
 
 _notes_base_cache_key = "notes"
 _notes_count_cache_key = "notesCount"
@@ -29,7 +30,7 @@ def get_note_or_404(note_id: str, user: User, values: list[T_Values] | None = No
         note = get_repository().get(id_=note_id, values=values)
     except NotFoundError:
         raise Http404()
-    if set(get_unavailable_tags(user)) & set(note.tags_list):
+    if get_permission_snapshot(user).unavailable_tags & set(note.tags_list):
         # Если нет такой записи, либо пользователь не имеет к ней доступа
         raise Http404()
     return note
@@ -48,19 +49,32 @@ def update_note_callback(**kwargs):
     CacheVersion(_notes_base_cache_key).increment_version()  # Записи
 
 
-def get_notes_count(user: User) -> int:
-    timeout = 60 * 10
-    version = CacheVersion(_notes_count_cache_key).get_version()
-    user_cache_key: str = f"{_notes_count_cache_key}:{user.username}"  # type: ignore
+@register("created_note", "updated_note")
+def update_note_vector_callback(note: PostIndex, **kwargs):
+    """Векторный индекс должен сразу находить новую или измененную запись."""
+    get_repository().update_vector_index(note.id, note.tags_list)
 
-    total_count: int | None = cache.get(user_cache_key, default=None, version=version)
 
-    if total_count is None:
-        paginator = get_repository().filter(tags_off=get_unavailable_tags(user))
-        total_count = paginator.count
-        cache.set(user_cache_key, total_count, timeout, version=version)
+@register("deleted_note")
+def remove_note_vector_callback(note: PostIndex, **kwargs):
+    get_repository().remove_from_vector_index(note.id)
 
-    return total_count
+
+def get_notes_count(user: User) -> int:
+    timeout = 60 * 10
+    version = CacheVersion(_notes_count_cache_key).get_version()
+    snapshot = get_permission_snapshot(user)
+    # Пользователи с одинаковыми недоступными тегами видят одно и то же кол-во записей.
+    acl_cache_key = f"{_notes_count_cache_key}:{snapshot.fingerprint}"
+
+    # Кол-во считается поиском с `size=0`, без получения самих записей.
+    return get_or_cache(
+        function=lambda: get_repository().filter(tags_off=sorted(snapshot.unavailable_tags)).count,
+        kwargs={},
+        unique_name=acl_cache_key,
+        cache_timeout=timeout,
+        version=version,
+    )
 
 
 def get_note_detail(note: PostIndex) -> dict:
@@ -97,35 +111,58 @@ def update_note(note: PostIndex, title: str, content: str, tags: list[str], user
 
 
 def get_notes(
-    search: str, tags_in: list[str], page: str, user: User, use_vectorize_search: bool, vectorizer_only: bool
+    search: str,
+    tags_in: list[str],
+    page: str,
+    user: User,
+    use_vectorize_search: bool,
+    vectorizer_only: bool,
+    cursor: str | None = None,
+    rescore_window: str | None = None,
+    hybrid: bool = False,
 ) -> Response:
-    cache_timeout = 60 * 5
+    """
+    Возвращает страницу записей.
 
-    # Если не указана строка поиска, то сортируем по времени создания
-    sorted_by: T_Values | None = None if search else "published_at"
+    Если передан `cursor` (в том числе пустая строка для первой страницы), то пагинация идет
+    через `search_after` и point-in-time, а номер страницы `page` игнорируется.
+
+    `rescore_window` - кол-во лучших по тексту записей, которые пересчитываются векторной моделью
+    при `use_vectorize_search`, по умолчанию `settings.VECTOR_RESCORE_WINDOW`.
+
+    `hybrid` - объединить результаты текстового и векторного поиска через Reciprocal Rank Fusion.
+    """
+    cache_timeout = 60 * 5
+    snapshot = get_permission_snapshot(user)
 
     # Получает записи от Elasticsearch.
     paginator = get_repository().filter(
-        tags_off=get_unavailable_tags(user),
+        tags_off=sorted(snapshot.unavailable_tags),
         tags_in=tags_in,
         string=search,  # search_translate(search),
-        sort=sorted_by,
+        # Если не указана строка поиска, то сортируем по времени создания
+        sort=None if search else "published_at",
         sort_desc=True,
         values=["title", "tags", "published_at", "preview_image"],
         convert_result=notes_records_filter,
         use_vectorize_search=use_vectorize_search,
         vectorizer_only=vectorizer_only,
+        rescore_window=_get_rescore_window(rescore_window),
+        hybrid=hybrid,
+        # Одинаковые запросы пользователей с одинаковыми недоступными тегами используют одну запись кэша.
+        query_cache=QueryCache(
+            _notes_base_cache_key,
+            version=CacheVersion(_notes_base_cache_key).get_version(),
+            scope=snapshot.fingerprint,
+            timeout=cache_timeout,
+        ),
     )
 
-    if not search and not tags_in and page == "1":
-        # Получаем записи из кэша или они будут созданы по функции
-        records: list = get_or_cache(
-            function=paginator.get_page,
-            kwargs={"page": page},
-            unique_name=f"{_notes_base_cache_key}:{user.username}",
-            cache_timeout=cache_timeout,
-            version=CacheVersion(_notes_base_cache_key).get_version(),
-        )
+    if cursor is not None:
+        try:
+            records = paginator.get_cursor_page(cursor)
+        except CursorError as exc:
+            raise ValidationError(str(exc))
     else:
         records = paginator.get_page(page)
 
@@ -140,11 +177,25 @@ def get_notes(
                 "maxPages": paginator.max_pages,
                 "perPage": paginator.per_page,
                 "currentPage": paginator.page,
+                "nextCursor": paginator.next_cursor,
             },
         }
     )
 
 
+def _get_rescore_window(value: str | None) -> int | None:
+    if value is None:
+        return getattr(settings, "VECTOR_RESCORE_WINDOW", 0) or None
+    try:
+        window = int(value)
+    except ValueError:
+        raise ValidationError("rescore-window должен быть целым числом")
+    # 10000 - ограничение `index.max_rescore_window` в Elasticsearch по умолчанию.
+    if not 0 <= window <= 10_000:
+        raise ValidationError("rescore-window должен быть от 0 до 10000")
+    return window or None
+
+
 def search_translate(search: str) -> str:
     ru = "йцукенгшщзхъфывапролджэячсмитьбю.ёЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭЯЧСМИТЬБЮ,Ё"
     eng = "qwertyuiop[]asdfghjkl;'zxcvbnm,./`WERTYUIOP{}ASDFGHJKL:\"ZXCVBNM<>?~"
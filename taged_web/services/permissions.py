@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.core.cache import cache
+
+from taged_web.models import Tags, User
+from .cache_version import CacheVersion
+from .tags import acl_fingerprint, get_available_tags
+
+_permissions_cache_key = "permissions"
+
+
+@dataclass(frozen=True)
+class PermissionSnapshot:
+    """Права пользователя на момент версии `version` кэша прав."""
+
+    available_tags: frozenset[str]
+    unavailable_tags: frozenset[str]
+    # Права в формате `<app_label>.<codename>`, как у `User.get_all_permissions`.
+    permissions: frozenset[str]
+    is_superuser: bool
+    version: int
+    # Отпечаток недоступных тегов, общий для пользователей, которые видят одни и те же записи.
+    fingerprint: str
+
+    def has_perms(self, perms: list[str]) -> bool:
+        """Аналог `User.has_perms` для активного пользователя."""
+        return self.is_superuser or all(perm in self.permissions for perm in perms)
+
+
+class _LocalSnapshots:
+    """Копии снимков в памяти процесса, чтобы не читать их из Redis на каждый запрос."""
+
+    max_size = 1024
+
+    def __init__(self):
+        self._snapshots: OrderedDict[int, PermissionSnapshot] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: int) -> PermissionSnapshot | None:
+        with self._lock:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is None or snapshot.version != version:
+                return None
+            self._snapshots.move_to_end(user_id)
+            return snapshot
+
+    def set(self, user_id: int, snapshot: PermissionSnapshot) -> None:
+        with self._lock:
+            self._snapshots[user_id] = snapshot
+            self._snapshots.move_to_end(user_id)
+            while len(self._snapshots) > self.max_size:
+                self._snapshots.popitem(last=False)
+
+
+_local_snapshots = _LocalSnapshots()
+
+
+def get_permission_snapshot(user: User) -> PermissionSnapshot:
+    """
+    Возвращает снимок прав пользователя: доступные и недоступные теги и права.
+
+    Снимок хранится в кэше Django и в памяти процесса под общей версией прав,
+    любое изменение тегов, прав, групп или пользователей увеличивает версию (см. `invalidate_permissions`).
+    """
+    version = CacheVersion(_permissions_cache_key).get_version()
+    snapshot = _local_snapshots.get(user.pk, version)
+    if snapshot is not None:
+        return snapshot
+
+    cache_key = f"{_permissions_cache_key}:{user.pk}"
+    data: dict | None = cache.get(cache_key, version=version)
+    if data is None:
+        available_tags = get_available_tags(user)
+        all_tags = set(Tags.objects.values_list("tag_name", flat=True))
+        data = {
+            "available_tags": available_tags,
+            "unavailable_tags": list(all_tags - set(available_tags)),
+            "permissions": list(user.get_all_permissions()),
+            "is_superuser": user.is_active and user.is_superuser,
+        }
+        cache.set(cache_key, data, 60 * 60 * 24, version=version)
+
+    snapshot = PermissionSnapshot(
+        available_tags=frozenset(data["available_tags"]),
+        unavailable_tags=frozenset(data["unavailable_tags"]),
+        permissions=frozenset(data["permissions"]),
+        is_superuser=data["is_superuser"],
+        version=version,
+        fingerprint=acl_fingerprint(data["unavailable_tags"]),
+    )
+    _local_snapshots.set(user.pk, snapshot)
+    return snapshot
+
+
+def invalidate_permissions() -> None:
+    """Сбрасывает снимки прав всех пользователей."""
+    CacheVersion(_permissions_cache_key).increment_version()
@@ -1,3 +1,5 @@
+import hashlib
+
 from taged_web.models import Tags, User
 
 
@@ -14,6 +16,14 @@ def get_unavailable_tags(user: User) -> list[str]:
     return list(set(all_tags) - set(get_available_tags(user)))
 
 
+def acl_fingerprint(unavailable_tags: list[str]) -> str:
+    """
+    Отпечаток набора недоступных тегов.
+    У пользователей с одинаковыми правами он совпадает, поэтому по нему можно разделять кэш.
+    """
+    return hashlib.sha1("\n".join(sorted(set(unavailable_tags))).encode()).hexdigest()[:16]
+
+
 def add_tags_to_user_if_not_exist(tags_names: list[str], by_user: User) -> None:
     """
     Принимает строку названий тегов и создает отсутствующие из них.
@@ -13,3 +13,14 @@ def create_permission(sender, **kwargs):
 
     for codename, name in extra_permissions:
         Permission.objects.get_or_create(codename=codename, name=name, content_type=content_type)
+
+
+def invalidate_permissions_receiver(sender, **kwargs):
+    """Изменились теги, права или пользователи, снимки прав пользователей устарели."""
+    from taged_web.services.permissions import invalidate_permissions
+
+    if not kwargs.get("action", "post_").startswith("post_"):
+        return  # `m2m_changed` вызывается и до, и после изменения.
+    if kwargs.get("update_fields") and set(kwargs["update_fields"]) <= {"last_login"}:
+        return  # Вход пользователя не меняет его права.
+    invalidate_permissions()
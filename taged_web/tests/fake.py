@@ -1,3 +1,4 @@
+import json
 from typing import Any
 
 from elasticsearch import Elasticsearch, NotFoundError
@@ -9,10 +10,37 @@ class FakeElasticsearch(Elasticsearch):
         super().__init__(**kwargs)
         self.index_docs: list[dict] = []
         self.delete_ids: list[str] = []
+        self.get_params: list[dict] = []
+        self.bulk_actions: list[dict] = []
 
     def clear_fake_data(self):
         self.index_docs = []
         self.delete_ids = []
+        self.get_params = []
+        self.bulk_actions = []
+
+    def bulk(self, body, index=None, doc_type=None, params=None, headers=None, **kwargs):
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        items = []
+        # Строки идут парами: действие и документ.
+        for action, document in zip(lines[::2], lines[1::2]):
+            op_type, meta = next(iter(action.items()))
+            self.bulk_actions.append({"op_type": op_type, "_id": meta["_id"], "document": document})
+            items.append({op_type: {"_id": meta["_id"], "status": 200}})
+        return {"errors": False, "items": items}
+
+    def mget(self, body, index=None, doc_type=None, params=None, headers=None, **kwargs):
+        # Заметки с id `missing` нет.
+        return {
+            "docs": [
+                (
+                    {"_id": id_, "found": True, "_source": {"title": f"title {id_}", "content": "content"}}
+                    if id_ != "missing"
+                    else {"_id": id_, "found": False}
+                )
+                for id_ in body["ids"]
+            ]
+        }
 
     def get(
         self,
@@ -43,6 +71,7 @@ class FakeElasticsearch(Elasticsearch):
         params=...,
         headers=...,
     ):
+        self.get_params.append({"_source": _source, "_source_excludes": _source_excludes})
         if not id:  # Если пустой ID.
             raise NotFoundError()
         return {
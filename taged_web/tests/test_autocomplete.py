@@ -0,0 +1,88 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from taged_web.services.autocomplete import TitlePrefixIndex, _PrefixIndexes, get_autocomplete_titles
+
+
+class TestTitlePrefixIndex(SimpleTestCase):
+    def setUp(self):
+        self.index = TitlePrefixIndex(
+            ["Docker compose", "Установка Docker", "Ёлка на Debian", "Ansible", "Docker compose"], version=1
+        )
+
+    def test_prefix_of_any_word(self):
+        # Совпадения с начала заголовка идут первыми.
+        self.assertEqual(["Docker compose", "Установка Docker"], self.index.search("doc"))
+        self.assertEqual(["Docker compose"], self.index.search("Docker  comp"))
+        self.assertEqual(["Ёлка на Debian"], self.index.search("елк"))
+        self.assertEqual(["Ёлка на Debian"], self.index.search("deb"))
+
+    def test_no_match(self):
+        self.assertEqual([], self.index.search("kubernetes"))
+        self.assertEqual([], self.index.search("  "))
+        self.assertEqual(["Docker compose"], self.index.search("d", size=1))
+
+    def test_prefix_longer_than_key(self):
+        index = TitlePrefixIndex(["Настройка " + "a" * 40 + " b", "Настройка " + "a" * 40 + " c"], version=1)
+        with mock.patch.object(TitlePrefixIndex, "key_length", 8):
+            self.assertEqual(["Настройка " + "a" * 40 + " c"], index.search("a" * 40 + " c"))
+        self.assertEqual(2, len(index.search("настройка a")))
+
+
+@mock.patch("taged_web.services.autocomplete.threading.Thread")
+@mock.patch("taged_web.services.autocomplete.get_repository")
+@mock.patch("taged_web.services.autocomplete.CacheVersion")
+class TestPrefixIndexes(SimpleTestCase):
+    def test_built_in_background(self, cache_version, get_repository, thread):
+        get_repository.return_value.iter_titles.return_value = ["Docker"]
+        cache_version.return_value.get_version.return_value = 1
+        indexes = _PrefixIndexes()
+        # Индекса еще нет: поиск уходит в Elasticsearch, индекс строится в фоне одним потоком.
+        self.assertIsNone(indexes.get(["secret"]))
+        self.assertIsNone(indexes.get(["secret"]))
+        thread.assert_called_once()
+        get_repository.return_value.iter_titles.assert_not_called()
+
+        indexes._build(*thread.call_args.kwargs["args"])
+        index = indexes.get(["secret"])
+        self.assertEqual(["Docker"], index.search("doc"))
+
+        # Записи изменились: отдается старый индекс, новый строится в фоне одним потоком.
+        cache_version.return_value.get_version.return_value = 2
+        self.assertIs(index, indexes.get(["secret"]))
+        self.assertIs(index, indexes.get(["secret"]))
+        self.assertEqual(2, thread.call_count)
+
+        indexes._build(*thread.call_args.kwargs["args"])
+        self.assertEqual(2, indexes.get(["secret"]).version)
+        self.assertEqual(2, thread.call_count)
+
+    def test_evicted_by_size(self, cache_version, get_repository, thread):
+        get_repository.return_value.iter_titles.return_value = ["Docker compose"]
+        cache_version.return_value.get_version.return_value = 1
+        indexes = _PrefixIndexes()
+        size = TitlePrefixIndex(["Docker compose"], version=1).size
+        with mock.patch.object(_PrefixIndexes, "max_total_size", size * 2):
+            for tags in (["a"], ["b"], ["c"]):
+                indexes.get(tags)
+                indexes._build(*thread.call_args.kwargs["args"])
+        self.assertEqual(2, len(indexes._indexes))
+        self.assertIsNone(indexes.get(["a"]))
+
+
+class TestGetAutocompleteTitles(SimpleTestCase):
+    @override_settings(AUTOCOMPLETE_PREFIX_INDEX=True)
+    @mock.patch("taged_web.services.autocomplete.get_repository")
+    @mock.patch("taged_web.services.autocomplete.get_or_cache")
+    @mock.patch("taged_web.services.autocomplete.get_permission_snapshot")
+    @mock.patch.object(_PrefixIndexes, "get", return_value=None)
+    def test_falls_back_to_elasticsearch(
+        self, get_index, get_permission_snapshot, get_or_cache, get_repository
+    ):
+        get_permission_snapshot.return_value.unavailable_tags = {"secret"}
+        get_permission_snapshot.return_value.fingerprint = "fp"
+        get_or_cache.return_value = ["Docker"]
+        self.assertEqual(["Docker"], get_autocomplete_titles("doc", user=mock.Mock()))
+        get_index.assert_called_once_with(["secret"])
+        self.assertIs(get_repository.return_value.get_titles, get_or_cache.call_args.kwargs["function"])
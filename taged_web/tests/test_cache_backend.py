@@ -0,0 +1,127 @@
+import pickle
+from datetime import date
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from taged.cache import CompactSerializer, LocalLRU, TwoTierRedisCache, _MISSING
+
+
+class FakeRedisCacheClient:
+    """Клиент `RedisCache` в памяти, запоминает чтения и отправленные сообщения."""
+
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+        self.published = []
+        self._serializer = CompactSerializer()
+
+    def get(self, key, default):
+        self.gets += 1
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout):
+        self.data[key] = value
+
+    def incr(self, key, delta):
+        self.data[key] += delta
+        return self.data[key]
+
+    def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+    def get_client(self, key=None, *, write=False):
+        return self
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+@mock.patch.object(TwoTierRedisCache, "_ensure_listener", lambda *args: None)
+class TestTwoTierRedisCache(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierRedisCache("redis://test", {"OPTIONS": {"L1_CHANNEL": f"test:{self.id()}"}})
+        self.client = FakeRedisCacheClient()
+        self.cache.__dict__["_cache"] = self.client
+
+    def test_version_keys_from_l1(self):
+        self.cache.set("notes:version", 1)
+        self.assertEqual(1, self.cache.get("notes:version"))
+        self.assertEqual(0, self.client.gets)
+
+        self.cache.incr("notes:version")
+        self.assertEqual(2, self.cache.get("notes:version"))
+        self.assertEqual(0, self.client.gets)
+        self.assertEqual(2, len(self.client.published))
+        self.assertTrue(self.client.published[-1][1].endswith(":notes:version"))
+
+    def test_invalidation_from_other_process(self):
+        self.client.data[self.cache.make_key("notes:version")] = 5
+        self.assertEqual(5, self.cache.get("notes:version"))
+        self.client.data[self.cache.make_key("notes:version")] = 6
+        # Сообщение от другого процесса удаляет ключ из L1.
+        self.cache._process.l1.delete(self.cache.make_key("notes:version"))
+        self.assertEqual(6, self.cache.get("notes:version"))
+        self.assertEqual(2, self.client.gets)
+
+    def test_other_keys_bypass_l1(self):
+        self.cache.set("drafts:user", ["draft"])
+        self.assertEqual(["draft"], self.cache.get("drafts:user"))
+        self.assertEqual(["draft"], self.cache.get("drafts:user"))
+        self.assertEqual(2, self.client.gets)
+        self.assertEqual([], self.client.published)
+
+    def test_serializer_stats(self):
+        before = self.cache.get_serializer_stats()
+        self.client._serializer.dumps("x" * 10_000)
+        stats = self.cache.get_serializer_stats()
+        self.assertEqual(before["values"] + 1, stats["values"])
+        self.assertGreater(stats["saved_bytes"] - before["saved_bytes"], 9_000)
+
+
+class TestLocalLRU(SimpleTestCase):
+    def test_eviction_and_timeout(self):
+        lru = LocalLRU(max_entries=2, timeout=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertIs(_MISSING, lru.get("b"))
+        self.assertEqual(1, lru.get("a"))
+
+        lru.set("d", 4, timeout=-1)
+        self.assertIs(_MISSING, lru.get("d"))
+
+
+class TestCompactSerializer(SimpleTestCase):
+    def setUp(self):
+        self.serializer = CompactSerializer()
+
+    def test_round_trip(self):
+        values = [
+            {"value": ["a", 1, 2.5, None, True], "version": 3},
+            {"date": date(2024, 1, 2), "tags": ("a", "b")},
+            "x" * 10_000,
+            [2**70],
+        ]
+        for value in values:
+            with self.subTest(value=str(value)[:50]):
+                data = self.serializer.dumps(value)
+                self.assertIsInstance(data, bytes)
+                self.assertEqual(self.serializer.loads(data), value)
+
+    def test_formats(self):
+        # Целые числа хранятся как есть, чтобы работал `incr`.
+        self.assertEqual(self.serializer.dumps(5), 5)
+        self.assertEqual(self.serializer.loads(b"5"), 5)
+        self.assertTrue(self.serializer.dumps({"a": [1]}).startswith(b"J"))
+        self.assertTrue(self.serializer.dumps({"a": (1,)}).startswith(b"P"))
+
+    def test_large_values_compressed(self):
+        value = {"hits": [{"_id": str(i), "title": "Заметка"} for i in range(200)]}
+        data = self.serializer.dumps(value)
+        self.assertIn(data[:1], [b"Z", b"z"])
+        self.assertLess(len(data), len(pickle.dumps(value)) / 3)
+
+    def test_reads_redis_serializer_values(self):
+        self.assertEqual(self.serializer.loads(pickle.dumps({"a": (1, 2)})), {"a": (1, 2)})
@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.test import SimpleTestCase
 
 from elasticsearch_control import QueryLimitParams
@@ -10,7 +12,7 @@ class TestQueryParams(SimpleTestCase):
         valid_query_params = QueryLimitParams(
             index="test_index",
             source=["title", "content", "tags", "published_at", "preview_image"],
-            query={"bool": {"must": [{"match": {"tags": "tag1 tag2"}}]}},
+            query={"bool": {"must": [], "filter": [{"term": {"tags": "tag1"}}, {"term": {"tags": "tag2"}}]}},
             request_timeout=5,
             sort=None,
         )
@@ -21,7 +23,7 @@ class TestQueryParams(SimpleTestCase):
         valid_query_params = QueryLimitParams(
             index="test_index",
             source=["title", "content", "tags", "published_at", "preview_image"],
-            query={"bool": {"must": [], "must_not": [{"match": {"tags": "tag1 tag2"}}]}},
+            query={"bool": {"must": [], "must_not": [{"terms": {"tags": ["tag1", "tag2"]}}]}},
             request_timeout=5,
             sort=None,
         )
@@ -36,8 +38,9 @@ class TestQueryParams(SimpleTestCase):
             source=["title", "content", "tags", "published_at", "preview_image"],
             query={
                 "bool": {
-                    "must": [{"match": {"tags": "tag1 tag2"}}],
-                    "must_not": [{"match": {"tags": "tag3 tag4"}}],
+                    "must": [],
+                    "filter": [{"term": {"tags": "tag1"}}, {"term": {"tags": "tag2"}}],
+                    "must_not": [{"terms": {"tags": ["tag3", "tag4"]}}],
                 }
             },
             request_timeout=5,
@@ -54,13 +57,14 @@ class TestQueryParams(SimpleTestCase):
             source=["title", "content", "tags", "published_at", "preview_image"],
             query={
                 "bool": {
-                    "must": [{"match": {"tags": "tag1 tag2"}}],
+                    "must": [],
+                    "filter": [{"term": {"tags": "tag1"}}, {"term": {"tags": "tag2"}}],
                     "should": [
                         {"match": {"title": {"query": "Search String", "fuzziness": "auto"}}},
                         {"match": {"content": {"query": "Search String", "fuzziness": "auto"}}},
                     ],
                     "minimum_should_match": 1,
-                    "must_not": [{"match": {"tags": "tag3 tag4"}}],
+                    "must_not": [{"terms": {"tags": ["tag3", "tag4"]}}],
                 }
             },
             request_timeout=5,
@@ -77,7 +81,8 @@ class TestQueryParams(SimpleTestCase):
             source=["title", "content", "tags", "published_at", "preview_image"],
             query={
                 "bool": {
-                    "must": [{"match": {"tags": "tag1 tag2"}}],
+                    "must": [],
+                    "filter": [{"term": {"tags": "tag1"}}, {"term": {"tags": "tag2"}}],
                     "should": [
                         {"match": {"title": {"query": "Search String", "fuzziness": "auto"}}},
                         {"match": {"content": {"query": "Search String", "fuzziness": "auto"}}},
@@ -103,13 +108,14 @@ class TestQueryParams(SimpleTestCase):
             source=["title", "content", "tags", "published_at", "preview_image"],
             query={
                 "bool": {
-                    "must": [{"match": {"tags": "tag1 tag2"}}],
+                    "must": [],
+                    "filter": [{"term": {"tags": "tag1"}}, {"term": {"tags": "tag2"}}],
                     "should": [
                         {"match": {"title": {"query": "Search String", "fuzziness": "auto"}}},
                         {"match": {"content": {"query": "Search String", "fuzziness": "auto"}}},
                     ],
                     "minimum_should_match": 1,
-                    "must_not": [{"match": {"tags": "tag3 tag4"}}],
+                    "must_not": [{"terms": {"tags": ["tag3", "tag4"]}}],
                 }
             },
             request_timeout=5,
@@ -131,13 +137,14 @@ class TestQueryParams(SimpleTestCase):
             source=["title", "content", "tags", "published_at", "preview_image"],
             query={
                 "bool": {
-                    "must": [{"match": {"tags": "tag1 tag2"}}],
+                    "must": [],
+                    "filter": [{"term": {"tags": "tag1"}}, {"term": {"tags": "tag2"}}],
                     "should": [
                         {"match": {"title": {"query": "Search String", "fuzziness": "auto"}}},
                         {"match": {"content": {"query": "Search String", "fuzziness": "auto"}}},
                     ],
                     "minimum_should_match": 1,
-                    "must_not": [{"match": {"tags": "tag3 tag4"}}],
+                    "must_not": [{"terms": {"tags": ["tag3", "tag4"]}}],
                 }
             },
             request_timeout=5,
@@ -145,6 +152,40 @@ class TestQueryParams(SimpleTestCase):
         )
         self.assertEqual(valid_query_params, query_params)
 
+    @mock.patch("taged_web.filters.vectorize_query", return_value=[0.5, 0.5])
+    def test_vector_rescore_window(self, _):
+        query_params = create_notes_query_params(
+            "test_index",
+            tags_in=[],
+            tags_off=[],
+            string="Search String",
+            use_vectorize_search=True,
+            rescore_window=50,
+        )
+        # Векторная близость не оборачивает основной запрос, а применяется только к окну лучших записей.
+        self.assertEqual(["must", "should", "minimum_should_match"], list(query_params.query["bool"]))
+        self.assertEqual(50, query_params.to_dict["rescore"]["window_size"])
+        self.assertEqual("multiply", query_params.rescore["query"]["score_mode"])
+        self.assertEqual(
+            [0.5, 0.5],
+            query_params.rescore["query"]["rescore_query"]["script_score"]["script"]["params"][
+                "query_vector"
+            ],
+        )
+
+    @mock.patch("taged_web.filters.vectorize_query", return_value=[])
+    def test_vectorizer_unavailable(self, _):
+        """Без вектора запроса поиск только по векторной модели становится текстовым"""
+        query_params = create_notes_query_params(
+            "test_index",
+            tags_in=[],
+            tags_off=[],
+            string="Search String",
+            use_vectorize_search=True,
+            vectorizer_only=True,
+        )
+        self.assertEqual(["must", "should", "minimum_should_match"], list(query_params.query["bool"]))
+
 
 class TestNotesFilter(SimpleTestCase):
     data = None  # type: dict
@@ -208,14 +249,14 @@ class TestNotesFilter(SimpleTestCase):
         }
 
     def test_notes_filter(self):
-        self.assertListEqual(
-            [self.note_docker], notes_records_filter(self.data, tags_in=["Docker"], tags_off=[])
-        )
-        self.assertListEqual(
-            [self.note_ansible], notes_records_filter(self.data, tags_in=[], tags_off=["Docker"])
-        )
-        self.assertListEqual([], notes_records_filter(self.data, tags_in=["Docker"], tags_off=["Docker"]))
-        self.assertListEqual([], notes_records_filter(self.data, tags_in=["Ansible"], tags_off=["IaC"]))
-        self.assertListEqual(
-            [self.note_docker, self.note_ansible], notes_records_filter(self.data, tags_in=[], tags_off=[])
-        )
+        self.assertListEqual([self.note_docker, self.note_ansible], notes_records_filter(self.data))
+
+    def test_notes_filter_single_tag(self):
+        data = {
+            "hits": {
+                "total": {"value": 1, "relation": "eq"},
+                "max_score": None,
+                "hits": [{"_id": "1", "_score": None, "_source": {"title": "Docker", "tags": "Docker"}}],
+            }
+        }
+        self.assertListEqual(["Docker"], notes_records_filter(data)[0]["tags"])
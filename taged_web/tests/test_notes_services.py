@@ -1,12 +1,14 @@
 from datetime import datetime
+from unittest import mock
 
+from django.core.cache import cache
 from django.http import Http404
 from django.test import TestCase
 
 from elasticsearch_control.transport import es_connector
 from .fake import FakeElasticsearch
 from ..models import User, Tags
-from ..services.notes import get_note_or_404
+from ..services.notes import get_note_or_404, get_notes_count
 
 
 class TestNotesServices(TestCase):
@@ -46,3 +48,19 @@ class TestNotesServices(TestCase):
         """У пользователя нет доступа к тегам записи"""
         with self.assertRaises(Http404):
             get_note_or_404("1", self.user)
+
+    @mock.patch("taged_web.services.notes.get_repository")
+    def test_notes_count_shared_by_acl(self, get_repository):
+        cache.clear()
+        get_repository.return_value.filter.return_value.count = 7
+        same_acl_user = User.objects.create_user("TestNotesServices2", "<EMAIL>", "<PASSWORD>")
+        other_acl_user = User.objects.create_user("TestNotesServices3", "<EMAIL>", "<PASSWORD>")
+        self.user.tags_set.add(self.tag1)
+        same_acl_user.tags_set.add(self.tag1)
+
+        self.assertEqual(7, get_notes_count(self.user))
+        self.assertEqual(7, get_notes_count(same_acl_user))
+        self.assertEqual(1, get_repository.return_value.filter.call_count)
+
+        get_notes_count(other_acl_user)
+        self.assertEqual(2, get_repository.return_value.filter.call_count)
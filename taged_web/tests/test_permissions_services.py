@@ -0,0 +1,45 @@
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+
+from taged_web.models import Tags, User
+from taged_web.services.permissions import get_permission_snapshot
+
+
+class TestPermissionSnapshot(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("TestPermissionSnapshot", "<EMAIL>", "<PASSWORD>")
+        self.user.tags_set.add(Tags.objects.create(tag_name="tag1"))
+        Tags.objects.create(tag_name="tag2")
+
+    def test_snapshot(self):
+        snapshot = get_permission_snapshot(self.user)
+        self.assertEqual({"tag1"}, snapshot.available_tags)
+        self.assertEqual({"tag2"}, snapshot.unavailable_tags)
+        self.assertFalse(snapshot.has_perms(["taged_web.create_notes"]))
+
+    def test_snapshot_is_cached(self):
+        get_permission_snapshot(self.user)
+        with self.assertNumQueries(0):
+            get_permission_snapshot(self.user)
+
+    def test_invalidate_on_tags_change(self):
+        get_permission_snapshot(self.user)
+        Tags.objects.get(tag_name="tag2").user.add(self.user)
+        Tags.objects.create(tag_name="tag3")
+        snapshot = get_permission_snapshot(self.user)
+        self.assertEqual({"tag1", "tag2"}, snapshot.available_tags)
+        self.assertEqual({"tag3"}, snapshot.unavailable_tags)
+
+    def test_invalidate_on_permissions_change(self):
+        get_permission_snapshot(self.user)
+        self.user.user_permissions.add(Permission.objects.get(codename="add_tags"))
+        # Django кэширует права в объекте пользователя, поэтому берем его заново.
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(get_permission_snapshot(user).has_perms(["taged_web.add_tags"]))
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+        self.user.save()
+        snapshot = get_permission_snapshot(self.user)
+        self.assertEqual({"tag1", "tag2"}, snapshot.available_tags)
+        self.assertTrue(snapshot.has_perms(["taged_web.delete_notes"]))
@@ -0,0 +1,92 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+
+def make_hits(start: int, count: int) -> list[dict]:
+    return [
+        {
+            "_id": str(i),
+            "_source": {"title": f"title {i}", "content": "content", "embedding": [0.1]},
+            "sort": [i, str(i)],
+        }
+        for i in range(start, start + count)
+    ]
+
+
+@mock.patch("taged_web.management.commands.reindex_notes.es_connector")
+class TestReindexNotesCommand(SimpleTestCase):
+    def setUp(self):
+        self.written: list[list[dict]] = []
+        self.bulk_options: list[dict] = []
+
+    def bulk_write(self, es, actions, **kwargs):
+        self.written.append(list(actions))
+        self.bulk_options.append(kwargs)
+        return len(self.written[-1]), []
+
+    def call(self, *args, vector=(0.5,)):
+        batches = [make_hits(0, 2), make_hits(2, 2), make_hits(4, 2)]
+        with (
+            mock.patch(
+                "taged_web.management.commands.reindex_notes.iter_hit_batches", return_value=batches
+            ) as iter_hit_batches,
+            mock.patch("taged_web.management.commands.reindex_notes.bulk_write", side_effect=self.bulk_write),
+            mock.patch(
+                "taged_web.management.commands.reindex_notes.vectorize_many",
+                side_effect=lambda texts, batch_size: [list(vector)] * len(texts),
+            ) as vectorize_many,
+        ):
+            call_command("reindex_notes", "--chunk-size=2", "--threads=2", *args, stdout=mock.MagicMock())
+        # Заметки читаются внутри point-in-time.
+        self.assertEqual("5m", iter_hit_batches.call_args.kwargs["pit_keep_alive"])
+        return vectorize_many
+
+    def test_groups_fill_all_threads(self, _):
+        vectorize_many = self.call("--batch-size=8")
+
+        # Каждый вызов `bulk_write` получает `chunk_size * threads` документов.
+        self.assertEqual([4, 2], [len(actions) for actions in self.written])
+        self.assertEqual(
+            {"chunk_size": 2, "thread_count": 2},
+            {k: self.bulk_options[0][k] for k in ["chunk_size", "thread_count"]},
+        )
+        self.assertEqual(8, vectorize_many.call_args.kwargs["batch_size"])
+        self.assertEqual([0.5], self.written[0][0]["_source"]["embedding"])
+        self.assertFalse(self.written[0][0]["_source"]["embedding_stale"])
+
+    def test_vectorizer_unavailable_keeps_vector(self, _):
+        """Без векторизатора старый вектор не затирается, а помечается устаревшим"""
+        self.call(vector=())
+
+        sources = [action["_source"] for actions in self.written for action in actions]
+        self.assertTrue(all(source["embedding"] == [0.1] for source in sources))
+        self.assertTrue(all(source["embedding_stale"] for source in sources))
+
+    def test_checkpoint(self, _):
+        with tempfile.TemporaryDirectory() as path:
+            checkpoint = Path(path) / "checkpoint.json"
+            states = []
+            bulk_write = self.bulk_write
+
+            def bulk_write_with_state(*args, **kwargs):
+                if checkpoint.exists():
+                    states.append(json.loads(checkpoint.read_text()))
+                return bulk_write(*args, **kwargs)
+
+            self.bulk_write = bulk_write_with_state
+            self.call(f"--checkpoint={checkpoint}", "--no-embed")
+            # После успешного завершения checkpoint удаляется.
+            self.assertFalse(checkpoint.exists())
+
+        # Перед записью второй группы сохранен прогресс первой.
+        self.assertEqual(
+            [{"source": "notes", "target": "notes", "search_after": [3, "3"], "processed": 4}], states
+        )
+        # Без пересчета документы копируются как есть, вместе со старым вектором.
+        self.assertEqual([0.1], self.written[0][0]["_source"]["embedding"])
+        self.assertNotIn("embedding_stale", self.written[0][0]["_source"])
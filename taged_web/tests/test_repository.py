@@ -1,12 +1,28 @@
 from datetime import datetime
+from unittest import mock
 
+from django.core.cache import cache
 from django.test import SimpleTestCase
+from elasticsearch.exceptions import AuthorizationException
 
+from elasticsearch_control.cache import QueryCache
 from elasticsearch_control.transport import es_connector
+from elasticsearch_control.write_block import IndexWriteBlockedError
 from taged_web.repo.notes import NotesRepository, get_repository
 from .fake import FakeElasticsearch
 
 
+class FakeEmbeddingQueue:
+    def __init__(self):
+        self.ids: list[str] = []
+
+    def push(self, ids):
+        self.ids.extend(ids)
+
+
+MODIFIED = {"modified_at": "2024-05-01T00:00:00"}
+
+
 class TestRepository(SimpleTestCase):
     fake_es = None  # type: FakeElasticsearch
     repo = None  # type: NotesRepository
@@ -16,6 +32,11 @@ class TestRepository(SimpleTestCase):
         cls.fake_es = FakeElasticsearch()
         cls.repo = NotesRepository(cls.fake_es, "test_index", 5)
 
+    def setUp(self):
+        patcher = mock.patch.object(NotesRepository, "_modified_fields", return_value=MODIFIED)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def tearDown(self):
         self.fake_es.clear_fake_data()
 
@@ -33,11 +54,23 @@ class TestRepository(SimpleTestCase):
         self.assertListEqual(note.tags_list, ["tag1", "tag2"])
         self.assertEqual(note.published_at, datetime(2024, 4, 28, 0, 0, 0, 0))
 
+    def test_get_note_without_embedding(self):
+        """Вектор не должен читаться из `_source` при получении заметки"""
+        self.repo.get("1")
+        self.repo.get("1", values=["tags"])
+        self.assertEqual(
+            [
+                {"_source": None, "_source_excludes": ["embedding"]},
+                {"_source": ["tags"], "_source_excludes": ["embedding"]},
+            ],
+            self.fake_es.get_params,
+        )
+
     def test_add_note(self):
         note = self.repo.create("title", ["tag1", "tag2"], "content", "image")
 
         self.assertEqual(
-            note.json(),
+            {**note.json(), **MODIFIED},
             self.fake_es.index_docs[0],
         )
         self.assertEqual(note.title, "title")
@@ -45,6 +78,55 @@ class TestRepository(SimpleTestCase):
         self.assertEqual(note.tags, "tag1, tag2")
         self.assertListEqual(note.tags_list, ["tag1", "tag2"])
 
+    @mock.patch("taged_web.repo.notes.vectorize_many", return_value=[[0.5, 0.5], [0.1, 0.2]])
+    def test_create_many_notes(self, vectorize_many):
+        created = self.repo.create_many(
+            [
+                {"title": "title 1", "tags": ["tag1"], "content": "content 1", "preview_image": ""},
+                {"title": "title 2", "tags": ["tag2"], "content": "content 2", "preview_image": ""},
+            ]
+        )
+        self.assertEqual(["title 1", "title 2"], [post.title for post in created])
+        # Векторы всех заметок запрашиваются одним вызовом.
+        vectorize_many.assert_called_once()
+        self.assertEqual(
+            [("index", created[0].id, [0.5, 0.5]), ("index", created[1].id, [0.1, 0.2])],
+            [
+                (action["op_type"], action["_id"], action["document"]["embedding"])
+                for action in self.fake_es.bulk_actions
+            ],
+        )
+
+    def test_update_many_notes(self):
+        updated = self.repo.update_many(
+            {
+                "1": {"title": "title 1", "tags": ["tag1"]},
+                "2": {"title": "title 2", "tags": ["tag2"]},
+            },
+            values=["tags"],
+        )
+        self.assertListEqual(["1", "2"], updated)
+        self.assertListEqual(
+            [
+                {"op_type": "update", "_id": "1", "document": {"doc": {"tags": ["tag1"], **MODIFIED}}},
+                {"op_type": "update", "_id": "2", "document": {"doc": {"tags": ["tag2"], **MODIFIED}}},
+            ],
+            sorted(self.fake_es.bulk_actions, key=lambda action: action["_id"]),
+        )
+
+    @mock.patch("elasticsearch_control.write_block.time.sleep")
+    def test_write_blocked(self, _):
+        """Пока индекс закрыт на запись на время перехода на новую версию, запись повторяется"""
+        blocked = AuthorizationException(403, "cluster_block_exception", {})
+        with mock.patch.object(self.fake_es, "index", side_effect=[blocked, {"_id": "1"}]):
+            self.assertEqual("1", self.repo.create("title", ["tag1"], "content", "image").id)
+
+        with mock.patch.object(self.fake_es, "update", side_effect=blocked), mock.patch.object(
+            self.repo, "write_blocked_timeout", 0
+        ):
+            with self.assertRaises(IndexWriteBlockedError):
+                self.repo.update("1", {"title": "title"})
+
     def test_delete_note(self):
         self.assertTrue(self.repo.delete("122"))
         self.assertEqual(self.fake_es.index_docs, [])
@@ -52,3 +134,91 @@ class TestRepository(SimpleTestCase):
 
     def test_count_notes(self):
         self.assertEqual(self.repo.tags_count("tag1"), 123)
+
+    @mock.patch("taged_web.repo.notes.vectorize", return_value=[])
+    def test_update_without_vector(self, _):
+        """Без векторизатора содержимое сохраняется, а старый вектор помечается устаревшим"""
+        instance = {"title": "title", "content": "new content", "tags": ["tag1"]}
+        with mock.patch.object(self.fake_es, "update") as update:
+            self.assertTrue(self.repo.update("1", instance, values=["content"]))
+        self.assertEqual(
+            {"content": "new content", "embedding_stale": True, **MODIFIED},
+            update.call_args.kwargs["body"]["doc"],
+        )
+
+    @mock.patch("taged_web.repo.notes.vectorize_many", return_value=[[], [0.5, 0.5]])
+    def test_bulk_without_vector(self, _):
+        self.repo.update_many({"1": {"title": "t", "content": "a"}, "2": {"title": "t", "content": "b"}})
+        docs = {action["_id"]: action["document"]["doc"] for action in self.fake_es.bulk_actions}
+        self.assertEqual({"title": "t", "content": "a", "embedding_stale": True, **MODIFIED}, docs["1"])
+        self.assertEqual([0.5, 0.5], docs["2"]["embedding"])
+
+        self.fake_es.clear_fake_data()
+        self.repo.create_many(
+            [{"title": "t", "tags": ["a"], "content": c, "preview_image": ""} for c in ["a", "b"]]
+        )
+        sources = [action["document"] for action in self.fake_es.bulk_actions]
+        self.assertNotIn("embedding", sources[0])
+        self.assertEqual([0.5, 0.5], sources[1]["embedding"])
+
+
+class TestRepositoryEmbeddingQueue(SimpleTestCase):
+    def setUp(self):
+        self.fake_es = FakeElasticsearch()
+        self.queue = FakeEmbeddingQueue()
+        self.repo = NotesRepository(self.fake_es, "test_index", 5, embedding_queue=self.queue)
+
+    @mock.patch("taged_web.repo.notes.vectorize")
+    def test_create_enqueues_embedding(self, vectorize):
+        note = self.repo.create("title", ["tag1"], "content", "image")
+
+        vectorize.assert_not_called()
+        self.assertNotIn("embedding", self.fake_es.index_docs[0])
+        self.assertListEqual([note.id], self.queue.ids)
+
+    @mock.patch("taged_web.repo.notes.vectorize_many")
+    def test_update_many_enqueues_changed_content(self, vectorize_many):
+        self.repo.update_many({"1": {"title": "t", "content": "new"}, "2": {"title": "t", "tags": ["a"]}})
+
+        vectorize_many.assert_not_called()
+        self.assertListEqual(["1"], self.queue.ids)
+
+    @mock.patch("taged_web.repo.notes.vectorize_many", return_value=[[0.5, 0.5], [], [0.1, 0.2]])
+    def test_apply_embeddings(self, vectorize_many):
+        failed = self.repo.apply_embeddings(["1", "2", "missing", "3"])
+
+        self.assertEqual(3, len(vectorize_many.call_args.args[0]))
+        # Для "2" векторизатор не вернул вектор, "missing" удалена.
+        self.assertListEqual(["2"], failed)
+        self.assertListEqual(
+            [("1", [0.5, 0.5]), ("3", [0.1, 0.2])],
+            [(action["_id"], action["document"]["doc"]["embedding"]) for action in self.fake_es.bulk_actions],
+        )
+
+
+@mock.patch("taged_web.repo.notes.is_vectorizer_available", return_value=True)
+class TestRepositoryRankingCache(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.repo = NotesRepository(FakeElasticsearch(), "test_index", 5)
+        self.query_cache = QueryCache("notes", version=1, scope="fingerprint")
+
+    def _filter(self):
+        return self.repo.filter(string="query", hybrid=True, query_cache=self.query_cache)
+
+    @mock.patch("taged_web.repo.notes.vectorize_query", return_value=[0.5, 0.5])
+    def test_hybrid_ranking_cached(self, vectorize_query, _):
+        """При попадании в кэш векторизатор и поиски рейтингов не выполняются"""
+        with mock.patch.object(self.repo, "_get_ranking", return_value=[("1", 1.0)]) as get_ranking:
+            self.assertListEqual(self._filter()._ranking, self._filter()._ranking)
+
+        vectorize_query.assert_called_once()
+        self.assertEqual(2, get_ranking.call_count)
+
+    @mock.patch("taged_web.repo.notes.vectorize_query", return_value=[])
+    def test_hybrid_ranking_without_vector_not_cached(self, vectorize_query, _):
+        with mock.patch.object(self.repo, "_get_ranking", return_value=[("1", 1.0)]):
+            self._filter()
+            self._filter()
+
+        self.assertEqual(2, vectorize_query.call_count)
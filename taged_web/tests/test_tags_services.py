@@ -1,7 +1,12 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
 from taged_web.models import User, Tags
-from taged_web.services.tags import add_tags_to_user_if_not_exist, get_available_tags, get_unavailable_tags
+from taged_web.services.tags import (
+    acl_fingerprint,
+    add_tags_to_user_if_not_exist,
+    get_available_tags,
+    get_unavailable_tags,
+)
 
 
 class TestAddTagsToUser(TestCase):
@@ -56,3 +61,10 @@ class TestAvailableUnavailableTags(TestCase):
             list(Tags.objects.all().values_list("tag_name", flat=True)),
         )
         self.assertSetEqual({"tag4", "tag5"}, set(get_unavailable_tags(self.user)))
+
+
+class TestAclFingerprint(SimpleTestCase):
+    def test_same_tags_same_fingerprint(self):
+        self.assertEqual(acl_fingerprint(["b", "a", "a"]), acl_fingerprint(["a", "b"]))
+        self.assertNotEqual(acl_fingerprint(["a"]), acl_fingerprint(["a", "b"]))
+        self.assertNotEqual(acl_fingerprint(["a b"]), acl_fingerprint(["a", "b"]))
@@ -0,0 +1,41 @@
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from taged_web.repo.vector_index import NotesVectorIndex
+
+
+class TestNotesVectorIndex(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.es = mock.Mock()
+        self.es.search.return_value = {
+            "hits": {"hits": [{"_id": "2", "_source": {"embedding": [0.0, 1.0], "tags": ["b"]}, "sort": [1]}]}
+        }
+        self.index = NotesVectorIndex(self.es, "notes", tmp.name, dims=2)
+        self.index.rebuild([("1", [1.0, 0.0], ["a"])], "2024-05-01T00:00:00")
+        self.index.sync()  # Загружает построенный индекс.
+        self.index._last_sync = 0
+
+    def test_sync_by_modified_at(self):
+        """Изменения из других процессов подтягиваются по времени любой записи заметки"""
+        self.index.sync()
+
+        self.assertEqual(
+            {"range": {"modified_at": {"gte": "2024-04-30T23:59:00"}}},
+            self.es.search.call_args_list[0].kwargs["query"],
+        )
+        self.assertEqual("2", self.index.search([0.0, 1.0], 1)[0][0])
+
+    @mock.patch("taged_web.repo.vector_index.threading.Thread")
+    def test_save_in_background(self, thread):
+        self.index.save_threshold = 1
+        with mock.patch.object(self.index, "save") as save:
+            self.index.sync()
+
+        save.assert_not_called()
+        thread.assert_called_once_with(target=self.index._save, daemon=True)
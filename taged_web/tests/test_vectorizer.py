@@ -0,0 +1,137 @@
+from unittest import mock
+
+import numpy as np
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from taged_web.vectorizer import CircuitBreaker, VectorizerClient, vectorize_query
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    @mock.patch("taged_web.vectorizer.time.monotonic")
+    def test_open_and_probe(self, monotonic):
+        monotonic.return_value = 100
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(breaker.allow())
+
+        # После таймаута пропускается только один пробный запрос.
+        monotonic.return_value = 131
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow())
+
+
+class TestVectorizerClient(SimpleTestCase):
+    def setUp(self):
+        self.client = VectorizerClient("http://vectorizer", failure_threshold=2)
+
+    def test_vectorize_many_batches(self):
+        response = mock.Mock(status_code=200, headers={"Content-Type": "application/json"})
+        response.json.return_value = {"vectors": [[1.0], [2.0]]}
+        with mock.patch.object(self.client._session, "post", return_value=response) as post:
+            self.assertEqual(
+                [[1.0], [2.0], [1.0], [2.0]], self.client.vectorize_many(["a", "b", "c", "d"], 2)
+            )
+        self.assertEqual(2, post.call_count)
+        self.assertEqual("http://vectorizer/api/v1/vectorize/batch", post.call_args.args[0])
+        self.assertEqual(self.client.timeout, post.call_args.kwargs["timeout"])
+
+    def test_binary_response(self):
+        response = mock.Mock(status_code=200, headers={"Content-Type": "application/x-float16"})
+        response.content = np.array([[0.5, -1.0], [2.0, 0.25]], dtype="<f2").tobytes()
+        with mock.patch.object(self.client._session, "post", return_value=response):
+            self.assertEqual([[0.5, -1.0], [2.0, 0.25]], self.client.vectorize_many(["a", "b"]))
+        self.assertTrue(self.client._session.headers["Accept"].startswith("application/x-float32"))
+
+    def test_breaker_skips_requests(self):
+        with mock.patch.object(self.client._session, "post", side_effect=requests.ConnectionError) as post:
+            self.assertEqual([], self.client.vectorize("a"))
+            self.assertEqual([], self.client.vectorize("b"))
+            self.assertFalse(self.client.available)
+            self.assertEqual([[], []], self.client.vectorize_many(["c", "d"]))
+        self.assertEqual(2, post.call_count)
+
+
+class TestVectorizerClientEndpoints(SimpleTestCase):
+    def setUp(self):
+        self.client = VectorizerClient(["http://vect1", "http://vect2/"], failure_threshold=1)
+        self.client._health_started = True
+
+    @staticmethod
+    def _response(vector: list[float]):
+        response = mock.Mock(status_code=200, headers={"Content-Type": "application/json"})
+        response.json.return_value = {"vector": vector}
+        return response
+
+    def test_least_outstanding(self):
+        first, second = self.client.endpoints
+        first.outstanding = 3
+        with mock.patch.object(self.client._session, "post", return_value=self._response([1.0])) as post:
+            self.client.vectorize("a")
+        self.assertEqual("http://vect2/api/v1/vectorize", post.call_args.args[0])
+        self.assertEqual(0, second.outstanding)
+
+    def test_failover_to_next_endpoint(self):
+        def post(url, **kwargs):
+            if url.startswith("http://vect1"):
+                raise requests.ConnectionError
+            return self._response([2.0])
+
+        with mock.patch.object(self.client._session, "post", side_effect=post) as session_post:
+            self.assertEqual([2.0], self.client.vectorize("a"))
+            self.assertEqual([2.0], self.client.vectorize("b"))
+        # Первый экземпляр исключен размыкателем после первой ошибки.
+        self.assertEqual(3, session_post.call_count)
+        self.assertTrue(self.client.available)
+
+    def test_health_check_ejects(self):
+        def get(url, **kwargs):
+            return mock.Mock(status_code=200 if url.startswith("http://vect1") else 502)
+
+        with mock.patch.object(self.client._session, "get", side_effect=get):
+            self.client.check_health()
+        self.assertEqual([True, False], [endpoint.healthy for endpoint in self.client.endpoints])
+
+        # Исключенный экземпляр не выбирается, даже если он свободнее.
+        self.client.endpoints[0].outstanding = 5
+        with mock.patch.object(self.client._session, "post", return_value=self._response([1.0])) as post:
+            self.client.vectorize("a")
+        self.assertTrue(post.call_args.args[0].startswith("http://vect1"))
+
+    def test_parallel_batches(self):
+        def post(url, json, **kwargs):
+            response = mock.Mock(status_code=200, headers={"Content-Type": "application/json"})
+            response.json.return_value = {"vectors": [[float(text)] for text in json["texts"]]}
+            return response
+
+        with mock.patch.object(self.client._session, "post", side_effect=post):
+            vectors = self.client.vectorize_many([str(i) for i in range(10)], batch_size=3)
+        self.assertEqual([[float(i)] for i in range(10)], vectors)
+
+
+class TestVectorizeQuery(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch("taged_web.vectorizer.vectorize", return_value=[0.1, -0.5, 0.25])
+    def test_cached_as_float16(self, vectorize):
+        first = vectorize_query("настройка  vlan ")
+        second = vectorize_query("настройка vlan")
+
+        vectorize.assert_called_once_with("настройка vlan")
+        self.assertEqual([0.1, -0.5, 0.25], first)
+        for expected, value in zip(first, second):
+            self.assertAlmostEqual(expected, value, places=3)
+
+    @mock.patch("taged_web.vectorizer.vectorize", return_value=[])
+    def test_empty_vector_not_cached(self, vectorize):
+        vectorize_query("vlan")
+        vectorize_query("vlan")
+        self.assertEqual(2, vectorize.call_count)
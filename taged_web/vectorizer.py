@@ -1,11 +1,321 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import requests
 from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель: после `failure_threshold` ошибок подряд запросы не выполняются `reset_timeout` секунд.
+    Затем пропускается один пробный запрос, при успехе размыкатель замыкается, иначе снова ждет.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Разомкнут ли размыкатель, не учитывая пробные запросы."""
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        "Векторизатор недоступен, запросы приостановлены на %s сек", self.reset_timeout
+                    )
+                self._opened_at = time.monotonic()
+
+
+class VectorizerEndpoint:
+    """Экземпляр сервиса векторизации: адрес, кол-во выполняющихся запросов и состояние."""
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url.rstrip("/")
+        self.breaker = breaker
+        self.outstanding = 0
+        # `False`, если экземпляр не ответил на последнюю проверку `/ping`.
+        self.healthy = True
+
+
+class VectorizerClient:
+    """
+    Клиент сервиса векторизации, в том числе нескольких его экземпляров.
+
+    Соединения переиспользуются через `requests.Session`, у запросов есть таймауты соединения и чтения,
+    при ошибках соединения и ответах 502/503/504 запрос повторяется не более `retries` раз.
+    Если экземпляр недоступен, то его `CircuitBreaker` на время прекращает запросы к нему,
+    а если недоступны все, то методы сразу возвращают пустые векторы,
+    чтобы поиск и сохранение заметок не ждали таймаутов.
+
+    Запрос отправляется экземпляру с наименьшим кол-вом выполняющихся запросов, при ошибке - следующему.
+    Экземпляры, не ответившие на `/ping` (проверка раз в `health_interval` секунд в фоне),
+    исключаются, пока снова не ответят. Пачки `vectorize_many` отправляются параллельно.
+
+    Векторы запрашиваются в бинарном формате (байты float32 или float16 little-endian) вместо списка
+    чисел в JSON, сервис без поддержки бинарного формата отвечает JSON, он тоже разбирается.
+    """
+
+    # Бинарные форматы ответа сервиса.
+    binary_dtypes = {
+        "application/x-float32": np.dtype("<f4"),
+        "application/x-float16": np.dtype("<f2"),
+    }
+    health_interval = 10
+
+    def __init__(
+        self,
+        urls: str | list[str],
+        connect_timeout: float = 1,
+        read_timeout: float = 10,
+        retries: int = 2,
+        pool_size: int = 16,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        wire_format: str = "float32",
+    ):
+        """
+        :param urls: Адрес сервиса векторизации или список адресов его экземпляров.
+        :param connect_timeout: Таймаут соединения в секундах.
+        :param read_timeout: Таймаут ответа в секундах.
+        :param retries: Кол-во повторов запроса к одному экземпляру.
+        :param pool_size: Кол-во соединений с каждым экземпляром, которые держатся открытыми.
+        :param failure_threshold: После стольких ошибок подряд экземпляр исключается на `reset_timeout` секунд.
+        :param reset_timeout: Через сколько секунд после исключения экземпляру отправляется пробный запрос.
+        :param wire_format: Формат векторов в ответе: `float32`, `float16` или `json`.
+        """
+        urls = [urls] if isinstance(urls, str) else urls
+        self.endpoints = [
+            VectorizerEndpoint(url, CircuitBreaker(failure_threshold, reset_timeout)) for url in urls
+        ]
+        self.timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._health_started = False
+        self._executor = ThreadPoolExecutor(max_workers=len(self.endpoints), thread_name_prefix="vectorizer")
+        self._session = requests.Session()
+        if wire_format != "json":
+            self._session.headers["Accept"] = f"application/x-{wire_format}, application/json;q=0.5"
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["POST"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=pool_size, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    @property
+    def available(self) -> bool:
+        return any(not endpoint.breaker.is_open for endpoint in self.endpoints)
+
+    def _acquire(self, exclude: list[VectorizerEndpoint]) -> VectorizerEndpoint | None:
+        """
+        Выбирает экземпляр с наименьшим кол-вом выполняющихся запросов и учитывает запрос в нем.
+        Непрошедшие проверку `/ping` экземпляры выбираются, только если таких все.
+        """
+        with self._lock:
+            candidates = sorted(
+                (endpoint for endpoint in self.endpoints if endpoint not in exclude),
+                key=lambda endpoint: (not endpoint.healthy, endpoint.outstanding),
+            )
+            for endpoint in candidates:
+                if endpoint.breaker.allow():
+                    endpoint.outstanding += 1
+                    return endpoint
+        return None
+
+    def _release(self, endpoint: VectorizerEndpoint) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def _post(self, path: str, data: dict) -> requests.Response | None:
+        """
+        Возвращает ответ сервиса или `None`, если все экземпляры недоступны или вернули ошибку.
+        При ошибке экземпляра запрос повторяется на следующем.
+        """
+        self._ensure_health_checks()
+        tried: list[VectorizerEndpoint] = []
+        while (endpoint := self._acquire(tried)) is not None:
+            tried.append(endpoint)
+            try:
+                resp = self._session.post(f"{endpoint.url}{path}", json=data, timeout=self.timeout)
+            except requests.RequestException as exc:
+                logger.warning("Ошибка запроса к векторизатору %s: %s", endpoint.url, exc)
+                endpoint.breaker.record_failure()
+                continue
+            finally:
+                self._release(endpoint)
+            if resp.status_code >= 500:
+                endpoint.breaker.record_failure()
+                continue
+            endpoint.breaker.record_success()
+            return resp if resp.status_code == 200 else None
+        return None
+
+    def _ensure_health_checks(self) -> None:
+        """Запускает фоновую проверку `/ping`, если экземпляров несколько."""
+        if self._health_started or len(self.endpoints) < 2:
+            return
+        with self._lock:
+            if self._health_started:
+                return
+            self._health_started = True
+        threading.Thread(target=self._run_health_checks, name="vectorizer-health", daemon=True).start()
+
+    def _run_health_checks(self) -> None:
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    def check_health(self) -> None:
+        """Проверяет все экземпляры через `/ping`."""
+        for endpoint in self.endpoints:
+            try:
+                healthy = (
+                    self._session.get(f"{endpoint.url}/ping", timeout=self.timeout[0]).status_code == 200
+                )
+            except requests.RequestException:
+                healthy = False
+            if endpoint.healthy != healthy:
+                logger.warning(
+                    "Векторизатор %s %s", endpoint.url, "доступен" if healthy else "не отвечает на /ping"
+                )
+            endpoint.healthy = healthy
+
+    def _decode(self, resp: requests.Response, count: int) -> list[list[float]]:
+        """
+        Возвращает `count` векторов из ответа в бинарном формате или в JSON.
+        Бинарный ответ - байты матрицы `(count, размерность)` без заголовков, поэтому `count`
+        берется из запроса, а размерность вычисляется из длины тела.
+        """
+        dtype = self.binary_dtypes.get(resp.headers.get("Content-Type", "").split(";")[0].strip())
+        if dtype is None:
+            data = resp.json()
+            return data["vectors"] if "vectors" in data else [data["vector"]]
+        return np.frombuffer(resp.content, dtype=dtype).astype(np.float32).reshape(count, -1).tolist()
+
+    def vectorize(self, text: str) -> list[float]:
+        resp = self._post("/api/v1/vectorize", {"text": text})
+        return self._decode(resp, 1)[0] if resp is not None else []
+
+    def _vectorize_batch(self, batch: list[str]) -> list[list[float]]:
+        resp = self._post("/api/v1/vectorize/batch", {"texts": batch})
+        if resp is not None:
+            return self._decode(resp, len(batch))
+        if self.available:
+            # Сервис без пакетной векторизации или ошибка всей пачки - по одному тексту.
+            return [self.vectorize(text) for text in batch]
+        return [[] for _ in batch]
+
+    def vectorize_many(self, texts: list[str], batch_size: int = 64) -> list[list[float]]:
+        """
+        Возвращает векторы для списка текстов в том же порядке.
+        Тексты отправляются пачками не больше `batch_size` на `/vectorize/batch`,
+        при нескольких экземплярах сервиса пачки выполняются параллельно.
+        Для текстов, которые не удалось векторизовать, будет пустой список.
+        """
+        # Тексты делятся между всеми экземплярами, даже если их меньше `batch_size`.
+        batch_size = max(1, min(batch_size, -(-len(texts) // len(self.endpoints))))
+        batches = [texts[start : start + batch_size] for start in range(0, len(texts), batch_size)]
+        if len(self.endpoints) > 1 and len(batches) > 1:
+            results = self._executor.map(self._vectorize_batch, batches)
+        else:
+            results = map(self._vectorize_batch, batches)
+        return [vector for vectors in results for vector in vectors]
+
+
+_client: VectorizerClient | None = None
+
+
+def get_vectorizer_client() -> VectorizerClient:
+    global _client
+    if _client is None:
+        _client = VectorizerClient(
+            settings.VECTORIZE_URLS,
+            connect_timeout=getattr(settings, "VECTORIZE_CONNECT_TIMEOUT", 1),
+            read_timeout=getattr(settings, "VECTORIZE_READ_TIMEOUT", 10),
+            retries=getattr(settings, "VECTORIZE_RETRIES", 2),
+            wire_format=getattr(settings, "VECTORIZE_WIRE_FORMAT", "float32"),
+        )
+    return _client
 
 
 def vectorize(text: str) -> list[float]:
-    resp = requests.post(f"{settings.VECTORIZE_URL}/api/v1/vectorize", json={"text": text})
-    if resp.status_code == 200:
-        data = resp.json()
-        return data["vector"]
-    else:
-        return []
+    """Вектор текста, либо пустой список, если векторизатор недоступен."""
+    return get_vectorizer_client().vectorize(text)
+
+
+def vectorize_query(string: str) -> list[float]:
+    """
+    Вектор строки поиска с кэшированием на `VECTORIZE_QUERY_CACHE_TIMEOUT` секунд.
+
+    Ключ кэша - строка без лишних пробелов и версия модели `VECTORIZE_MODEL_VERSION`,
+    вектор хранится в float16, для косинусной близости такой точности достаточно.
+    Пустой вектор (векторизатор недоступен) не кэшируется.
+    """
+    normalized = " ".join(string.split())
+    model_version = getattr(settings, "VECTORIZE_MODEL_VERSION", "")
+    cache_key = f"queryVector:{model_version}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+    data: bytes | None = cache.get(cache_key)
+    if data is not None:
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32).tolist()
+
+    vector = vectorize(normalized)
+    if vector:
+        cache.set(
+            cache_key,
+            np.asarray(vector, dtype=np.float16).tobytes(),
+            getattr(settings, "VECTORIZE_QUERY_CACHE_TIMEOUT", 60 * 60),
+        )
+    return vector
+
+
+def vectorize_many(texts: list[str], batch_size: int = 64) -> list[list[float]]:
+    """
+    Возвращает векторы для списка текстов в том же порядке.
+    Для текстов, которые не удалось векторизовать, будет пустой список.
+    """
+    return get_vectorizer_client().vectorize_many(texts, batch_size)
+
+
+def is_vectorizer_available() -> bool:
+    """`False`, пока разомкнуты размыкатели всех экземпляров векторизатора."""
+    return get_vectorizer_client().available
@@ -0,0 +1,108 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+
+from .settings import settings
+
+
+class Encoder(ABC):
+    """Прогон модели: по дополненной пачке токенов возвращает нормализованные векторы токена [CLS]."""
+
+    @abstractmethod
+    def encode(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        pass
+
+
+class TorchEncoder(Encoder):
+
+    def __init__(self, model_name: str, use_cuda: bool = False):
+        import torch
+        from transformers import AutoModel
+
+        self._torch = torch
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+        if use_cuda:
+            # if you have a GPU
+            self.model.cuda()
+
+    def encode(self, input_ids, attention_mask):
+        torch = self._torch
+        with torch.no_grad():
+            model_output = self.model(
+                input_ids=torch.from_numpy(input_ids).to(self.model.device),
+                attention_mask=torch.from_numpy(attention_mask).to(self.model.device),
+            )
+        embeddings = model_output.last_hidden_state[:, 0, :]
+        embeddings = torch.nn.functional.normalize(embeddings)
+        return embeddings.cpu().numpy()
+
+
+class OnnxEncoder(Encoder):
+    """
+    Прогон модели через ONNX Runtime на CPU.
+    Если файла модели еще нет, то модель экспортируется из PyTorch и, при `quantize`,
+    веса линейных слоев квантуются в int8 (динамическая квантизация).
+    """
+
+    def __init__(self, model_name: str, path: Path | str, quantize: bool = True):
+        import onnxruntime
+
+        path = Path(path)
+        model_path = path / ("model.int8.onnx" if quantize else "model.onnx")
+        if not model_path.exists():
+            self.export(model_name, path, quantize)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+
+    @staticmethod
+    def export(model_name: str, path: Path, quantize: bool) -> None:
+        import torch
+        from transformers import AutoModel
+
+        path.mkdir(parents=True, exist_ok=True)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        # Пример входа нужен только для трассировки, размеры пачки и текста остаются динамическими.
+        dummy = torch.ones((1, 8), dtype=torch.int64)
+        torch.onnx.export(
+            model,
+            (dummy, dummy),
+            str(path / "model.onnx"),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(path / "model.onnx", path / "model.int8.onnx", weight_type=QuantType.QInt8)
+
+    def encode(self, input_ids, attention_mask):
+        (last_hidden_state,) = self.session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids.astype(np.int64), "attention_mask": attention_mask.astype(np.int64)},
+        )
+        embeddings = last_hidden_state[:, 0, :]
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+
+
+def create_encoder(backend: str | None = None) -> Encoder:
+    """Создает прогон модели по настройке `backend`: `torch` или `onnx`."""
+    backend = backend or settings.backend
+    if backend == "onnx":
+        return OnnxEncoder(settings.model_name, settings.onnx_path, settings.onnx_quantize)
+    if backend == "torch":
+        return TorchEncoder(settings.model_name, settings.use_cuda)
+    raise ValueError(f"Неизвестный backend векторизатора: {backend}")
@@ -0,0 +1,72 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .deco import singleton
+from .settings import settings
+from .vectorizer import Vectorizer
+
+
+@singleton
+class MicroBatcher:
+    """
+    Собирает тексты из одновременных запросов в общие пачки для модели.
+
+    После первого текста ждет остальные не дольше `settings.batch_wait_ms` миллисекунд
+    или пока не наберется `settings.batch_max_texts` текстов, затем векторизует их одним вызовом
+    `Vectorizer.vectorize_many` и раздает результаты ожидающим запросам.
+    Если пачка не векторизовалась, то тексты векторизуются по одному, и ошибку получают
+    только запросы с проблемными текстами. Модель вызывается только из одного рабочего потока.
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue[tuple[str, Future]] = queue.Queue()
+        self._vectorizer = Vectorizer()
+        threading.Thread(target=self._run, name="vectorizer-batcher", daemon=True).start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def vectorize_many(self, texts: list[str]) -> list[np.ndarray]:
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def vectorize(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def _collect(self) -> list[tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + settings.batch_wait_ms / 1000
+        while len(batch) < settings.batch_max_texts:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                vectors = self._vectorizer.vectorize_many([text for text, _ in batch])
+            except Exception as exc:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(exc)
+                else:
+                    self._run_each(batch)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def _run_each(self, batch: list[tuple[str, Future]]) -> None:
+        for text, future in batch:
+            try:
+                future.set_result(self._vectorizer.vectorize(text))
+            except Exception as exc:
+                future.set_exception(exc)
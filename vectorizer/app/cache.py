@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Кэш векторов текстов по хэшу `(модель, нормализованный текст)`.
+
+    Первый уровень - LRU в памяти на `max_size` векторов.
+    Второй уровень (если указан `path`) - кольцевой буфер на диске на `disk_size` векторов,
+    открытый через `np.memmap`, поэтому он переживает перезапуск сервиса.
+    Измененные страницы буфера сбрасываются на диск в фоне раз в `flush_interval` секунд
+    и при закрытии кэша, а не после каждой записи.
+    """
+
+    _digest_size = 20
+
+    def __init__(
+        self,
+        model_name: str,
+        dims: int,
+        max_size: int = 10_000,
+        path: Path | str | None = None,
+        disk_size: int = 0,
+        flush_interval: float = 5,
+    ):
+        self._model_name = model_name
+        self._dims = dims
+        self._max_size = max_size
+        self._memory: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._disk_rows: dict[bytes, int] = {}
+        self._vectors: np.memmap | None = None
+        self._dirty = False
+        self._closed = threading.Event()
+        if path and disk_size:
+            self._open(Path(path), disk_size)
+            if flush_interval:
+                threading.Thread(
+                    target=self._flush_periodically,
+                    args=(flush_interval,),
+                    name="embedding-cache",
+                    daemon=True,
+                ).start()
+
+    def _open(self, path: Path, disk_size: int) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        meta = {"model": self._model_name, "dims": self._dims, "size": disk_size}
+        meta_path = path / "meta.json"
+        exists = meta_path.exists() and json.loads(meta_path.read_text()) == meta
+        mode = "r+" if exists else "w+"
+
+        self._vectors = np.memmap(path / "vectors.f32", np.float32, mode, shape=(disk_size, self._dims))
+        self._keys = np.memmap(path / "keys.bin", np.uint8, mode, shape=(disk_size, self._digest_size))
+        # Номер следующей строки кольцевого буфера.
+        self._position = np.memmap(path / "position.i64", np.int64, mode, shape=(1,))
+        if not exists:
+            # Другая модель или размер - старые векторы не подходят.
+            meta_path.write_text(json.dumps(meta))
+            return
+
+        empty = bytes(self._digest_size)
+        for row, key in enumerate(self._keys):
+            key = key.tobytes()
+            if key != empty:
+                self._disk_rows[key] = row
+
+    def make_key(self, text: str) -> bytes:
+        normalized = " ".join(text.split())
+        return hashlib.sha1(f"{self._model_name}\0{normalized}".encode()).digest()
+
+    def get(self, text: str) -> np.ndarray | None:
+        key = self.make_key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return vector
+
+            row = self._disk_rows.get(key)
+            if row is not None:
+                vector = np.array(self._vectors[row])
+                self._remember(key, vector)
+                self.stats["disk_hits"] += 1
+                return vector
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, text: str, vector: np.ndarray) -> None:
+        key = self.make_key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._vectors is None or key in self._disk_rows:
+                return
+
+            row = int(self._position[0])
+            old_key = self._keys[row].tobytes()
+            self._disk_rows.pop(old_key, None)
+            # Ключ записывается после вектора, чтобы после сбоя не прочитать неполный вектор.
+            self._keys[row] = 0
+            self._vectors[row] = vector
+            self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+            self._position[0] = (row + 1) % len(self._keys)
+            self._disk_rows[key] = row
+            self._dirty = True
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_size:
+            self._memory.popitem(last=False)
+
+    def flush(self) -> None:
+        """Сбрасывает на диск измененные страницы кольцевого буфера."""
+        if self._vectors is not None:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._vectors.flush()
+                self._keys.flush()
+                self._position.flush()
+                self._dirty = False
+
+    def _flush_periodically(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Останавливает фоновый сброс и сбрасывает на диск последние изменения."""
+        self._closed.set()
+        self.flush()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "memory_size": len(self._memory), "disk_size": len(self._disk_rows)}
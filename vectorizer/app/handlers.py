@@ -1,15 +1,41 @@
-from fastapi import APIRouter
+import logging
 
-from .schema import TokenizerRequest, TokenizerResponse
+from fastapi import APIRouter, Header, Response
+
+from .batcher import MicroBatcher
+from .schema import BatchTokenizerRequest, BatchTokenizerResponse, TokenizerRequest, TokenizerResponse
 from .vectorizer import Vectorizer
+from .wire import choose_media_type, encode_vectors
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
 @router.post("/vectorize", response_model=TokenizerResponse)
-def vectorize(data: TokenizerRequest):
-    vectorizer = Vectorizer()
-    print("Text: ", data.text[:50])
-    vector = vectorizer.vectorize(data.text)
-    print("Vector: ", vector[:10])
-    return {"vector": vector}
+def vectorize(data: TokenizerRequest, accept: str | None = Header(None)):
+    logger.debug("Text: %s", data.text[:50])
+    vector = MicroBatcher().vectorize(data.text)
+    media_type = choose_media_type(accept)
+    if media_type:
+        return Response(encode_vectors([vector], media_type), media_type=media_type)
+    return {"vector": vector.tolist()}
+
+
+@router.post("/vectorize/batch", response_model=BatchTokenizerResponse)
+def vectorize_batch(data: BatchTokenizerRequest, accept: str | None = Header(None)):
+    """
+    В бинарном формате векторы идут подряд, без разделителей, их кол-во равно кол-ву текстов запроса
+    (см. `app.wire`).
+    """
+    logger.debug("Texts: %s", len(data.texts))
+    vectors = MicroBatcher().vectorize_many(data.texts)
+    media_type = choose_media_type(accept)
+    if media_type:
+        return Response(encode_vectors(vectors, media_type), media_type=media_type)
+    return {"vectors": [vector.tolist() for vector in vectors]}
+
+
+@router.get("/stats")
+def stats():
+    return {"cache": Vectorizer().cache.get_stats()}
@@ -7,3 +7,11 @@ class TokenizerRequest(BaseModel):
 
 class TokenizerResponse(BaseModel):
     vector: list[float]
+
+
+class BatchTokenizerRequest(BaseModel):
+    texts: list[str]
+
+
+class BatchTokenizerResponse(BaseModel):
+    vectors: list[list[float]]
@@ -5,6 +5,26 @@ class _Settings(BaseSettings):
     model_name: str = "cointegrated/rubert-tiny"
     tokenizer_name: str = "cointegrated/rubert-tiny"
     use_cuda: bool = False
+    # Прогон модели: `torch` или `onnx` (ONNX Runtime на CPU).
+    backend: str = "torch"
+    # Папка для экспортированной ONNX модели.
+    onnx_path: str = "onnx_model"
+    # Квантовать веса ONNX модели в int8.
+    onnx_quantize: bool = True
+    # Кол-во векторов в кэше в памяти.
+    embedding_cache_size: int = 10_000
+    # Папка кэша векторов на диске, пустая строка - без кэша на диске.
+    embedding_cache_path: str = ""
+    # Кол-во векторов в кэше на диске.
+    embedding_cache_disk_size: int = 200_000
+    # Раз в сколько секунд кэш на диске сбрасывается из памяти, остальное сбрасывается при остановке.
+    embedding_cache_flush_interval: float = 5
+    # Максимальное кол-во частей текстов в одном проходе модели.
+    batch_size: int = 32
+    # Максимальное кол-во текстов из одновременных запросов, которые собираются в одну пачку.
+    batch_max_texts: int = 64
+    # Сколько ждать другие запросы, чтобы векторизовать их одной пачкой.
+    batch_wait_ms: float = 5
 
 
 settings = _Settings()
@@ -1,7 +1,8 @@
 import numpy as np
-import torch
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoConfig, AutoTokenizer
 
+from .backends import create_encoder
+from .cache import EmbeddingCache
 from .deco import singleton
 from .settings import settings
 
@@ -9,40 +10,80 @@ from .settings import settings
 @singleton
 class Vectorizer:
 
-    def __init__(self, use_cuda: bool = False):
+    def __init__(self, backend: str | None = None):
         self.tokenizer = AutoTokenizer.from_pretrained(settings.tokenizer_name)
-        self.model = AutoModel.from_pretrained(settings.model_name)
-        self.max_length = self.model.config.max_position_embeddings - 2
-        if use_cuda:
-            # if you have a GPU
-            self.model.cuda()
-
-    def _vectorize_chunk(self, text: str) -> np.ndarray:
-        tokens = self.tokenizer(
-            text, padding=True, truncation=True, return_tensors="pt", max_length=self.max_length
+        self.config = AutoConfig.from_pretrained(settings.model_name)
+        self.max_length = self.config.max_position_embeddings - 2
+        self.encoder = create_encoder(backend)
+        # Векторы ONNX и PyTorch немного отличаются, поэтому у каждого backend свои записи.
+        self.cache = EmbeddingCache(
+            f"{settings.model_name}/{backend or settings.backend}",
+            self.config.hidden_size,
+            max_size=settings.embedding_cache_size,
+            path=settings.embedding_cache_path or None,
+            disk_size=settings.embedding_cache_disk_size,
+            flush_interval=settings.embedding_cache_flush_interval,
         )
-        with torch.no_grad():
-            model_output = self.model(**{k_: v_.to(self.model.device) for k_, v_ in tokens.items()})
-        embeddings = model_output.last_hidden_state[:, 0, :]
-        embeddings = torch.nn.functional.normalize(embeddings)
-        return embeddings[0].cpu().numpy()
+
+    def _vectorize_chunks(self, chunks: list[list[int]]) -> np.ndarray:
+        """
+        Векторизует части текстов одним проходом модели.
+
+        :param chunks: Идентификаторы токенов частей без служебных токенов.
+        :return: Матрица нормализованных векторов частей.
+        """
+        tokens = self.tokenizer.pad(
+            {"input_ids": [self.tokenizer.build_inputs_with_special_tokens(chunk) for chunk in chunks]},
+            padding=True,
+            return_tensors="np",
+        )
+        return self.encoder.encode(tokens["input_ids"], tokens["attention_mask"])
+
+    def _split(self, text: str) -> list[list[int]]:
+        """Токенизирует текст один раз и делит идентификаторы токенов на части по `max_length`."""
+        input_ids = self.tokenizer(text, add_special_tokens=False, return_attention_mask=False)["input_ids"]
+        return [input_ids[i : i + self.max_length] for i in range(0, len(input_ids), self.max_length)] or [[]]
+
+    def _count_words(self, chunk: list[int]) -> int:
+        # Продолжения слов в WordPiece начинаются с "##".
+        return sum(not token.startswith("##") for token in self.tokenizer.convert_ids_to_tokens(chunk))
+
+    def vectorize_many(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        Векторизует несколько текстов, уже векторизованные ранее тексты берутся из кэша.
+        Части остальных текстов отправляются в модель пачками по `settings.batch_size`.
+        """
+        vectors = [self.cache.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, self._vectorize_many([texts[i] for i in missing])):
+                self.cache.set(texts[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def _vectorize_many(self, texts: list[str]) -> list[np.ndarray]:
+        chunks: list[list[int]] = []
+        owners: list[int] = []
+        for i, text in enumerate(texts):
+            parts = self._split(text)
+            chunks.extend(parts)
+            owners.extend([i] * len(parts))
+
+        # Части похожей длины в одной пачке - меньше лишних токенов дополнения.
+        order = np.argsort([len(chunk) for chunk in chunks], kind="stable")
+        chunk_vectors = np.empty((len(chunks), self.config.hidden_size), dtype=np.float32)
+        for start in range(0, len(order), settings.batch_size):
+            batch = order[start : start + settings.batch_size]
+            chunk_vectors[batch] = self._vectorize_chunks([chunks[i] for i in batch])
+
+        # Взвешенное усреднение, вес пропорционален количеству слов в части
+        owners_array = np.asarray(owners)
+        weights = np.array([max(self._count_words(chunk), 1) for chunk in chunks], dtype=np.float32)
+        sums = np.zeros((len(texts), chunk_vectors.shape[1]), dtype=np.float32)
+        np.add.at(sums, owners_array, chunk_vectors * weights[:, None])
+        # `np.bincount` всегда возвращает float64, без приведения векторы в кэше и ответе были бы вдвое больше.
+        totals = np.bincount(owners_array, weights=weights, minlength=len(texts)).astype(np.float32)
+        return list(sums / totals[:, None])
 
     def vectorize(self, text: str) -> np.ndarray:
-        tokens = self.tokenizer.tokenize(text)
-        chunks = [
-            self.tokenizer.convert_tokens_to_string(tokens[i : i + self.max_length])
-            for i in range(0, len(tokens), self.max_length)
-        ]
-
-        vectors = []
-        weights = []
-        for chunk in chunks:
-            vector = self._vectorize_chunk(chunk)
-            weight = len(chunk.split())  # Вес пропорционален количеству слов в части
-            vectors.append(vector)
-            weights.append(weight)
-
-        # Взвешенное усреднение
-        weights = np.array(weights) / np.sum(weights)
-        weighted_vectors = np.average(vectors, axis=0, weights=weights)
-        return weighted_vectors
+        return self.vectorize_many([text])[0]
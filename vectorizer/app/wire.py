@@ -0,0 +1,43 @@
+"""
+Бинарный формат ответов с векторами.
+
+Тело ответа - только байты матрицы `(кол-во векторов, размерность)` подряд, без заголовков и разделителей,
+тип значений задает `Content-Type` (`application/x-float32` или `application/x-float16`, little-endian).
+Кол-во векторов клиент знает из своего запроса (один для `/vectorize`, по одному на текст для
+`/vectorize/batch`), поэтому размерность - это длина тела, деленная на кол-во и размер значения.
+
+Вместо msgpack выбран именно такой формат: он получается и разбирается одним `tobytes`/`np.frombuffer`
+без копирования чисел по одному, не требует дополнительной зависимости ни у сервиса, ни у клиента,
+а msgpack с векторами как массивами чисел был бы больше и медленнее, а как bin - тем же набором байтов
+с лишней оберткой.
+"""
+
+import numpy as np
+
+# Типы данных векторов в бинарном формате ответа, байты всегда little-endian.
+BINARY_MEDIA_TYPES = {
+    "application/x-float32": np.dtype("<f4"),
+    "application/x-float16": np.dtype("<f2"),
+}
+
+
+def choose_media_type(accept: str | None) -> str | None:
+    """
+    Возвращает первый бинарный формат из заголовка `Accept` либо `None`, тогда ответ будет в JSON.
+    Параметры вида `;q=0.5` не учитываются, клиент перечисляет форматы в порядке предпочтения.
+    """
+    for item in (accept or "").split(","):
+        media_type = item.split(";")[0].strip().lower()
+        if media_type in BINARY_MEDIA_TYPES:
+            return media_type
+        if media_type == "application/json":
+            return None
+    return None
+
+
+def encode_vectors(vectors: list[np.ndarray], media_type: str) -> bytes:
+    """
+    Склеивает векторы в одну матрицу `(кол-во, размерность)` и возвращает её байты в порядке строк.
+    Формат описан в документации модуля.
+    """
+    return np.asarray(vectors, dtype=BINARY_MEDIA_TYPES[media_type]).tobytes()
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from app.handlers import router
@@ -8,7 +10,15 @@ print(f"Start load model: {settings.model_name}")
 Vectorizer()
 print("Model has been loaded")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    yield
+    # Векторы, записанные после последнего фонового сброса кэша на диск.
+    Vectorizer().cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router, prefix="/api/v1")
 
 
@@ -0,0 +1,37 @@
+import importlib.util
+import unittest
+from unittest import mock
+
+import numpy as np
+
+_has_deps = all(importlib.util.find_spec(name) for name in ["transformers", "pydantic_settings"])
+
+
+class FakeVectorizer:
+    """Не векторизует тексты со словом `bad`, в том числе всю пачку с таким текстом."""
+
+    def vectorize(self, text: str) -> np.ndarray:
+        if "bad" in text:
+            raise ValueError(text)
+        return np.full(2, len(text), dtype=np.float32)
+
+    def vectorize_many(self, texts: list[str]) -> list[np.ndarray]:
+        return [self.vectorize(text) for text in texts]
+
+
+@unittest.skipUnless(_has_deps, "Нужны transformers и pydantic_settings")
+class TestMicroBatcher(unittest.TestCase):
+    def setUp(self):
+        from app.batcher import MicroBatcher
+
+        with mock.patch("app.batcher.Vectorizer", FakeVectorizer):
+            # `MicroBatcher` - синглтон, поэтому создаем экземпляр исходного класса.
+            self.batcher = MicroBatcher.__wrapped__()
+
+    def test_error_only_for_failed_text(self):
+        futures = [self.batcher.submit(text) for text in ["ok", "bad", "good"]]
+
+        np.testing.assert_array_equal(futures[0].result(timeout=1), np.full(2, 2))
+        with self.assertRaises(ValueError):
+            futures[1].result(timeout=1)
+        np.testing.assert_array_equal(futures[2].result(timeout=1), np.full(2, 4))
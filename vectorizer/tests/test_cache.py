@@ -0,0 +1,53 @@
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.cache import EmbeddingCache
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_memory_lru(self):
+        cache = EmbeddingCache("model", 3, max_size=2)
+        cache.set("a", np.ones(3))
+        cache.set("b", np.ones(3) * 2)
+        self.assertIsNotNone(cache.get("a"))
+        cache.set("c", np.ones(3) * 3)
+
+        self.assertIsNone(cache.get("b"))
+        np.testing.assert_array_equal(cache.get("  a \n"), np.ones(3))
+        self.assertEqual(cache.get_stats()["memory_hits"], 2)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_disk_survives_restart(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = EmbeddingCache("model", 3, max_size=10, path=path, disk_size=2)
+            for i, text in enumerate(["a", "b", "c"]):
+                cache.set(text, np.full(3, i, dtype=np.float32))
+            cache.flush()
+
+            restarted = EmbeddingCache("model", 3, max_size=10, path=path, disk_size=2)
+            # Кольцевой буфер на 2 вектора, первый уже перезаписан.
+            self.assertIsNone(restarted.get("a"))
+            np.testing.assert_array_equal(restarted.get("c"), np.full(3, 2))
+            self.assertEqual(restarted.get_stats()["disk_hits"], 1)
+
+            other_model = EmbeddingCache("other", 3, path=path, disk_size=2)
+            self.assertIsNone(other_model.get("c"))
+
+    def test_flush_in_background(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = EmbeddingCache("model", 3, path=path, disk_size=2, flush_interval=0.01)
+            with mock.patch.object(cache._vectors, "flush") as flush:
+                cache.set("a", np.ones(3))
+                deadline = time.monotonic() + 1
+                while cache._dirty and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                flush.assert_called_once()
+
+                # Без новых векторов сбрасывать нечего.
+                time.sleep(0.05)
+                cache.close()
+                flush.assert_called_once()
@@ -0,0 +1,36 @@
+import importlib.util
+import unittest
+
+import numpy as np
+
+_has_deps = all(importlib.util.find_spec(name) for name in ["torch", "transformers", "onnxruntime", "onnx"])
+
+
+@unittest.skipUnless(_has_deps, "Нужны torch, transformers и onnxruntime")
+class TestOnnxBackend(unittest.TestCase):
+    """Векторы ONNX модели (в том числе квантованной) должны почти совпадать с векторами PyTorch."""
+
+    # Минимальная косинусная близость векторов одного текста.
+    tolerance = 0.98
+
+    texts = [
+        "Как настроить резервное копирование базы данных",
+        "Коммутатор не видит VLAN после обновления прошивки. " * 60,
+        "ok",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        from app.vectorizer import Vectorizer
+
+        # `Vectorizer` - синглтон, поэтому создаем экземпляры исходного класса.
+        cls.torch_vectors = Vectorizer.__wrapped__("torch").vectorize_many(cls.texts)
+        cls.onnx_vectors = Vectorizer.__wrapped__("onnx").vectorize_many(cls.texts)
+
+    def test_cosine_similarity(self):
+        for text, torch_vector, onnx_vector in zip(self.texts, self.torch_vectors, self.onnx_vectors):
+            with self.subTest(text=text[:30]):
+                similarity = np.dot(torch_vector, onnx_vector) / (
+                    np.linalg.norm(torch_vector) * np.linalg.norm(onnx_vector)
+                )
+                self.assertGreaterEqual(similarity, self.tolerance)
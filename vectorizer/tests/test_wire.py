@@ -0,0 +1,21 @@
+import unittest
+
+import numpy as np
+
+from app.wire import choose_media_type, encode_vectors
+
+
+class TestWire(unittest.TestCase):
+    def test_choose_media_type(self):
+        self.assertEqual(
+            "application/x-float16", choose_media_type("application/x-float16, application/json")
+        )
+        self.assertIsNone(choose_media_type("application/json, application/x-float32"))
+        self.assertIsNone(choose_media_type("*/*"))
+        self.assertIsNone(choose_media_type(None))
+
+    def test_encode_vectors(self):
+        vectors = [np.array([1.0, -2.0]), np.array([0.5, 3.0])]
+        data = encode_vectors(vectors, "application/x-float32")
+        self.assertEqual(16, len(data))
+        np.testing.assert_array_equal(np.frombuffer(data, "<f4").reshape(2, 2), vectors)